@@ -46,6 +46,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so that its total covers the other middleware as well
+    'LittleLemonAPI.instrumentation.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -83,9 +85,37 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections open between requests (checked before reuse)
+        # instead of reconnecting and rerunning the pragmas every time
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        # A file rather than the in-memory default, so that concurrency tests
+        # get real SQLite locking between threads
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Applied to every new SQLite connection (see LittleLemonAPI/database.py).
+# WAL lets readers carry on while a write is in progress, and with it
+# synchronous=NORMAL only syncs at checkpoints. Writers wait up to
+# busy_timeout ms for the lock. mmap_size is in bytes, a negative cache_size
+# in KiB.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -32000,
+}
+
+# Transactions on SQLite start with BEGIN <mode> (see LittleLemonAPI/database.py).
+# IMMEDIATE takes the write lock up front: a deferred transaction that reads
+# first and then writes cannot wait for the lock and fails with "database is
+# locked" when another writer holds it.
+SQLITE_TRANSACTION_MODE = 'IMMEDIATE'
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
@@ -122,6 +152,19 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/5.0/howto/static-files/
 
 STATIC_URL = 'static/'
+# collectstatic writes content-hashed, gzipped and downscaled copies of the
+# static files here (see restaurant/storage.py)
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    'staticfiles': {'BACKEND': 'restaurant.storage.OptimizedStaticFilesStorage'},
+}
+# Widths of the downscaled copies of each JPEG, used in srcset (needs Pillow)
+RESPONSIVE_IMAGE_WIDTHS = [480, 960, 1440]
+# Serve STATIC_ROOT from Django, with far-future caching of hashed names,
+# when no web server does it. With DEBUG on, runserver serves the app
+# directories instead.
+SERVE_STATIC = not DEBUG
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
@@ -132,7 +175,7 @@ REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': (
         'rest_framework.renderers.JSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
-        'rest_framework_xml.renderers.XMLRenderer',
+        'LittleLemonAPI.renderers.StreamingXMLRenderer',
     ),
     'DEFAULT_PARSER_CLASSES':(
         'rest_framework.parsers.JSONParser',
@@ -141,7 +184,7 @@ REST_FRAMEWORK = {
         'rest_framework_xml.parsers.XMLParser',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'LittleLemonAPI.authentication.CachedTokenAuthentication',
         # 'rest_framework.authentication.SessionAuthentication',
         # 'rest_framework.authentication.BasicAuthentication',
     ),
@@ -156,15 +199,42 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination', # ?page=3&page_size=5
     'PAGE_SIZE': 5,
     'DEFAULT_THROTTLE_CLASSES': (
-        'rest_framework.throttling.AnonRateThrottle',
-        'rest_framework.throttling.UserRateThrottle',
+        'LittleLemonAPI.throttling.SharedRateThrottle',
     ),
     'DEFAULT_THROTTLE_RATES': {
         'anon': '10/minute',
         'user': '25/minute',
+        # Views with a throttle_scope use that budget instead
+        'menu': '60/minute',
+        'checkout': '5/minute',
     },
 }
 
+# Token buckets for the API rate limits, shared by all worker processes
+THROTTLE_DATABASE = BASE_DIR / 'throttle.sqlite3'
+# Turn off to load test a server (manage.py loadtest --server)
+THROTTLE_ENABLED = True
+
+# Reservation slots (hour of the day) and the number of covers each can seat
+BOOKING_SLOT_COVERS = {hour: 40 for hour in range(14, 23)}
+
+# Server-Timing header, N+1 query warnings and per-view query budgets (see
+# LittleLemonAPI/instrumentation.py). When off, the middleware is not loaded.
+PERFORMANCE_INSTRUMENTATION = DEBUG
+# What a view running more queries than its query_budget gets: 'log' or 'raise'
+QUERY_BUDGET_ACTION = 'log'
+
+# Run checkout, cart and booking writes on one writer thread per database,
+# committing the ones that queue up together (see LittleLemonAPI/writer.py).
+# Requests wait up to WRITE_QUEUE_TIMEOUT seconds before giving up with 503.
+WRITE_QUEUE = False
+WRITE_QUEUE_TIMEOUT = 10
+WRITE_QUEUE_BATCH = 32
+
+# Serve GET/HEAD on the menu, category and order detail endpoints from the
+# async views in LittleLemonAPI/async_views.py (worth it under ASGI only)
+ASYNC_READ_VIEWS = False
+
 DJOSER = {
     'USER_ID_FIELD': 'username'
 }
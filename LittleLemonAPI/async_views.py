@@ -0,0 +1,110 @@
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.shortcuts import aget_object_or_404
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.response import Response
+from . import catalogue
+from .mixins import ValuesProjectionMixin
+from .models import OrderItem
+from .paginators import AsyncPageNumberPagination
+from .roles import aget_roles, is_customer
+from .serializers import OrderItemSerializer
+from .views import CategoriesView, MenuItemsView, SingleMenuItemView, SingeOrderView
+
+
+class AsyncAPIViewMixin:
+    # Native async dispatch for the read-only (GET/HEAD) side of a DRF view.
+    # Authentication, permissions and throttling still run through the view's
+    # own (sync) checks, in a thread; the handlers use the async ORM.
+    http_method_names = ['get', 'head']
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            response = handler(request, *args, **kwargs)
+            if iscoroutinefunction(handler):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+class AsyncListMixin(ValuesProjectionMixin, AsyncAPIViewMixin):
+    async def get(self, request, *args, **kwargs):
+        # Filter backends only build the queryset, but the full-text filter
+        # may look the index up once, so they run in a thread too
+        queryset = await sync_to_async(self.filter_queryset)(self.get_queryset())
+        projection = self.get_projection()
+        if projection is not None:
+            page = await self.paginator.apaginate_queryset(self.project(projection, queryset), request, view=self)
+            return self.get_projected_response(projection, page, paginated=True)
+        page = await self.paginator.apaginate_queryset(queryset, request, view=self)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+
+class AsyncCatalogueListMixin(AsyncListMixin):
+    # Same catalogue cache and ETags as the sync list views. The cache and
+    # the stats counters are sync APIs, and rendering a response to cache it
+    # is CPU work, so both run in a thread, off the event loop.
+    async def get(self, request, *args, **kwargs):
+        version = await sync_to_async(catalogue.get_version)()
+        if request.accepted_renderer.format == 'api' or version is None:
+            return await super().get(request, *args, **kwargs)
+        key = catalogue.cache_key(request, version)
+        response = await sync_to_async(self.get_cached_response)(request, key)
+        if response is None:
+            response = await sync_to_async(self.cache_response)(await super().get(request, *args, **kwargs), key)
+        return response
+
+
+class AsyncRetrieveMixin(AsyncAPIViewMixin):
+    async def get(self, request, *args, **kwargs):
+        queryset = await sync_to_async(self.filter_queryset)(self.get_queryset())
+        instance = await aget_object_or_404(queryset, **{self.lookup_field: kwargs[self.lookup_url_kwarg or self.lookup_field]})
+        self.check_object_permissions(request, instance)
+        return Response(self.get_serializer(instance).data)
+
+
+class AsyncCategoriesView(AsyncCatalogueListMixin, CategoriesView):
+    pagination_class = AsyncPageNumberPagination
+
+
+class AsyncMenuItemsView(AsyncCatalogueListMixin, MenuItemsView):
+    pass
+
+
+class AsyncSingleMenuItemView(AsyncRetrieveMixin, SingleMenuItemView):
+    pass
+
+
+class AsyncSingleOrderView(AsyncAPIViewMixin, SingeOrderView):
+    async def get(self, request, *args, **kwargs):
+        # Resolving the roles first lets get_queryset() run without a query
+        await aget_roles(request.user)
+        order = await aget_object_or_404(self.get_queryset(), pk=kwargs['pk'])
+
+        # check if the order belongs to the current user (for customers)
+        if is_customer(request.user) and order.user_id != request.user.id:
+            return Response({'detail': "Permission denied. This order does not belong to the current user"}, status=status.HTTP_403_FORBIDDEN)
+
+        order_items = [item async for item in OrderItem.objects.filter(order=order)]
+        serialized_order_items = OrderItemSerializer(order_items, many=True)
+        return Response(serialized_order_items.data)
+
+
+def read_async(sync_view, async_view):
+    # Sends GET/HEAD to the async view and every other method to the sync one
+    async def view(request, *args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            return await async_view(request, *args, **kwargs)
+        return await sync_to_async(sync_view)(request, *args, **kwargs)
+    return csrf_exempt(view)
@@ -0,0 +1,234 @@
+import logging
+import re
+import warnings
+from contextlib import contextmanager
+from django.apps import apps
+from django.core.paginator import UnorderedObjectListWarning
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, get_resolver
+from . import throttling
+from .authentication import token_cache
+
+# URL configurations whose routes are audited
+AUDITED_URLCONFS = ('LittleLemonAPI.urls', 'restaurant.urls')
+
+# Extra query strings requested on top of the bare URL, for the filters and
+# orderings the clients use
+QUERY_VARIANTS = {
+    'MenuItemsView': ['?ordering=price', '?ordering=-price&page=2', '?search=dish'],
+    'OrdersView': ['?ordering=-date', '?ordering=total&page=2', '?search=seed'],
+    'OrderExportView': ['?format=csv', '?status=0&date_from={date}'],
+    'MenuItemSalesReportView': ['?ordering=units&limit=50'],
+    'BookingsView': ['?date={date}'],
+    'BookingAvailabilityView': ['?date={date}'],
+    'reservations': ['?date={date}'],
+}
+
+ROLES = ('anonymous', 'customer', 'delivery crew', 'manager')
+
+PLAN_FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+PLAN_TEMP_BTREE = re.compile(r'USE TEMP B-TREE FOR (.+)')
+
+
+def get_routes():
+    # (path template, route name) of every route in the audited URL confs
+    routes = []
+    for resolver in get_resolver().url_patterns:
+        # include() has already imported the URL conf module
+        if isinstance(resolver, URLResolver) and getattr(resolver.urlconf_name, '__name__', None) in AUDITED_URLCONFS:
+            prefix = '/' + str(resolver.pattern)
+            for pattern in resolver.url_patterns:
+                routes.append((prefix + str(pattern.pattern), pattern.name))
+    return list(dict.fromkeys(routes))
+
+
+def sample_path(template, name, fixtures):
+    # Fills the <int:pk> of a route with a row the fixtures say exists
+    if name == 'SingleOrderView':
+        pk = fixtures['order'].pk
+    elif name == 'SingleManagerUserView':
+        pk = fixtures['users']['manager'].pk
+    elif name == 'SingleDeliveryCrewUserView':
+        pk = fixtures['users']['delivery crew'].pk
+    else:
+        pk = fixtures['menuitem'].pk
+    return re.sub(r'<(?:\w+:)?\w+>', str(pk), template)
+
+
+def normalize(sql):
+    # The statement with its literals taken out, to group repeated queries
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(\.\d+)?\b', '?', sql)
+    return re.sub(r'\((\?, )+\?\)', '(?)', sql)
+
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        return [row[3] for row in cursor.fetchall()]
+
+
+def find_problems(plan):
+    problems = []
+    for detail in plan:
+        if match := PLAN_FULL_SCAN.match(detail):
+            problems.append(('full scan', match.group(1)))
+        elif match := PLAN_TEMP_BTREE.search(detail):
+            problems.append((f'temp b-tree for {match.group(1).lower()}', None))
+    return problems
+
+
+@contextmanager
+def quiet_requests():
+    # The 401s, 403s and 404s of roles without access are expected, and so
+    # are the unordered list warnings, which the plans already show
+    logger = logging.getLogger('django.request')
+    level = logger.level
+    logger.setLevel(logging.ERROR)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UnorderedObjectListWarning)
+            yield
+    finally:
+        logger.setLevel(level)
+
+
+def audit_urls(fixtures):
+    # GETs every audited route (and its query variants) as each role and
+    # explains every distinct SELECT the requests ran. Caches and throttling
+    # are switched off so that every request reaches the database.
+    # Returns the requests and the statements.
+    client = Client()
+    requests = []
+    statements = {}
+    with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}), quiet_requests():
+        for template, name in get_routes():
+            path = sample_path(template, name, fixtures)
+            for variant in [''] + QUERY_VARIANTS.get(name, []):
+                url = path + variant.format(date=fixtures['date'].isoformat())
+                for role in ROLES:
+                    headers = {}
+                    if role != 'anonymous':
+                        headers['HTTP_AUTHORIZATION'] = f'Token {fixtures["users"][role].auth_token.key}'
+                    throttling.reset()
+                    token_cache.clear()
+                    with CaptureQueriesContext(connection) as context:
+                        response = client.get(url, **headers)
+                        if response.streaming:
+                            b''.join(response.streaming_content)
+                    requests.append({'url': url, 'role': role, 'status': response.status_code, 'queries': len(context.captured_queries)})
+                    for query in context.captured_queries:
+                        sql = query['sql']
+                        # Django's own introspection of sqlite_master is left out
+                        if not sql.lstrip().upper().startswith(('SELECT', 'WITH')) or 'sqlite_master' in sql:
+                            continue
+                        statement = statements.setdefault(normalize(sql), {'sql': sql, 'urls': set(), 'count': 0})
+                        statement['urls'].add(url)
+                        statement['count'] += 1
+    for statement in statements.values():
+        statement['plan'] = explain(statement['sql'])
+        statement['problems'] = find_problems(statement['plan'])
+    return requests, list(statements.values())
+
+
+def get_table_models():
+    return {model._meta.db_table: model for model in apps.get_app_config('LittleLemonAPI').get_models()}
+
+
+def existing_indexes(model):
+    # Field lists already indexed, leading columns first
+    indexed = [list(index.fields) for index in model._meta.indexes]
+    indexed += [list(fields) for fields in model._meta.unique_together]
+    indexed += [[field.name] for field in model._meta.concrete_fields if field.db_index or field.unique or field.primary_key]
+    return [[name.lstrip('-') for name in fields] for fields in indexed]
+
+
+def order_by_terms(sql):
+    # (expression, descending) of the ORDER BY clause, with the positional
+    # references that values() queries use resolved against the select list
+    select = re.search(r'^\s*SELECT (.*?) FROM ', sql, re.S)
+    items = re.split(r',\s+(?=")', select.group(1)) if select else []
+    order_by = re.search(r' ORDER BY (.*?)(?: LIMIT |$)', sql, re.S)
+    terms = []
+    for term in re.split(r',\s+', order_by.group(1)) if order_by else []:
+        term, descending = re.subn(r'\s+DESC$', '', term.strip())
+        term = re.sub(r'\s+ASC$', '', term)
+        if term.isdigit() and 0 < int(term) <= len(items):
+            term = items[int(term) - 1]
+        terms.append((term, bool(descending)))
+    return terms
+
+
+def suggest_index(statement, models):
+    # A composite index for a flagged statement on one of our tables: the
+    # columns compared for equality in the WHERE clause, then the ORDER BY
+    # columns. None when there is nothing better to suggest.
+    sql = statement['sql']
+    tables = [table for problem, table in statement['problems'] if table] or re.findall(r'\bFROM "(\w+)"', sql)[:1]
+    for table in tables:
+        model = models.get(table)
+        if model is None:
+            continue
+        fields = {field.column: field.name for field in model._meta.concrete_fields}
+        where = re.search(r' WHERE (.*?)(?: GROUP BY | ORDER BY | LIMIT |$)', sql, re.S)
+        columns = []
+        if where:
+            columns += re.findall(rf'"{table}"\."(\w+)" (?:= |IN \(|IS NULL)', where.group(1))
+        terms = order_by_terms(sql)
+        # SQLite walks an index backwards just as well, so the direction only
+        # matters when the terms are mixed
+        mixed = len({descending for _, descending in terms}) > 1
+        for term, descending in terms:
+            column = re.match(rf'"{table}"\."(\w+)"', term)
+            if column:
+                columns.append(('-' if descending and mixed else '') + column.group(1))
+        index = []
+        for column in columns:
+            name = fields.get(column.lstrip('-'))
+            if name and name not in (field.lstrip('-') for field in index) and name != 'id':
+                index.append(('-' if column.startswith('-') else '') + name)
+        if len(index) < 2 or [field.lstrip('-') for field in index] in existing_indexes(model):
+            continue
+        return model, index
+    return None
+
+
+def suggest_indexes(statements):
+    models = get_table_models()
+    suggestions = {}
+    for statement in statements:
+        if statement['problems']:
+            suggestion = suggest_index(statement, models)
+            if suggestion:
+                model, fields = suggestion
+                suggestions.setdefault((model._meta.model_name, tuple(fields)), []).append(statement)
+    return suggestions
+
+
+def index_name(model_name, fields):
+    # Django allows at most 30 characters
+    name = '_'.join([model_name] + [field.lstrip('-') for field in fields])
+    return name[:26].rstrip('_') + '_idx'
+
+
+def migration_draft(suggestions):
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    app_label = 'LittleLemonAPI'
+    dependencies = ''.join(f"        ('{app_label}', '{name}'),\n" for _, name in sorted(loader.graph.leaf_nodes(app_label)))
+    operations = ''.join(
+        f"        migrations.AddIndex(\n"
+        f"            model_name='{model_name}',\n"
+        f"            index=models.Index(fields={list(fields)!r}, name='{index_name(model_name, fields)}'),\n"
+        f"        ),\n"
+        for model_name, fields in suggestions
+    )
+    return (
+        "# Generated by manage.py auditqueries\n\n"
+        "from django.db import migrations, models\n\n\n"
+        "class Migration(migrations.Migration):\n\n"
+        f"    dependencies = [\n{dependencies}    ]\n\n"
+        f"    operations = [\n{operations}    ]\n"
+    )
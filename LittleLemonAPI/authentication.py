@@ -0,0 +1,85 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+from .instrumentation import count_cache
+
+# Most recently used tokens kept per process, and seconds an entry is trusted.
+# Logout and user changes invalidate entries straight away (see signals.py);
+# the timeout bounds how long another worker process can keep using a token
+# that was revoked elsewhere.
+TOKEN_CACHE_SIZE = getattr(settings, 'TOKEN_CACHE_SIZE', 1024)
+TOKEN_CACHE_TIMEOUT = getattr(settings, 'TOKEN_CACHE_TIMEOUT', 60)
+
+
+class TokenCache:
+    # Bounded LRU of token key -> (expiry, user, token)
+
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = dict.fromkeys(('hits', 'misses', 'invalidations'), 0)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                self.entries.pop(key, None)
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[1:]
+
+    def set(self, key, user, token):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.timeout, user, token)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.stats['invalidations'] += 1
+
+    def delete_user(self, user_id):
+        with self.lock:
+            keys = [key for key, entry in self.entries.items() if entry[1].pk == user_id]
+            for key in keys:
+                del self.entries[key]
+            self.stats['invalidations'] += len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.stats = dict.fromkeys(self.stats, 0)
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, 'size': len(self.entries)}
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TIMEOUT)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    # TokenAuthentication without the token/user query for recently seen tokens
+
+    def authenticate_credentials(self, key):
+        cached = token_cache.get(key)
+        count_cache(hits=cached is not None, misses=cached is None)
+        if cached is None:
+            user, token = super().authenticate_credentials(key)
+            # Deactivated users are rejected above, so only active ones get cached
+            token_cache.set(key, user, token)
+            cached = (user, token)
+        # Every request gets its own copies, so nothing memoized on the user
+        # during one request (roles, for instance) leaks into the next
+        user, token = (copy.copy(obj) for obj in cached)
+        token.user = user
+        return user, token
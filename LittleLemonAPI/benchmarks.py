@@ -0,0 +1,461 @@
+import asyncio
+import statistics
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import date
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import OperationalError, close_old_connections, connection
+from django.db.backends.signals import connection_created
+from django.test import AsyncRequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext, setup_test_environment, teardown_test_environment
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory, force_authenticate
+from .models import Category, MenuItem, Cart, Order, OrderItem
+from .serializers import MenuItemSerializer, OrderSerializer, OrderItemSerializer, ValuesProjection
+
+# Benchmark suites by name, run through `manage.py benchmark <suite>`
+SUITES = {}
+
+
+def suite(name):
+    def register(func):
+        SUITES[name] = func
+        return func
+    return register
+
+
+@contextmanager
+def test_database():
+    # Benchmarks write a lot of rows, so they never touch the real database
+    old_name = connection.settings_dict['NAME']
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def measure(func, setup=None, repeat=10):
+    # One untimed run to count queries, then `repeat` timed runs.
+    # Capturing queries slows the cursor down, so it is kept out of the timings.
+    args = setup() if setup else ()
+    with CaptureQueriesContext(connection) as context:
+        func(*args)
+    timings = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return {
+        'queries': len(context.captured_queries),
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'min_ms': round(min(timings) * 1000, 3),
+    }
+
+
+def create_menu(count, prefix='Item'):
+    category, _ = Category.objects.get_or_create(slug='bench', title='Bench')
+    MenuItem.objects.bulk_create([
+        MenuItem(title=f'{prefix} {i}', price='1.50', featured=False, category=category)
+        for i in range(count)
+    ])
+    return list(MenuItem.objects.filter(title__startswith=f'{prefix} ').order_by('id'))
+
+
+# Django's SQLite defaults: rollback journal, deferred transactions and a new
+# connection for every request
+DEFAULT_PROFILE = {
+    'CONN_MAX_AGE': 0, 'OPTIONS': {}, 'SQLITE_PRAGMAS': {'journal_mode': 'DELETE'}, 'SQLITE_TRANSACTION_MODE': None,
+}
+
+
+def configured_profile():
+    return {
+        'CONN_MAX_AGE': connection.settings_dict['CONN_MAX_AGE'],
+        'OPTIONS': connection.settings_dict['OPTIONS'],
+        'SQLITE_PRAGMAS': settings.SQLITE_PRAGMAS,
+        'SQLITE_TRANSACTION_MODE': getattr(settings, 'SQLITE_TRANSACTION_MODE', None),
+    }
+
+
+@contextmanager
+def database_profile(profile):
+    # Connection settings, pragmas and transaction mode of `profile` for every
+    # connection opened inside the block, on any thread. The journal mode can
+    # only change while nobody else is connected, so the current thread
+    # reconnects first.
+    settings_dict = connection.settings_dict
+    saved = {key: settings_dict[key] for key in ('CONN_MAX_AGE', 'OPTIONS')}
+    connection.close()
+    settings_dict.update(CONN_MAX_AGE=profile['CONN_MAX_AGE'], OPTIONS=profile['OPTIONS'])
+    try:
+        with override_settings(SQLITE_PRAGMAS=profile['SQLITE_PRAGMAS'], SQLITE_TRANSACTION_MODE=profile['SQLITE_TRANSACTION_MODE']):
+            connection.ensure_connection()
+            yield
+    finally:
+        connection.close()
+        settings_dict.update(saved)
+
+
+def create_concurrency_fixtures(writers):
+    create_menu(50, prefix='Concurrent')
+    for i in range(writers):
+        User.objects.get_or_create(username=f'bench-writer-{i}')
+    User.objects.get_or_create(username='bench-reader')
+
+
+def run_concurrently(writers, readers, operations):
+    # `writers` threads each add three menu items to their cart and check out,
+    # `operations` times, while `readers` threads list menu pages. Requests
+    # end the way real ones do, closing connections older than CONN_MAX_AGE.
+    # The cache is switched off so every read hits the database.
+    from . import views
+    factory = APIRequestFactory()
+    add_to_cart = views.CartBulkView.as_view(throttle_classes=[])
+    checkout = views.OrdersView.as_view(throttle_classes=[])
+    menu_list = views.MenuItemsView.as_view(throttle_classes=[])
+    menu = list(MenuItem.objects.filter(title__startswith='Concurrent ').values_list('pk', flat=True))
+    lock = threading.Lock()
+    counts = dict.fromkeys(('requests', 'errors', 'lock_errors', 'connections'), 0)
+    write_timings = []
+
+    def count(key):
+        with lock:
+            counts[key] += 1
+
+    def opened(sender, **kwargs):
+        count('connections')
+
+    def send(view, user, request):
+        force_authenticate(request, user=user)
+        start = time.perf_counter()
+        try:
+            response = view(request)
+            if hasattr(response, 'render'):
+                response.render()
+            if response.status_code >= 300:
+                count('errors')
+        except OperationalError as e:
+            count('lock_errors' if 'locked' in str(e) else 'errors')
+        finally:
+            if request.method != 'GET':
+                write_timings.append(time.perf_counter() - start)
+            count('requests')
+            close_old_connections()
+
+    def write(i):
+        user = User.objects.get(username=f'bench-writer-{i}')
+        for n in range(operations):
+            items = [{'menuitem': menu[(i + n + k) % len(menu)], 'quantity': 1} for k in range(3)]
+            send(add_to_cart, user, factory.post('/api/cart/menu-items/bulk', items, format='json'))
+            send(checkout, user, factory.post('/api/orders'))
+
+    def read(i):
+        user = User.objects.get(username='bench-reader')
+        for n in range(operations * 2):
+            send(menu_list, user, factory.get(f'/api/menu-items?page={(i + n) % 5 + 1}'))
+
+    def worker(func, i):
+        try:
+            func(i)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(write, i)) for i in range(writers)]
+    threads += [threading.Thread(target=worker, args=(read, i)) for i in range(readers)]
+    connection_created.connect(opened)
+    try:
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+    finally:
+        connection_created.disconnect(opened)
+    percentiles = statistics.quantiles(write_timings, n=100)
+    return {
+        **counts, 'seconds': round(elapsed, 3), 'requests_per_s': round(counts['requests'] / elapsed),
+        'write_p50_ms': round(percentiles[49] * 1000, 3), 'write_p99_ms': round(percentiles[98] * 1000, 3),
+    }
+
+
+def legacy_checkout(user):
+    # OrdersView.post before checkout became set-based, kept for comparison
+    order_serializer = OrderSerializer(data={'user': user.id, 'delivery_crew': None, 'status': 0, 'total': 0, 'date': date.today()})
+    order_serializer.is_valid(raise_exception=True)
+    order = order_serializer.save()
+    cart_items = Cart.objects.filter(user=user)
+    for cart_item in cart_items:
+        order_item_serializer = OrderItemSerializer(data={
+            'order': order.id,
+            'menuitem': cart_item.menuitem.id,
+            'quantity': cart_item.quantity,
+            'unitprice': cart_item.unitprice,
+            'price': cart_item.price
+        })
+        order_item_serializer.is_valid(raise_exception=True)
+        order_item_serializer.save()
+        order.total += cart_item.price
+        order.save()
+    cart_items.delete()
+    return order
+
+
+@suite('checkout')
+def checkout_suite(repeat):
+    user = User.objects.create_user(username='bench-customer')
+    menu = create_menu(100)
+
+    def fill_cart(lines):
+        def setup():
+            Cart.objects.bulk_create([
+                Cart(user=user, menuitem=item, quantity=2, unitprice=item.price, price=item.price * 2)
+                for item in menu[:lines]
+            ])
+            return (user,)
+        return setup
+
+    rows = []
+    for lines in (1, 10, 100):
+        for name, func in (('legacy', legacy_checkout), ('set-based', Order.objects.create_from_cart)):
+            rows.append({'implementation': name, 'cart_lines': lines, **measure(func, fill_cart(lines), repeat)})
+    return rows
+
+
+@suite('export')
+def export_suite(repeat):
+    # Peak Python memory while streaming the order export should not depend
+    # on the number of rows exported
+    from rest_framework.test import APIClient
+    user = User.objects.create_user(username='bench-manager')
+    user.groups.create(name='Manager')
+    menu = create_menu(5)
+    client = APIClient()
+    client.force_authenticate(user)
+
+    rows = []
+    exported = 0
+    for items in (10_000, 50_000, 200_000):
+        orders = Order.objects.bulk_create([
+            Order(user=user, total='7.50', date=date.today()) for _ in range((items - exported) // 5)
+        ])
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, menuitem=item, quantity=5, unitprice=item.price, price='7.50')
+            for order in orders for item in menu
+        ], batch_size=5000)
+        exported = items
+        for export_format in ('csv', 'ndjson', 'xml'):
+            tracemalloc.start()
+            start = time.perf_counter()
+            response = client.get(f'/api/orders/export?format={export_format}')
+            size = sum(len(chunk) for chunk in response.streaming_content)
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            rows.append({
+                'format': export_format, 'order_items': items, 'bytes': size,
+                'seconds': round(elapsed, 3), 'peak_kib': peak // 1024,
+            })
+    return rows
+
+
+@suite('asgi')
+def asgi_suite(repeat):
+    # Sync vs async read views under concurrent requests, dispatched the way
+    # the ASGI handler does it: sync views through sync_to_async, async views
+    # awaited directly. Caching and throttling are switched off so every
+    # request hits the database.
+    from . import views, async_views
+    user = User.objects.create_user(username='bench-reader')
+    token = Token.objects.create(user=user)
+    menu = create_menu(50)
+    order = Order.objects.bulk_create([Order(user=user, total='7.50', date=date.today())])[0]
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, menuitem=item, quantity=1, unitprice=item.price, price=item.price) for item in menu[:5]
+    ])
+    factory = AsyncRequestFactory()
+    cases = [
+        ('menu-items', '/api/menu-items?page=2', {}, views.MenuItemsView, async_views.AsyncMenuItemsView),
+        ('orders/<pk>', f'/api/orders/{order.pk}', {'pk': order.pk}, views.SingeOrderView, async_views.AsyncSingleOrderView),
+    ]
+
+    async def run(view, path, kwargs, concurrency):
+        async def one():
+            request = factory.get(path, headers={'Authorization': f'Token {token.key}'})
+            response = await view(request, **kwargs)
+            response.render()
+            assert response.status_code == 200, response.status_code
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(concurrency)))
+        return time.perf_counter() - start
+
+    rows = []
+    with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+        for name, path, kwargs, sync_view, async_view in cases:
+            for concurrency in (1, 10, 50):
+                for implementation, view in (('sync', sync_to_async(sync_view.as_view(throttle_classes=[]))), ('async', async_view.as_view(throttle_classes=[]))):
+                    timings = [async_to_sync(run)(view, path, kwargs, concurrency) for _ in range(repeat)]
+                    rows.append({
+                        'endpoint': name, 'implementation': implementation, 'concurrency': concurrency,
+                        'median_ms': round(statistics.median(timings) * 1000, 3),
+                        'requests_per_s': round(concurrency / statistics.median(timings)),
+                    })
+    return rows
+
+
+@suite('concurrency')
+def concurrency_suite(repeat):
+    # Parallel cart adds and checkouts against parallel menu reads, with
+    # Django's SQLite defaults and with the configured tuning
+    create_concurrency_fixtures(16)
+    rows = []
+    for name, profile in (('default', DEFAULT_PROFILE), ('configured', configured_profile())):
+        for threads in (4, 16):
+            with database_profile(profile):
+                runs = [run_concurrently(writers=threads, readers=threads, operations=5) for _ in range(repeat)]
+            rows.append({
+                'profile': name, 'writers': threads, 'readers': threads,
+                'requests': sum(run['requests'] for run in runs),
+                'lock_errors': sum(run['lock_errors'] for run in runs),
+                'other_errors': sum(run['errors'] for run in runs),
+                'connections': sum(run['connections'] for run in runs),
+                'requests_per_s': round(statistics.median(run['requests_per_s'] for run in runs)),
+            })
+    return rows
+
+
+@suite('writes')
+def writes_suite(repeat):
+    # Write latency of 50 clients checking out at once, next to 10 readers,
+    # with every request thread writing for itself and through the write queue
+    from .writer import get_queue, stop_queues
+    create_concurrency_fixtures(50)
+    rows = []
+    with database_profile(configured_profile()):
+        for write_queue in (False, True):
+            with override_settings(WRITE_QUEUE=write_queue):
+                batches = get_queue().get_stats()['batches']
+                runs = [run_concurrently(writers=50, readers=10, operations=5) for _ in range(repeat)]
+                stop_queues()
+            rows.append({
+                'write_queue': write_queue,
+                'requests': sum(run['requests'] for run in runs),
+                'lock_errors': sum(run['lock_errors'] for run in runs),
+                'other_errors': sum(run['errors'] for run in runs),
+                'write_batches': get_queue().get_stats()['batches'] - batches,
+                'requests_per_s': round(statistics.median(run['requests_per_s'] for run in runs)),
+                'write_p50_ms': round(statistics.median(run['write_p50_ms'] for run in runs), 3),
+                'write_p99_ms': round(statistics.median(run['write_p99_ms'] for run in runs), 3),
+            })
+    return rows
+
+
+@suite('instrumentation')
+def instrumentation_suite(repeat):
+    # Cost of the PerformanceMiddleware: the same requests through the full
+    # middleware stack with it loaded and left out. Caching is off so every
+    # request runs its queries, and the rate limits are reset before each one.
+    from django.test import Client
+    from . import throttling
+    user = User.objects.create_user(username='bench-instrumented')
+    token = Token.objects.create(user=user)
+    menu = create_menu(50)
+    order = Order.objects.bulk_create([Order(user=user, total='7.50', date=date.today())])[0]
+    OrderItem.objects.bulk_create([
+        OrderItem(order=order, menuitem=item, quantity=1, unitprice=item.price, price=item.price) for item in menu[:5]
+    ])
+    clients = {}
+    for enabled in (False, True):
+        # The middleware stack is built on a client's first request
+        with override_settings(PERFORMANCE_INSTRUMENTATION=enabled):
+            clients[enabled] = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+            clients[enabled].get('/api/categories')
+
+    def run(client, path):
+        start = time.perf_counter()
+        for _ in range(100):
+            throttling.reset()
+            assert client.get(path).status_code == 200
+        return (time.perf_counter() - start) / 100
+
+    rows = []
+    with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+        for path in ('/api/menu-items?page=2', f'/api/orders/{order.pk}'):
+            # Alternated, so that both see the same noise
+            timings = {False: [], True: []}
+            for _ in range(repeat):
+                for enabled, client in clients.items():
+                    timings[enabled].append(run(client, path))
+            off, on = (min(timings[enabled]) for enabled in (False, True))
+            rows.append({
+                'path': path, 'off_ms': round(off * 1000, 3), 'on_ms': round(on * 1000, 3),
+                'overhead_pct': round((on / off - 1) * 100, 1),
+            })
+    return rows
+
+
+@suite('serializers')
+def serializers_suite(repeat):
+    # Rows per second for a full 1000-row page (max_page_size), fetching and
+    # serializing, through the model serializer and the values() projection
+    user = User.objects.create_user(username='bench-serializers')
+    create_menu(1000)
+    Order.objects.bulk_create([Order(user=user, total='12.75', date=date.today()) for _ in range(1000)])
+
+    rows = []
+    for serializer_class, queryset in (
+        (MenuItemSerializer, MenuItem.objects.order_by('id')[:1000]),
+        (OrderSerializer, Order.objects.order_by('id')[:1000]),
+    ):
+        projection = ValuesProjection(serializer_class())
+        for name, func in (
+            ('serializer', lambda: serializer_class(queryset, many=True).data),
+            ('values', lambda: projection.to_representation(projection.apply(queryset))),
+        ):
+            result = measure(func, repeat=repeat)
+            rows.append({
+                'serializer': serializer_class.__name__, 'implementation': name, **result,
+                'rows_per_s': round(1000 / result['median_ms'] * 1000),
+            })
+    return rows
+
+
+@suite('xml')
+def xml_suite(repeat):
+    # Peak Python memory of rendering a list page as XML: the whole document
+    # at once (XMLRenderer) vs streamed while the rows are produced
+    from rest_framework_xml.renderers import XMLRenderer
+    from .renderers import StreamingXMLRenderer
+
+    def page(rows):
+        return {'count': rows, 'next': None, 'previous': None, 'results': (
+            {'id': i, 'title': f'Item {i}', 'price': '1.50', 'featured': False, 'description': 'none', 'category': 1}
+            for i in range(rows)
+        )}
+
+    rows = []
+    for size in (1_000, 10_000, 100_000):
+        for name, render in (
+            ('XMLRenderer', lambda data: [XMLRenderer().render({**data, 'results': list(data['results'])})]),
+            ('StreamingXMLRenderer', lambda data: StreamingXMLRenderer().stream(data)),
+        ):
+            tracemalloc.start()
+            start = time.perf_counter()
+            length = sum(len(chunk) for chunk in render(page(size)))
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            rows.append({
+                'renderer': name, 'rows': size, 'chars': length,
+                'seconds': round(elapsed, 3), 'peak_kib': peak // 1024,
+            })
+    return rows
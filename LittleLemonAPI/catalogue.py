@@ -0,0 +1,95 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+from .models import CatalogueVersion
+
+# Only these query parameters change a catalogue response; anything else
+# shares the cache entry of the request without it
+CACHED_QUERY_PARAMS = ('page', 'page_size', 'search', 'ordering', 'cursor')
+
+CATALOGUE_CACHE_TIMEOUT = getattr(settings, 'CATALOGUE_CACHE_TIMEOUT', 600)
+
+# Primary key of the CatalogueVersion row
+VERSION_ROW = 1
+# Attribute used to memoize the version on the request
+_REQUEST_ATTR = '_littlelemon_catalogue'
+# Hits, misses and invalidations are counted per process
+STATS = ('hits', 'misses', 'invalidations')
+
+
+def _stat_key(name):
+    return f'littlelemon:catalogue:stats:{name}'
+
+
+def incr_stat(name):
+    key = _stat_key(name)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Evicted between add() and incr()
+        cache.set(key, 1, None)
+
+
+def get_stats():
+    values = cache.get_many([_stat_key(name) for name in STATS])
+    stats = {name: values.get(_stat_key(name), 0) for name in STATS}
+    stats['version'] = get_version()
+    return stats
+
+
+def _read_state():
+    return CatalogueVersion.objects.filter(pk=VERSION_ROW).values_list('version', 'modified').first()
+
+
+def get_state(request=None):
+    # (version, modified) of the catalogue, from the database row all worker
+    # processes share, read at most once per request (memoized on it). A
+    # missing row (manage.py flush deletes it) is created again with a
+    # version seeded from the clock, so that a number older cache entries
+    # were stored under never comes back.
+    state = getattr(request, _REQUEST_ATTR, None)
+    if state is None:
+        state = _read_state()
+        if state is None:
+            CatalogueVersion.objects.bulk_create(
+                [CatalogueVersion(pk=VERSION_ROW, version=time.time_ns(), modified=timezone.now())], ignore_conflicts=True,
+            )
+            state = _read_state()
+        if request is not None:
+            setattr(request, _REQUEST_ATTR, state)
+    return state
+
+
+def get_version(request=None):
+    return get_state(request)[0]
+
+
+def get_last_modified(request=None):
+    return get_state(request)[1]
+
+
+def bump_version():
+    # A single UPDATE, so concurrent changes never end up with one version
+    if not CatalogueVersion.objects.filter(pk=VERSION_ROW).update(version=F('version') + 1, modified=timezone.now()):
+        get_state()
+    incr_stat('invalidations')
+
+
+def cache_key(request, version):
+    # Pagination links are absolute, so the host is part of the key as well
+    # as the path, the negotiated media type and the normalized query string
+    params = sorted(
+        (name, value)
+        for name in CACHED_QUERY_PARAMS
+        for value in request.query_params.getlist(name)
+    )
+    raw = repr((version, request.build_absolute_uri(request.path), request.accepted_media_type, params))
+    return 'littlelemon:catalogue:' + hashlib.sha256(raw.encode()).hexdigest()
+
+
+def etag(key):
+    return '"%s"' % key.rsplit(':', 1)[1][:32]
@@ -0,0 +1,25 @@
+from django.conf import settings
+
+
+def apply_pragmas(connection):
+    # Runs the SQLITE_PRAGMAS on a new DB-API connection. They go straight to
+    # the sqlite3 connection, so they never show up in the query log.
+    for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+        connection.execute(f'PRAGMA {name}={value}')
+
+
+def set_transaction_mode(wrapper):
+    # Makes the Django connection start its transactions with BEGIN
+    # SQLITE_TRANSACTION_MODE. OPTIONS['transaction_mode'] does the same, but
+    # only from Django 5.1 on.
+    mode = getattr(settings, 'SQLITE_TRANSACTION_MODE', None)
+    if mode:
+        wrapper._start_transaction_under_autocommit = lambda: wrapper.cursor().execute(f'BEGIN {mode}')
+    else:
+        # Back to Django's deferred BEGIN on a reconnect with the setting off
+        wrapper.__dict__.pop('_start_transaction_under_autocommit', None)
+
+
+def get_pragmas(connection, names):
+    # Current values, for checking the setup
+    return {name: connection.execute(f'PRAGMA {name}').fetchone()[0] for name in names}
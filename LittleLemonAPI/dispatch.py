@@ -0,0 +1,124 @@
+import heapq
+import threading
+import time
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from .models import Order
+from .roles import DELIVERY_CREW
+
+# Seconds the in-memory loads are trusted before dispatch() reloads them.
+# Every worker process keeps its own, and only sees the changes it commits
+# itself; the reload brings in the other processes' assignments and
+# deliveries.
+DISPATCH_RELOAD_INTERVAL = getattr(settings, 'DISPATCH_RELOAD_INTERVAL', 60)
+
+
+class Dispatcher:
+    # Assigns unassigned orders to the delivery crew member with the fewest
+    # open (undelivered) orders. The loads live in memory: loaded from the
+    # database on first use and every DISPATCH_RELOAD_INTERVAL seconds, and
+    # kept up to date from committed order saves and deletes (see
+    # signals.py), so picking a crew member is a heap pop and push, O(log n)
+    # in the size of the crew, without any query.
+    #
+    # The heap holds (load, crew id) entries; when a load changes a new entry
+    # is pushed and the old one is skipped once it reaches the top.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+
+    def invalidate(self):
+        # Reloaded from the database on next use. No lock: dispatch() holds it
+        # while it waits for the database write lock, which the transaction
+        # calling this may hold, and a single assignment is atomic anyway.
+        self.loaded = False
+
+    def load(self):
+        crew = User.objects.filter(groups__name=DELIVERY_CREW, is_active=True).values_list('pk', flat=True)
+        self.loads = dict.fromkeys(crew, 0)
+        self.open_orders = {}
+        for order_id, crew_id in Order.objects.filter(status=False, delivery_crew__isnull=False).values_list('pk', 'delivery_crew_id'):
+            self.open_orders[order_id] = crew_id
+            if crew_id in self.loads:
+                self.loads[crew_id] += 1
+        self.heap = [(load, crew_id) for crew_id, load in self.loads.items()]
+        heapq.heapify(self.heap)
+        self.loaded = True
+        self.loaded_at = time.monotonic()
+
+    def change_load(self, crew_id, delta):
+        if crew_id in self.loads:
+            self.loads[crew_id] += delta
+            heapq.heappush(self.heap, (self.loads[crew_id], crew_id))
+
+    def pick(self):
+        # Least loaded crew member, counted as one more order
+        while self.heap:
+            load, crew_id = heapq.heappop(self.heap)
+            if self.loads.get(crew_id) == load:
+                self.change_load(crew_id, 1)
+                return crew_id
+        return None
+
+    def order_changed(self, order_id, crew_id, delivered):
+        # Called once an order save commits; an order counts while it is
+        # assigned and not delivered
+        with self.lock:
+            if not self.loaded:
+                return
+            previous = self.open_orders.pop(order_id, None)
+            if previous is not None:
+                self.change_load(previous, -1)
+            if crew_id is not None and not delivered:
+                self.open_orders[order_id] = crew_id
+                self.change_load(crew_id, 1)
+
+    def order_deleted(self, order_id):
+        self.order_changed(order_id, None, True)
+
+    def dispatch(self, batch_size):
+        # Assigns up to batch_size of the oldest unassigned orders with one
+        # UPDATE, and returns the (order id, crew id) pairs
+        with self.lock:
+            try:
+                return self.assign(batch_size)
+            except Exception:
+                # The in-memory loads may not match the database any more
+                self.loaded = False
+                raise
+
+    def assign(self, batch_size):
+        with transaction.atomic():
+            if not self.loaded or time.monotonic() - self.loaded_at > DISPATCH_RELOAD_INTERVAL:
+                self.load()
+            order_ids = list(
+                Order.objects.filter(status=False, delivery_crew__isnull=True)
+                .order_by('date', 'id').values_list('pk', flat=True)[:batch_size]
+            )
+            assignments = []
+            for order_id in order_ids:
+                crew_id = self.pick()
+                if crew_id is None:
+                    break
+                assignments.append((order_id, crew_id))
+                self.open_orders[order_id] = crew_id
+            if not assignments:
+                return []
+
+            # Only orders that are still unassigned, in case another process
+            # got to some of them first
+            updated = Order.objects.filter(pk__in=[order_id for order_id, _ in assignments], delivery_crew__isnull=True).update(
+                delivery_crew=Case(*[When(pk=order_id, then=Value(crew_id)) for order_id, crew_id in assignments]),
+                version=F('version') + 1,
+            )
+            if updated != len(assignments):
+                assigned = dict(Order.objects.filter(pk__in=[order_id for order_id, _ in assignments]).values_list('pk', 'delivery_crew_id'))
+                assignments = [(order_id, crew_id) for order_id, crew_id in assignments if assigned.get(order_id) == crew_id]
+                self.loaded = False
+            return assignments
+
+
+dispatcher = Dispatcher()
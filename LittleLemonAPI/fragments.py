@@ -0,0 +1,86 @@
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from .instrumentation import count_cache, timer
+
+# Upper bound on the rendered JSON kept per process
+FRAGMENT_CACHE_BYTES = getattr(settings, 'FRAGMENT_CACHE_BYTES', 16 * 1024 * 1024)
+
+
+class FragmentCache:
+    # LRU of (model label, pk) -> (row version, serializer, rendered JSON),
+    # bounded by the total size of the JSON. A row whose version moved on is
+    # a miss, so entries never need to be invalidated for correctness; the
+    # signals in signals.py drop them early to free the memory.
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = dict.fromkeys(('hits', 'misses', 'evictions', 'invalidations'), 0)
+
+    def get(self, key, version, serializer):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != version or entry[1] != serializer:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[2]
+
+    def set(self, key, version, serializer, content):
+        if len(content) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[2])
+            self.entries[key] = (version, serializer, content)
+            self.size += len(content)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted[2])
+                self.stats['evictions'] += 1
+
+    def delete(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.size -= len(entry[2])
+                self.stats['invalidations'] += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.stats = dict.fromkeys(self.stats, 0)
+
+    def get_stats(self):
+        with self.lock:
+            return {**self.stats, 'entries': len(self.entries), 'bytes': self.size}
+
+
+fragment_cache = FragmentCache(FRAGMENT_CACHE_BYTES)
+
+
+def render_rows(rows, projection, renderer):
+    # JSON array of the rows, built from cached fragments where the row
+    # version matches and rendering only the rest. The rows must be
+    # projection rows fetched with the model's version.
+    label = projection.model._meta.label_lower
+    serializer = projection.name
+    parts = []
+    misses = 0
+    with timer('serialize'):
+        for row in rows:
+            key = (label, row['id'])
+            content = fragment_cache.get(key, row['version'], serializer)
+            if content is None:
+                misses += 1
+                content = renderer.render(projection.to_representation([row])[0])
+                fragment_cache.set(key, row['version'], serializer, content)
+            parts.append(content)
+    count_cache(hits=len(parts) - misses, misses=misses)
+    return b'[' + b','.join(parts) + b']'
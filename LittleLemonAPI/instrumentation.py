@@ -0,0 +1,235 @@
+import logging
+import time
+from collections import Counter
+from contextlib import nullcontext
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse
+
+logger = logging.getLogger(__name__)
+
+# The same SQL run this many times in one request is reported as a likely
+# N+1 query
+DUPLICATE_QUERY_THRESHOLD = getattr(settings, 'DUPLICATE_QUERY_THRESHOLD', 3)
+
+_metrics = ContextVar('littlelemon_request_metrics', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestMetrics:
+    # What one request spent its time on. Timings of the named phases leave
+    # out the queries run inside them, which count towards `db` only.
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = Counter()
+        self.db_time = 0.0
+        self.timings = {}
+        self.running = {}
+        self.cache = Counter()
+        self.view_name = None
+        self.query_budget = None
+
+    def record_query(self, execute, sql, params, many, context):
+        # connection.execute_wrapper() hook
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries[sql] += 1
+
+    def begin(self, name):
+        # Nested spans of the same phase count once
+        if name in self.running:
+            return False
+        self.running[name] = (time.perf_counter(), self.db_time)
+        return True
+
+    def end(self, name):
+        start, db_time = self.running.pop(name)
+        elapsed = time.perf_counter() - start - (self.db_time - db_time)
+        self.timings[name] = self.timings.get(name, 0) + elapsed
+
+    def timer(self, name):
+        return Phase(self, name)
+
+    def duplicates(self):
+        return [(sql, count) for sql, count in self.queries.items() if count >= DUPLICATE_QUERY_THRESHOLD]
+
+    def server_timing(self):
+        total = time.perf_counter() - self.start
+        entries = [f'db;dur={self.db_time * 1000:.2f};desc="{sum(self.queries.values())} queries"']
+        entries += [f'{name};dur={seconds * 1000:.2f}' for name, seconds in self.timings.items()]
+        if self.cache:
+            entries.append(f'cache;desc="{self.cache["hits"]} hits, {self.cache["misses"]} misses"')
+        if duplicates := self.duplicates():
+            entries.append(f'dup;desc="{len(duplicates)} repeated statements"')
+        entries.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(entries)
+
+
+class Phase:
+    # RequestMetrics.timer(); a plain class, as it is entered for every
+    # serialized row
+    __slots__ = ('metrics', 'name', 'started')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = self.metrics.begin(self.name)
+
+    def __exit__(self, *exc_info):
+        if self.started:
+            self.metrics.end(self.name)
+
+
+def timer(name):
+    # Times a phase (serialize, render, ...) of the current request; does
+    # nothing outside of an instrumented request
+    metrics = _metrics.get()
+    return nullcontext() if metrics is None else metrics.timer(name)
+
+
+def count_cache(hits=0, misses=0):
+    metrics = _metrics.get()
+    if metrics is not None:
+        metrics.cache['hits'] += hits
+        metrics.cache['misses'] += misses
+
+
+def record_query(execute, sql, params, many, context):
+    # Installed on every database connection (see signals.py), in whatever
+    # thread it is opened, so the queries of async views, which run in other
+    # threads, count towards the request they belong to: the metrics follow
+    # the request's context into those threads.
+    metrics = _metrics.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics.record_query(execute, sql, params, many, context)
+
+
+def install(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class PerformanceMiddleware:
+    # Adds a Server-Timing header with the query count and time, the
+    # serialization and rendering time and the cache hits of the request,
+    # warns about statements repeated within a request (likely N+1 queries)
+    # and enforces the `query_budget` a view class declares, by logging or
+    # raising QueryBudgetExceeded (QUERY_BUDGET_ACTION = 'log' or 'raise').
+    # With PERFORMANCE_INSTRUMENTATION off, Django leaves it out altogether.
+    #
+    # Runs sync under WSGI and async under ASGI, so it never makes Django
+    # adapt the stack to a thread. The body of a streaming response is
+    # produced after the view returns: its queries are counted as it is
+    # consumed and the budget is checked once it ends, but the Server-Timing
+    # header has gone out by then and only covers what ran before.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PERFORMANCE_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+            # Django would run a sync hook in a thread
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        token = _metrics.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        token = _metrics.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _metrics.reset(token)
+        return self.finish(request, response, metrics)
+
+    def finish(self, request, response, metrics):
+        match = getattr(request, 'resolver_match', None)
+        if match is not None:
+            view_class = getattr(match.func, 'cls', None) or getattr(match.func, 'view_class', None)
+            metrics.view_name = view_class.__name__ if view_class else match.func.__name__
+            metrics.query_budget = getattr(view_class, 'query_budget', None)
+        response['Server-Timing'] = metrics.server_timing()
+        # Files are read straight from disk, without queries
+        if response.streaming and not isinstance(response, FileResponse):
+            if response.is_async:
+                response.streaming_content = self.astream(request, response.streaming_content, metrics)
+            else:
+                response.streaming_content = self.stream(request, response.streaming_content, metrics)
+        else:
+            self.check(request, metrics)
+        return response
+
+    def stream(self, request, chunks, metrics):
+        chunks = iter(chunks)
+        while True:
+            token = _metrics.set(metrics)
+            try:
+                chunk = next(chunks, None)
+            finally:
+                _metrics.reset(token)
+            if chunk is None:
+                break
+            yield chunk
+        self.check(request, metrics)
+
+    async def astream(self, request, chunks, metrics):
+        chunks = aiter(chunks)
+        while True:
+            token = _metrics.set(metrics)
+            try:
+                chunk = await anext(chunks, None)
+            finally:
+                _metrics.reset(token)
+            if chunk is None:
+                break
+            yield chunk
+        self.check(request, metrics)
+
+    def process_template_response(self, request, response):
+        # Called just before the response is rendered
+        return self.time_render(response)
+
+    async def aprocess_template_response(self, request, response):
+        return self.time_render(response)
+
+    def time_render(self, response):
+        metrics = _metrics.get()
+        if metrics.begin('render'):
+            response.add_post_render_callback(lambda response: metrics.end('render'))
+        return response
+
+    def check(self, request, metrics):
+        where = f'{request.method} {request.path} ({metrics.view_name})'
+        for sql, count in metrics.duplicates():
+            logger.warning("Likely N+1 query in %s, run %d times: %s", where, count, sql)
+        queries = sum(metrics.queries.values())
+        if metrics.query_budget is not None and queries > metrics.query_budget:
+            message = f"{where} ran {queries} queries, over its budget of {metrics.query_budget}"
+            if getattr(settings, 'QUERY_BUDGET_ACTION', 'log') == 'raise':
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
@@ -0,0 +1,197 @@
+import json
+import re
+import statistics
+import threading
+import time
+from collections import Counter
+from urllib import error, request as urllib_request
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client, override_settings
+from rest_framework.authtoken.models import Token
+from .audit import QUERY_VARIANTS, ROLES, get_routes, quiet_requests, sample_path
+from .models import Category, MenuItem, Cart, Order, OrderItem, Booking
+
+# Query count reported by the PerformanceMiddleware
+SERVER_TIMING_QUERIES = re.compile(r'\bdb;[^,]*desc="(\d+) queries"')
+
+# Tables whose sizes are reported with the results, so that runs against
+# differently seeded databases are not compared by mistake
+COUNTED_MODELS = (Category, MenuItem, User, Cart, Order, OrderItem, Booking)
+
+
+class ClientTransport:
+    # Requests through Django's test client in this process, one client and
+    # database connection per thread, counting the queries of each request
+
+    name = 'client'
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def send(self, method, url, token=None, data=None):
+        if not hasattr(self.local, 'client'):
+            self.local.client = Client()
+        headers = {'HTTP_AUTHORIZATION': f'Token {token}'} if token else {}
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            if method == 'GET':
+                response = self.local.client.get(url, **headers)
+            else:
+                response = self.local.client.generic(method, url, json.dumps(data), 'application/json', **headers)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return response.status_code, queries
+
+    def close(self):
+        connection.close()
+
+
+class ServerTransport:
+    # Requests over HTTP to a running server. Query counts are read from the
+    # Server-Timing header, so they are only known with
+    # PERFORMANCE_INSTRUMENTATION on in the server.
+
+    def __init__(self, base_url):
+        self.name = base_url
+        self.base_url = base_url.rstrip('/')
+
+    def send(self, method, url, token=None, data=None):
+        headers = {'Authorization': f'Token {token}'} if token else {}
+        body = None
+        if data is not None:
+            body = json.dumps(data).encode()
+            headers['Content-Type'] = 'application/json'
+        try:
+            with urllib_request.urlopen(urllib_request.Request(self.base_url + url, body, headers, method=method), timeout=60) as response:
+                response.read()
+                status, timing = response.status, response.headers.get('Server-Timing')
+        except error.HTTPError as e:
+            e.read()
+            status, timing = e.code, e.headers.get('Server-Timing')
+        match = SERVER_TIMING_QUERIES.search(timing or '')
+        return status, int(match.group(1)) if match else None
+
+    def close(self):
+        pass
+
+
+def get_targets(fixtures, roles=ROLES, writes=False):
+    # The GETs of every API and restaurant route (with the query variants of
+    # the query plan audit) as each role, and with `writes`, adding to the
+    # cart and checking out. Writes are made as a customer of each worker's
+    # own, so that concurrent checkouts do not empty each other's carts.
+    targets = []
+    for template, name in get_routes():
+        path = sample_path(template, name, fixtures)
+        for variant in [''] + QUERY_VARIANTS.get(name, []):
+            url = path + variant.format(date=fixtures['date'].isoformat())
+            targets += [{'method': 'GET', 'url': url, 'role': role} for role in roles]
+    if writes:
+        menu = list(MenuItem.objects.order_by('id').values_list('pk', flat=True)[:100])
+        add_to_cart = lambda i: [{'menuitem': menu[i % len(menu)], 'quantity': 1}]
+        targets += [
+            {'method': 'POST', 'url': '/api/cart/menu-items/bulk', 'role': 'writer', 'data': add_to_cart},
+            {'method': 'POST', 'url': '/api/orders', 'role': 'writer',
+             'setup': ('POST', '/api/cart/menu-items/bulk', add_to_cart)},
+        ]
+    return targets
+
+
+def get_tokens(fixtures, writers):
+    # Tokens of the fixture users by role, and of `writers` other customers
+    tokens = {role: Token.objects.get_or_create(user=user)[0].key for role, user in fixtures['users'].items()}
+    tokens['anonymous'] = None
+    customers = User.objects.filter(username__startswith='seed-customer-').exclude(pk=fixtures['users']['customer'].pk)
+    tokens['writer'] = [Token.objects.get_or_create(user=user)[0].key for user in customers.order_by('id')[:writers]] or [tokens['customer']]
+    return tokens
+
+
+def run_target(transport, target, tokens, requests, concurrency):
+    # Sends the target's request `requests` times from `concurrency` threads
+    lock = threading.Lock()
+    remaining = requests
+    timings, queries, statuses = [], [], Counter()
+
+    def work(worker):
+        nonlocal remaining
+        token = tokens['writer'][worker % len(tokens['writer'])] if target['role'] == 'writer' else tokens[target['role']]
+        n = 0
+        while True:
+            with lock:
+                if remaining == 0:
+                    return
+                remaining -= 1
+            n += 1
+            if 'setup' in target:
+                method, url, data = target['setup']
+                transport.send(method, url, token, data(n))
+            data = target.get('data')
+            start = time.perf_counter()
+            status, count = transport.send(target['method'], target['url'], token, data(n) if data else None)
+            elapsed = time.perf_counter() - start
+            with lock:
+                timings.append(elapsed)
+                statuses[status] += 1
+                if count is not None:
+                    queries.append(count)
+
+    def thread(worker):
+        try:
+            work(worker)
+        finally:
+            transport.close()
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        work(0)
+    else:
+        threads = [threading.Thread(target=thread, args=(worker,)) for worker in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    elapsed = time.perf_counter() - start
+
+    percentiles = statistics.quantiles(timings, n=100, method='inclusive') if len(timings) > 1 else timings * 99
+    return {
+        'method': target['method'], 'url': target['url'], 'role': target['role'],
+        'requests': len(timings), 'errors': sum(n for status, n in statuses.items() if status >= 400),
+        'statuses': {str(status): n for status, n in sorted(statuses.items())},
+        'rps': round(len(timings) / elapsed, 1),
+        'p50_ms': round(percentiles[49] * 1000, 2), 'p95_ms': round(percentiles[94] * 1000, 2),
+        'p99_ms': round(percentiles[98] * 1000, 2),
+        'queries': statistics.median(queries) if queries else None,
+    }
+
+
+def run_load_test(transport, fixtures, requests=100, concurrency=4, roles=ROLES, writes=False, match=None):
+    # Every target is requested once first; those a role has no access to
+    # (4xx) are left out, and the others are then timed one after the other.
+    # Rate limits are off in this process, and have to be turned off in a
+    # server (THROTTLE_ENABLED = False) for its results to mean anything.
+    tokens = get_tokens(fixtures, concurrency)
+    targets = [target for target in get_targets(fixtures, roles, writes) if not match or match in target['url']]
+    results = []
+    # The test client's requests are for host 'testserver'
+    with override_settings(THROTTLE_ENABLED=False, ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']), quiet_requests():
+        for target in targets:
+            if target['method'] == 'GET':
+                status, _ = transport.send('GET', target['url'], tokens[target['role']])
+                if status >= 400:
+                    continue
+            results.append(run_target(transport, target, tokens, requests, concurrency))
+    return {
+        'transport': transport.name,
+        'requests': requests,
+        'concurrency': concurrency,
+        'rows': {model._meta.label: model.objects.count() for model in COUNTED_MODELS},
+        'results': results,
+    }
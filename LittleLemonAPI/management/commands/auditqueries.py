@@ -0,0 +1,62 @@
+import json
+from django.core.management.base import BaseCommand
+from LittleLemonAPI.audit import audit_urls, index_name, migration_draft, suggest_indexes
+from LittleLemonAPI.benchmarks import test_database
+from LittleLemonAPI.seed import seed_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Requests every API and restaurant URL as each role against a seeded throwaway database, "
+        "explains the queries they run and suggests composite indexes for full scans and temp b-trees"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--customers', type=int, default=50, help="Customers to seed, 20 orders each on average")
+        parser.add_argument('--migration', help="Write the suggested indexes as a migration to this file")
+        parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+
+    def handle(self, *args, **options):
+        with test_database():
+            fixtures = seed_database(customers=options['customers'], orders=options['customers'] * 20)
+            requests, statements = audit_urls(fixtures)
+            suggestions = suggest_indexes(statements)
+        flagged = [statement for statement in statements if statement['problems']]
+
+        if options['json']:
+            self.stdout.write(json.dumps({
+                'requests': requests,
+                'flagged': [
+                    {'sql': s['sql'], 'plan': s['plan'], 'urls': sorted(s['urls']), 'count': s['count']} for s in flagged
+                ],
+                'suggestions': [
+                    {'model': model_name, 'fields': list(fields), 'name': index_name(model_name, fields)}
+                    for model_name, fields in suggestions
+                ],
+            }, indent=2))
+        else:
+            errors = [request for request in requests if request['status'] >= 500]
+            self.stdout.write(f"{len(requests)} requests, {len(statements)} distinct statements, {len(flagged)} flagged")
+            for request in errors:
+                self.stdout.write(self.style.ERROR(f"{request['status']} {request['role']} {request['url']}"))
+            for statement in flagged:
+                self.stdout.write('')
+                self.stdout.write(self.style.WARNING(', '.join(problem for problem, _ in statement['problems'])))
+                self.stdout.write(f"  {statement['sql'][:300]}")
+                for detail in statement['plan']:
+                    self.stdout.write(f"    {detail}")
+                self.stdout.write(f"  run {statement['count']} times by {', '.join(sorted(statement['urls'])[:5])}")
+            self.stdout.write('')
+            if not suggestions:
+                self.stdout.write(self.style.SUCCESS("No indexes to suggest"))
+            for (model_name, fields), covered in suggestions.items():
+                self.stdout.write(self.style.SUCCESS(f"Index {model_name}({', '.join(fields)}) for {len(covered)} statements"))
+
+        if suggestions:
+            draft = migration_draft(suggestions)
+            if options['migration']:
+                with open(options['migration'], 'w') as f:
+                    f.write(draft)
+            elif not options['json']:
+                self.stdout.write('')
+                self.stdout.write(draft)
@@ -0,0 +1,25 @@
+import json
+from django.core.management.base import BaseCommand
+from LittleLemonAPI.benchmarks import SUITES, test_database
+
+
+class Command(BaseCommand):
+    help = "Runs a benchmark suite against a throwaway test database and reports queries and latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument('suite', choices=sorted(SUITES))
+        parser.add_argument('--repeat', type=int, default=10, help="Timed runs per case")
+        parser.add_argument('--json', action='store_true', help="Print the results as JSON")
+
+    def handle(self, *args, **options):
+        with test_database():
+            rows = SUITES[options['suite']](repeat=options['repeat'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(rows, indent=2))
+            return
+        columns = list(rows[0])
+        widths = [max(len(str(c)), *(len(str(row[c])) for row in rows)) for c in columns]
+        self.stdout.write('  '.join(str(c).ljust(w) for c, w in zip(columns, widths)))
+        for row in rows:
+            self.stdout.write('  '.join(str(row[c]).ljust(w) for c, w in zip(columns, widths)))
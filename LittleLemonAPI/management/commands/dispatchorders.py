@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from LittleLemonAPI.dispatch import dispatcher
+
+
+class Command(BaseCommand):
+    help = "Assigns unassigned orders to the least loaded delivery crew members"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Orders assigned per UPDATE")
+        parser.add_argument('--all', action='store_true', help="Keep going until every order is assigned")
+
+    def handle(self, *args, **options):
+        # Start from the loads in the database, not this process's copy
+        dispatcher.invalidate()
+        total = 0
+        while True:
+            assigned = len(dispatcher.dispatch(options['batch_size']))
+            total += assigned
+            if not options['all'] or assigned < options['batch_size']:
+                break
+        self.stdout.write(self.style.SUCCESS(f"{total} orders assigned"))
@@ -0,0 +1,51 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from LittleLemonAPI.audit import ROLES
+from LittleLemonAPI.loadtest import ClientTransport, ServerTransport, run_load_test
+from LittleLemonAPI.seed import get_fixtures
+
+
+class Command(BaseCommand):
+    help = (
+        "Requests every API and restaurant URL as each role against a database filled by manage.py seedbench, "
+        "in this process or from a running server, and reports latency percentiles, throughput and queries"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100, help="Requests per URL and role")
+        parser.add_argument('--concurrency', type=int, default=4, help="Parallel clients")
+        parser.add_argument('--server', help="Base URL of a running server (THROTTLE_ENABLED = False) instead of the test client")
+        parser.add_argument('--roles', nargs='+', choices=ROLES, default=list(ROLES))
+        parser.add_argument('--writes', action='store_true', help="Also add to cart and check out (changes the database)")
+        parser.add_argument('--match', help="Only URLs containing this")
+        parser.add_argument('--output', help="Write the JSON report to this file")
+        parser.add_argument('--json', action='store_true', help="Print the JSON report")
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError("--requests and --concurrency must be at least 1")
+        try:
+            fixtures = get_fixtures()
+        except KeyError:
+            raise CommandError("The database has not been seeded; run manage.py seedbench first")
+        transport = ServerTransport(options['server']) if options['server'] else ClientTransport()
+        report = run_load_test(
+            transport, fixtures, requests=options['requests'], concurrency=options['concurrency'],
+            roles=options['roles'], writes=options['writes'], match=options['match'],
+        )
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.stdout.write(', '.join(f"{label}: {count}" for label, count in report['rows'].items()))
+        rows = [{k: v for k, v in result.items() if k != 'statuses'} for result in report['results']]
+        if not rows:
+            return
+        columns = list(rows[0])
+        widths = [max(len(str(c)), *(len(str(row[c])) for row in rows)) for c in columns]
+        self.stdout.write('  '.join(str(c).ljust(w) for c, w in zip(columns, widths)))
+        for row in rows:
+            self.stdout.write('  '.join(str(row[c]).ljust(w) for c, w in zip(columns, widths)))
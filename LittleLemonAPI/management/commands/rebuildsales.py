@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from LittleLemonAPI.models import DailySales, DailyMenuItemSales, Order
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuilds the daily sales rollups read by /api/reports from the orders and their items, "
+        "for orders written past the API (bulk inserts, the admin, deleted users)"
+    )
+
+    def handle(self, *args, **options):
+        Order.objects.rebuild_sales()
+        self.stdout.write(self.style.SUCCESS(
+            f"Sales rollups rebuilt: {DailySales.objects.count()} days, {DailyMenuItemSales.objects.count()} menu item days"
+        ))
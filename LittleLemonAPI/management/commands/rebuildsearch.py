@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand, CommandError
+from LittleLemonAPI.search import fts_available, rebuild_index
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the full-text search index of menu items from the menu tables"
+
+    def handle(self, *args, **options):
+        if not fts_available():
+            raise CommandError("The full-text search index is not available on this database")
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt"))
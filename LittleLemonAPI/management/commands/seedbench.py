@@ -0,0 +1,46 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from LittleLemonAPI.models import MenuItem, Order
+from LittleLemonAPI.search import fts_available, rebuild_index
+from LittleLemonAPI.seed import SEED_BATCH_SIZE, seed_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Fills an empty database with generated categories, menu items, users, orders and bookings "
+        "for load tests (see manage.py loadtest). The default volumes take a while."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--menu-items', type=int, default=100000)
+        parser.add_argument('--customers', type=int, default=100000)
+        parser.add_argument('--crew', type=int, default=50, help="Delivery crew members")
+        parser.add_argument('--orders', type=int, default=5000000, help="Orders, with 1 to 5 items each")
+        parser.add_argument('--bookings', type=int, default=1000000)
+        parser.add_argument('--days', type=int, default=730, help="Days of order history")
+        parser.add_argument('--seed', type=int, default=0, help="Random seed; the same seed gives the same rows")
+        parser.add_argument('--batch-size', type=int, default=SEED_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['customers'] < 1 or options['crew'] < 1 or options['categories'] < 1 or options['menu_items'] < 1:
+            raise CommandError("At least one category, menu item, customer and delivery crew member are needed")
+        if MenuItem.objects.exists() or Order.objects.exists():
+            raise CommandError("The database already has menu items or orders; run manage.py flush first")
+        if fts_available():
+            # flush leaves the search index behind
+            rebuild_index()
+
+        start = time.perf_counter()
+
+        def progress(table, count):
+            self.stdout.write(f"{table}: {count} ({time.perf_counter() - start:.0f} s)")
+
+        fixtures = seed_database(
+            customers=options['customers'], crew=options['crew'], categories=options['categories'],
+            menu_items=options['menu_items'], orders=options['orders'], bookings=options['bookings'],
+            days=options['days'], seed=options['seed'], batch_size=options['batch_size'], progress=progress,
+        )
+        for role, user in fixtures['users'].items():
+            self.stdout.write(f"{role}: {user.username}, token {user.auth_token.key}")
+        self.stdout.write(self.style.SUCCESS(f"Seeded in {time.perf_counter() - start:.0f} s"))
@@ -0,0 +1,69 @@
+from django.db import migrations
+
+# The SQL is spelled out here rather than imported from LittleLemonAPI.search,
+# so that this migration keeps building the index it always built whatever
+# becomes of that module.
+POPULATE_SQL = (
+    'INSERT INTO "LittleLemonAPI_menuitem_fts"(rowid, title, description, category) '
+    'SELECT m.id, m.title, m.description, c.title FROM "LittleLemonAPI_menuitem" m '
+    'INNER JOIN "LittleLemonAPI_category" c ON c.id = m.category_id'
+)
+
+CREATE_SQL = [
+    'CREATE VIRTUAL TABLE "LittleLemonAPI_menuitem_fts" USING fts5('
+    "title, description, category, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    'CREATE TRIGGER "LittleLemonAPI_menuitem_fts_ai" AFTER INSERT ON "LittleLemonAPI_menuitem" BEGIN '
+    f'{POPULATE_SQL} WHERE m.id = new.id; END',
+    'CREATE TRIGGER "LittleLemonAPI_menuitem_fts_au" AFTER UPDATE ON "LittleLemonAPI_menuitem" BEGIN '
+    'DELETE FROM "LittleLemonAPI_menuitem_fts" WHERE rowid = old.id; '
+    f'{POPULATE_SQL} WHERE m.id = new.id; END',
+    'CREATE TRIGGER "LittleLemonAPI_menuitem_fts_ad" AFTER DELETE ON "LittleLemonAPI_menuitem" BEGIN '
+    'DELETE FROM "LittleLemonAPI_menuitem_fts" WHERE rowid = old.id; END',
+    'CREATE TRIGGER "LittleLemonAPI_menuitem_fts_cu" AFTER UPDATE OF title ON "LittleLemonAPI_category" BEGIN '
+    'DELETE FROM "LittleLemonAPI_menuitem_fts" WHERE rowid IN '
+    '(SELECT id FROM "LittleLemonAPI_menuitem" WHERE category_id = new.id); '
+    f'{POPULATE_SQL} WHERE m.category_id = new.id; END',
+    POPULATE_SQL,
+]
+
+DROP_SQL = [
+    'DROP TRIGGER IF EXISTS "LittleLemonAPI_menuitem_fts_ai"',
+    'DROP TRIGGER IF EXISTS "LittleLemonAPI_menuitem_fts_au"',
+    'DROP TRIGGER IF EXISTS "LittleLemonAPI_menuitem_fts_ad"',
+    'DROP TRIGGER IF EXISTS "LittleLemonAPI_menuitem_fts_cu"',
+    'DROP TABLE IF EXISTS "LittleLemonAPI_menuitem_fts"',
+]
+
+
+def fts5_supported(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return ('ENABLE_FTS5',) in cursor.fetchall()
+
+
+def create_search_index(apps, schema_editor):
+    # Only SQLite builds with FTS5 get the index; search falls back to LIKE elsewhere
+    if not fts5_supported(schema_editor.connection):
+        return
+    for sql in CREATE_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0005_rename_desciption_menuitem_description'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:23
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def count_existing_bookings(apps, schema_editor):
+    Booking = apps.get_model('LittleLemonAPI', 'Booking')
+    SlotOccupancy = apps.get_model('LittleLemonAPI', 'SlotOccupancy')
+    totals = Booking.objects.values('reservation_date', 'reservation_slot').annotate(covers=Sum('guest_number')).order_by()
+    SlotOccupancy.objects.bulk_create([SlotOccupancy(**total) for total in totals], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0007_booking_date_slot_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlotOccupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reservation_date', models.DateField()),
+                ('reservation_slot', models.SmallIntegerField()),
+                ('covers', models.IntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('reservation_date', 'reservation_slot')},
+            },
+        ),
+        migrations.RunPython(count_existing_bookings, migrations.RunPython.noop),
+    ]
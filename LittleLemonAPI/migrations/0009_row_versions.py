@@ -0,0 +1,73 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:37
+
+from django.db import migrations, models
+
+# SQLite rebuilds a table to alter it, and the search index triggers would
+# fire on (or be dropped with) the old copy, so they are dropped first and
+# created again afterwards. The SQL is the same as in 0006_menuitem_fts,
+# spelled out here so that the migration does not depend on application code.
+POPULATE_SQL = (
+    'INSERT INTO "LittleLemonAPI_menuitem_fts"(rowid, title, description, category) '
+    'SELECT m.id, m.title, m.description, c.title FROM "LittleLemonAPI_menuitem" m '
+    'INNER JOIN "LittleLemonAPI_category" c ON c.id = m.category_id'
+)
+
+CREATE_TRIGGERS_SQL = [
+    'CREATE TRIGGER "LittleLemonAPI_menuitem_fts_ai" AFTER INSERT ON "LittleLemonAPI_menuitem" BEGIN '
+    f'{POPULATE_SQL} WHERE m.id = new.id; END',
+    'CREATE TRIGGER "LittleLemonAPI_menuitem_fts_au" AFTER UPDATE ON "LittleLemonAPI_menuitem" BEGIN '
+    'DELETE FROM "LittleLemonAPI_menuitem_fts" WHERE rowid = old.id; '
+    f'{POPULATE_SQL} WHERE m.id = new.id; END',
+    'CREATE TRIGGER "LittleLemonAPI_menuitem_fts_ad" AFTER DELETE ON "LittleLemonAPI_menuitem" BEGIN '
+    'DELETE FROM "LittleLemonAPI_menuitem_fts" WHERE rowid = old.id; END',
+    'CREATE TRIGGER "LittleLemonAPI_menuitem_fts_cu" AFTER UPDATE OF title ON "LittleLemonAPI_category" BEGIN '
+    'DELETE FROM "LittleLemonAPI_menuitem_fts" WHERE rowid IN '
+    '(SELECT id FROM "LittleLemonAPI_menuitem" WHERE category_id = new.id); '
+    f'{POPULATE_SQL} WHERE m.category_id = new.id; END',
+    # Catch up on anything written while the triggers were gone
+    'DELETE FROM "LittleLemonAPI_menuitem_fts"',
+    POPULATE_SQL,
+]
+
+DROP_TRIGGERS_SQL = [
+    'DROP TRIGGER IF EXISTS "LittleLemonAPI_menuitem_fts_ai"',
+    'DROP TRIGGER IF EXISTS "LittleLemonAPI_menuitem_fts_au"',
+    'DROP TRIGGER IF EXISTS "LittleLemonAPI_menuitem_fts_ad"',
+    'DROP TRIGGER IF EXISTS "LittleLemonAPI_menuitem_fts_cu"',
+]
+
+
+def drop_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in DROP_TRIGGERS_SQL:
+        schema_editor.execute(sql)
+
+
+def create_search_triggers(apps, schema_editor):
+    if 'LittleLemonAPI_menuitem_fts' not in schema_editor.connection.introspection.table_names():
+        return
+    for sql in CREATE_TRIGGERS_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0008_slotoccupancy'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_search_triggers, create_search_triggers),
+        migrations.AddField(
+            model_name='menuitem',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(create_search_triggers, drop_search_triggers),
+    ]
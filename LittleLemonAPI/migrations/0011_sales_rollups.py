@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Sum
+
+
+def sum_existing_orders(apps, schema_editor):
+    Order = apps.get_model('LittleLemonAPI', 'Order')
+    OrderItem = apps.get_model('LittleLemonAPI', 'OrderItem')
+    DailySales = apps.get_model('LittleLemonAPI', 'DailySales')
+    DailyMenuItemSales = apps.get_model('LittleLemonAPI', 'DailyMenuItemSales')
+    days = Order.objects.values('date').annotate(orders=Count('id'), revenue=Sum('total')).order_by()
+    DailySales.objects.bulk_create([DailySales(**day) for day in days], batch_size=1000)
+    items = OrderItem.objects.values('menuitem_id', date=F('order__date')).annotate(units=Sum('quantity'), revenue=Sum('price')).order_by()
+    DailyMenuItemSales.objects.bulk_create([DailyMenuItemSales(**item) for item in items], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0010_order_user_date_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True)),
+                ('orders', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DailyMenuItemSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('units', models.IntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('menuitem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='LittleLemonAPI.menuitem')),
+            ],
+            options={
+                'unique_together': {('date', 'menuitem')},
+            },
+        ),
+        migrations.RunPython(sum_existing_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:11
+
+import time
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def create_version(apps, schema_editor):
+    # Seeded from the clock, like catalogue.get_state() does for a lost row
+    CatalogueVersion = apps.get_model('LittleLemonAPI', 'CatalogueVersion')
+    CatalogueVersion.objects.create(pk=1, version=time.time_ns(), modified=timezone.now())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0011_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogueVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.BigIntegerField()),
+                ('modified', models.DateTimeField()),
+            ],
+        ),
+        migrations.RunPython(create_version, migrations.RunPython.noop),
+    ]
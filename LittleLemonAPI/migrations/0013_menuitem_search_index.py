@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0012_catalogue_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuItemSearchIndex',
+            fields=[
+                ('menuitem', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='LittleLemonAPI.menuitem')),
+                ('document', models.TextField(db_column='LittleLemonAPI_menuitem_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'LittleLemonAPI_menuitem_fts',
+                'managed': False,
+            },
+        ),
+    ]
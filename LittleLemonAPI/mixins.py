@@ -0,0 +1,124 @@
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import parse_etags
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from . import catalogue, fragments
+from .instrumentation import count_cache
+from .renderers import StreamingXMLRenderer
+from .serializers import ValuesProjection
+
+
+class CatalogueCacheMixin:
+    # Caches rendered list responses under the current catalogue version and
+    # answers If-None-Match with 304 with no query but the version's.
+    # The browsable API is rendered per user, so it is never cached.
+
+    def list(self, request, *args, **kwargs):
+        version = catalogue.get_version()
+        # Without a known version nothing could tell a stale entry apart
+        if request.accepted_renderer.format == 'api' or version is None:
+            return super().list(request, *args, **kwargs)
+        key = catalogue.cache_key(request, version)
+        response = self.get_cached_response(request, key)
+        if response is None:
+            response = self.cache_response(super().list(request, *args, **kwargs), key)
+        return response
+
+    def get_cached_response(self, request, key):
+        etag = catalogue.etag(key)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            catalogue.incr_stat('hits')
+            count_cache(hits=1)
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        cached = cache.get(key)
+        if cached is None:
+            catalogue.incr_stat('misses')
+            count_cache(misses=1)
+            return None
+        catalogue.incr_stat('hits')
+        count_cache(hits=1)
+        content, content_type = cached
+        response = HttpResponse(content, content_type=content_type)
+        response['ETag'] = etag
+        return response
+
+    def cache_response(self, response, key):
+        # Streamed responses are too big to be worth caching
+        if response.status_code == 200 and not response.streaming:
+            if isinstance(response, Response):
+                # Render now, the same way finalize_response() would, so
+                # that the bytes can be cached
+                response.accepted_renderer = self.request.accepted_renderer
+                response.accepted_media_type = self.request.accepted_media_type
+                response.renderer_context = self.get_renderer_context()
+                response.render()
+            cache.set(key, (response.content, response['Content-Type']), catalogue.CATALOGUE_CACHE_TIMEOUT)
+            response['ETag'] = catalogue.etag(key)
+        return response
+
+
+class ValuesProjectionMixin:
+    # values_projection = True serves list responses through ValuesProjection
+    # instead of the model serializer. The JSON is the same, only cheaper.
+    values_projection = False
+    # With fragment_cache = True as well, JSON responses are assembled from
+    # the rendered rows kept in fragments.fragment_cache. The model needs a
+    # `version` field that changes on every save.
+    fragment_cache = False
+
+    def get_projection(self):
+        if not self.values_projection:
+            return None
+        return ValuesProjection(self.get_serializer())
+
+    def list(self, request, *args, **kwargs):
+        projection = self.get_projection()
+        if projection is None:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.project(projection, self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_projected_response(projection, page, paginated=True)
+        return self.get_projected_response(projection, queryset, paginated=False)
+
+    def project(self, projection, queryset):
+        if self.fragment_cache:
+            return projection.apply(queryset, 'version')
+        return projection.apply(queryset)
+
+    def uses_fragments(self):
+        renderer = self.request.accepted_renderer
+        return (
+            self.fragment_cache and type(renderer) is JSONRenderer
+            and not renderer.get_indent(self.request.accepted_media_type, self.get_renderer_context())
+        )
+
+    def get_projected_response(self, projection, rows, paginated):
+        renderer = self.request.accepted_renderer
+        if isinstance(renderer, StreamingXMLRenderer):
+            # Rows are converted as the document is written out, and without
+            # pagination they are read from the database the same way
+            rows = rows if paginated else rows.iterator()
+            data = (projection.to_representation([row])[0] for row in rows)
+            if paginated:
+                data = self.get_paginated_response(data).data
+            return StreamingHttpResponse(renderer.stream(data), content_type=f'{renderer.media_type}; charset={renderer.charset}')
+
+        if not self.uses_fragments():
+            data = projection.to_representation(rows)
+            return self.get_paginated_response(data) if paginated else Response(data)
+
+        results = fragments.render_rows(rows, projection, renderer)
+        if paginated:
+            # Render the envelope around an empty result list and splice the
+            # rows in; the pagination classes put the results last
+            envelope = renderer.render(self.get_paginated_response([]).data)
+            if not envelope.endswith(b'[]}'):
+                return self.get_paginated_response(projection.to_representation(rows))
+            results = envelope[:-3] + results + b'}'
+        return HttpResponse(results, content_type=renderer.media_type)
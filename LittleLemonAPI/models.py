@@ -1,6 +1,32 @@
-from django.db import models
+from datetime import date
+from django.conf import settings
+from django.db import connections, models, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from .roles import is_delivery_crew
+
+class RowVersionMixin:
+    # For models with a `version` field that cached representations of the
+    # row are keyed by. save() bumps it in the database (version = version
+    # + 1), so two concurrent saves of a row never end up with the same
+    # version; the new value is read back when next accessed. Queryset
+    # updates have to bump it themselves.
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.version += 1
+            super().save(*args, **kwargs)
+            return
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+        self.version = F('version') + 1
+        try:
+            super().save(*args, **kwargs)
+        finally:
+            # Deferred, so the next read loads it
+            self.__dict__.pop('version', None)
 
 # Create your models here.
 class Category(models.Model):
@@ -10,17 +36,93 @@ class Category(models.Model):
     def __str__(self):
         return self.title
 
-class MenuItem(models.Model):
+class MenuItem(RowVersionMixin, models.Model):
     # title, price, featured, category
     title = models.CharField(max_length=255, db_index=True, unique=True)
     price = models.DecimalField(max_digits=6, decimal_places=2, db_index=True)
     description = models.CharField(max_length=1000, default='none')
     featured = models.BooleanField(db_index=True)
     category = models.ForeignKey(Category, on_delete=models.PROTECT)
+    # Bumped on every save; cached representations of the row are keyed by it
+    version = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.title
 
+class MenuItemSearchIndex(models.Model):
+    # The FTS5 table that migration 0006_menuitem_fts creates on SQLite builds
+    # with FTS5 (see search.py). Not managed by Django; declared so that
+    # search queries can join it. Its rowid is the menu item id, the hidden
+    # column named after the table takes MATCH queries and `rank` is the
+    # relevance of the match, lower first.
+    menuitem = models.OneToOneField(
+        MenuItem, primary_key=True, db_column='rowid', db_constraint=False,
+        on_delete=models.DO_NOTHING, related_name='search_index',
+    )
+    document = models.TextField(db_column='LittleLemonAPI_menuitem_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'LittleLemonAPI_menuitem_fts'
+
+@MenuItemSearchIndex._meta.get_field('document').register_lookup
+class Match(models.Lookup):
+    # search_index__document__match=expression -> "fts"."fts" MATCH expression
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', [*lhs_params, *rhs_params]
+
+class CatalogueVersion(models.Model):
+    # A single row that every worker process reads the catalogue version from
+    # and that menu changes bump in the database (see catalogue.py)
+    version = models.BigIntegerField()
+    modified = models.DateTimeField()
+
+class CartManager(models.Manager):
+    def add_items(self, user, items):
+        # Adds (menuitem id, quantity) pairs to the user's cart with a single
+        # upsert that also looks up the menu item prices: a menu item already
+        # in the cart gets its quantity increased and its price recomputed.
+        # Raises MenuItem.DoesNotExist (adding nothing) for unknown menu items.
+        items = list(items)
+        if not items:
+            raise ValidationError("No items to add.")
+        table, menuitem = self.model._meta.db_table, MenuItem._meta.db_table
+        connection = connections[self.db]
+        q = connection.ops.quote_name
+        sql = (
+            f"WITH new_item (menuitem_id, quantity) AS (VALUES {', '.join(['(%s, %s)'] * len(items))}) "
+            f"INSERT INTO {q(table)} (user_id, menuitem_id, quantity, unitprice, price) "
+            f"SELECT %s, m.id, new_item.quantity, m.price, ROUND(m.price * new_item.quantity, 2) "
+            f"FROM new_item INNER JOIN {q(menuitem)} m ON m.id = new_item.menuitem_id WHERE true "
+            f"ON CONFLICT (user_id, menuitem_id) DO UPDATE SET "
+            f"quantity = quantity + excluded.quantity, unitprice = excluded.unitprice, "
+            f"price = ROUND(excluded.unitprice * (quantity + excluded.quantity), 2) "
+            f"RETURNING id, menuitem_id, quantity, unitprice, price"
+        )
+        params = [value for item in items for value in item] + [user.pk]
+        price_field = self.model._meta.get_field('price')
+        with transaction.atomic(using=self.db):
+            with connection.cursor() as cursor:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+            missing = {menuitem_id for menuitem_id, _ in items} - {row[1] for row in rows}
+            if missing:
+                raise MenuItem.DoesNotExist(f"No menu item with id {', '.join(map(str, sorted(missing)))}.")
+            # A menu item listed twice comes back twice; the last row is the total
+            carts = [
+                self.model(id=id, user=user, menuitem_id=menuitem_id, quantity=quantity,
+                           unitprice=price_field.to_python(unitprice), price=price_field.to_python(price))
+                for id, menuitem_id, quantity, unitprice, price in {row[0]: row for row in rows}.values()
+            ]
+            if any(cart.price >= 10 ** (price_field.max_digits - price_field.decimal_places) for cart in carts):
+                raise ValidationError("Cart line price is too large.")
+        return carts
+
 class Cart(models.Model):
     # user, menuitem, quantity, unitprice, price
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -29,23 +131,131 @@ class Cart(models.Model):
     unitprice = models.DecimalField(max_digits=6, decimal_places=2)
     price = models.DecimalField(max_digits=6, decimal_places=2)
 
+    objects = CartManager()
+
     class Meta:
         unique_together = ('user', 'menuitem')
 
 class DeliveryCrewManager(models.Manager):
     def clean_delivery_crew(self, user):
         # Ensure that the user belongs to the 'Delivery Crew' group
-        if 'Delivery crew' not in [group.name for group in user.groups.all()]:
+        if not is_delivery_crew(user):
             raise ValidationError("User must belong to the 'Delivery crew' group.")
 
-class Order(models.Model):
+class OrderManager(DeliveryCrewManager):
+    def create_from_cart(self, user):
+        # Turns the user's cart into an order with a fixed number of queries,
+        # whatever the number of cart lines, and all or nothing
+        with transaction.atomic():
+            cart_items = list(Cart.objects.filter(user=user).select_related('menuitem'))
+            if not cart_items:
+                raise ValidationError("Cart is empty.")
+            errors = [
+                f"Invalid quantity or price for '{item.menuitem.title}'."
+                for item in cart_items
+                if item.quantity < 1 or item.price != item.unitprice * item.quantity
+            ]
+            if errors:
+                raise ValidationError(errors)
+
+            order = self.create(user=user, total=0, date=date.today())
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, menuitem_id=item.menuitem_id, quantity=item.quantity, unitprice=item.unitprice, price=item.price)
+                for item in cart_items
+            ])
+            total = OrderItem.objects.filter(order=order).aggregate(total=Sum('price'))['total']
+            total_field = self.model._meta.get_field('total')
+            if total >= 10 ** (total_field.max_digits - total_field.decimal_places):
+                raise ValidationError("Order total is too large.")
+            self.filter(pk=order.pk).update(total=total, version=F('version') + 1)
+            order.total = total
+            order.version += 1
+            # Only delete the rows that made it into the order
+            Cart.objects.filter(pk__in=[item.pk for item in cart_items]).delete()
+            self.record_sales(order, [(item.menuitem_id, item.quantity, item.price) for item in cart_items])
+        return order
+
+    def delete_order(self, order):
+        # Deletes the order and takes it out of the sales rollups, all or nothing
+        with transaction.atomic():
+            self.record_sales(order, sign=-1)
+            order.delete()
+
+    def record_sales(self, order, lines=None, sign=1):
+        # Adds the order to the daily sales rollups (or takes it out, with
+        # sign=-1) with one upsert per table, whatever its number of items.
+        # `lines` are the (menuitem id, quantity, price) of its items, read
+        # from the database when not given. Days and dishes left without
+        # sales are deleted, so that the tables match a rebuild_sales().
+        if lines is None:
+            lines = list(OrderItem.objects.filter(order=order).values_list('menuitem_id', 'quantity', 'price'))
+        connection = connections[self.db]
+        q = connection.ops.quote_name
+        daily, item = q(DailySales._meta.db_table), q(DailyMenuItemSales._meta.db_table)
+        # Part of the caller's transaction, if there is one
+        with transaction.atomic(using=self.db, savepoint=False), connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {daily} (date, orders, revenue) VALUES (%s, %s, %s) "
+                f"ON CONFLICT (date) DO UPDATE SET "
+                f"orders = orders + excluded.orders, revenue = ROUND(revenue + excluded.revenue, 2)",
+                [order.date, sign, sign * order.total],
+            )
+            if lines:
+                cursor.execute(
+                    f"INSERT INTO {item} (date, menuitem_id, units, revenue) VALUES {', '.join(['(%s, %s, %s, %s)'] * len(lines))} "
+                    f"ON CONFLICT (date, menuitem_id) DO UPDATE SET "
+                    f"units = units + excluded.units, revenue = ROUND(revenue + excluded.revenue, 2)",
+                    [value for menuitem_id, quantity, price in lines for value in (order.date, menuitem_id, sign * quantity, sign * price)],
+                )
+            if sign < 0:
+                DailySales.objects.filter(date=order.date, orders__lte=0).delete()
+                DailyMenuItemSales.objects.filter(date=order.date, units__lte=0).delete()
+
+    def move_sales(self, before, order):
+        # Moves the order's sales from the date and total it had (`before`)
+        # to its current ones
+        lines = list(OrderItem.objects.filter(order=order).values_list('menuitem_id', 'quantity', 'price'))
+        with transaction.atomic(using=self.db, savepoint=False):
+            self.record_sales(before, lines, sign=-1)
+            self.record_sales(order, lines)
+
+    def rebuild_sales(self):
+        # Recomputes the sales rollups from Order and OrderItem, for orders
+        # written without record_sales() (bulk inserts, the admin, deleted users)
+        connection = connections[self.db]
+        q = connection.ops.quote_name
+        order, order_item = q(self.model._meta.db_table), q(OrderItem._meta.db_table)
+        with transaction.atomic(using=self.db):
+            DailySales.objects.all().delete()
+            DailyMenuItemSales.objects.all().delete()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {q(DailySales._meta.db_table)} (date, orders, revenue) "
+                    f"SELECT date, COUNT(*), ROUND(SUM(total), 2) FROM {order} GROUP BY date"
+                )
+                cursor.execute(
+                    f"INSERT INTO {q(DailyMenuItemSales._meta.db_table)} (date, menuitem_id, units, revenue) "
+                    f"SELECT o.date, i.menuitem_id, SUM(i.quantity), ROUND(SUM(i.price), 2) "
+                    f"FROM {order_item} i INNER JOIN {order} o ON o.id = i.order_id GROUP BY o.date, i.menuitem_id"
+                )
+
+class Order(RowVersionMixin, models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     delivery_crew = models.ForeignKey(User, on_delete=models.SET_NULL, related_name='delivery_crew_user', null=True)
     status = models.BooleanField(db_index=True, default=False)
     total = models.DecimalField(max_digits=6, decimal_places=2)
     date = models.DateField(db_index=True)
+    # Bumped on every save; cached representations of the row are keyed by it
+    version = models.PositiveIntegerField(default=0, editable=False)
 
-    objects = DeliveryCrewManager()
+    objects = OrderManager()
+
+    class Meta:
+        indexes = [
+            # Customers' and delivery crews' orders by date (see manage.py auditqueries)
+            models.Index(fields=['user', 'date'], name='order_user_date_idx'),
+            models.Index(fields=['delivery_crew', 'date'], name='order_delivery_crew_date_idx'),
+        ]
 
     def clean(self):
         # Check the user's group when saving the model
@@ -56,6 +266,7 @@ class Order(models.Model):
         # Check the user's group when saving the model
         if self.delivery_crew:
             Order.objects.clean_delivery_crew(self.delivery_crew)
+        super().save(*args, **kwargs)
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
@@ -67,6 +278,79 @@ class OrderItem(models.Model):
     class Meta:
         unique_together = ('order', 'menuitem')
 
+class DailySales(models.Model):
+    # Orders and revenue per day, updated in the same transaction as the
+    # orders (see OrderManager.record_sales) so that sales reports read one
+    # row per day instead of scanning the orders
+    date = models.DateField(unique=True)
+    orders = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+class DailyMenuItemSales(models.Model):
+    # Units sold and revenue per menu item and day, kept like DailySales
+    date = models.DateField()
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ('date', 'menuitem')
+
+class SlotOccupancy(models.Model):
+    # Covers booked per date and slot, updated in the same transaction as the
+    # booking insert, edit or delete so that availability never needs a scan
+    # of Booking
+    reservation_date = models.DateField()
+    reservation_slot = models.SmallIntegerField()
+    covers = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('reservation_date', 'reservation_slot')
+
+class BookingManager(models.Manager):
+    def create_booking(self, **fields):
+        # Reserves the covers with a single conditional UPDATE, which the
+        # database serializes, so concurrent bookings can never overbook a slot
+        date, slot, guests = fields['reservation_date'], fields['reservation_slot'], fields['guest_number']
+        capacity = settings.BOOKING_SLOT_COVERS.get(slot)
+        if capacity is None:
+            raise ValidationError("There is no reservation slot %(slot)s.", params={'slot': slot})
+        if guests < 1:
+            raise ValidationError("A booking needs at least one guest.")
+        with transaction.atomic():
+            # Writing first takes the write lock straight away on SQLite
+            SlotOccupancy.objects.bulk_create([SlotOccupancy(reservation_date=date, reservation_slot=slot)], ignore_conflicts=True)
+            reserved = SlotOccupancy.objects.filter(
+                reservation_date=date, reservation_slot=slot, covers__lte=capacity - guests,
+            ).update(covers=F('covers') + guests)
+            if not reserved:
+                raise ValidationError("Not enough free tables in this slot for %(guests)s guests.", params={'guests': guests})
+            booking = self.model(**fields)
+            # Already counted; tells the post_save receiver not to add them again
+            booking._covers_reserved = True
+            booking.save(force_insert=True, using=self.db)
+            return booking
+
+    def add_covers(self, date, slot, guests):
+        # For bookings saved past create_booking (admin, forms, edits): counted
+        # without the capacity check, availability never goes below zero
+        SlotOccupancy.objects.bulk_create([SlotOccupancy(reservation_date=date, reservation_slot=slot)], ignore_conflicts=True)
+        SlotOccupancy.objects.filter(reservation_date=date, reservation_slot=slot).update(covers=F('covers') + guests)
+
+    def release_covers(self, date, slot, guests):
+        SlotOccupancy.objects.filter(reservation_date=date, reservation_slot=slot).update(
+            covers=Greatest(F('covers') - guests, 0),
+        )
+
+    def availability(self, date):
+        booked = dict(
+            SlotOccupancy.objects.filter(reservation_date=date).values_list('reservation_slot', 'covers')
+        )
+        return [
+            {'slot': slot, 'covers': covers, 'booked': booked.get(slot, 0), 'available': max(covers - booked.get(slot, 0), 0)}
+            for slot, covers in sorted(settings.BOOKING_SLOT_COVERS.items())
+        ]
+
 class Booking(models.Model):
    first_name = models.CharField(max_length=200)    
    last_name = models.CharField(max_length=200)
@@ -75,5 +359,12 @@ class Booking(models.Model):
    reservation_slot = models.SmallIntegerField()
    comment = models.CharField(max_length=1000)
 
+   objects = BookingManager()
+
+   class Meta:
+      indexes = [
+         models.Index(fields=['reservation_date', 'reservation_slot'], name='booking_date_slot_idx'),
+      ]
+
    def __str__(self):
       return self.first_name + ' ' + self.last_name
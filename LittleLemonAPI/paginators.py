@@ -1,7 +1,217 @@
-from rest_framework.pagination import PageNumberPagination
+import binascii
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from django.core.exceptions import ValidationError
+from django.core.paginator import InvalidPage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
 
 
-class StandardResultsSetPagination(PageNumberPagination):
+class KeysetPagination(BasePagination):
+    # Seeks on the (ordering fields..., id) tuple instead of counting and
+    # offsetting, so every page costs the same and stays stable while rows are
+    # being inserted. Cursors are opaque tokens holding the boundary row's values.
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = None
+    max_page_size = None
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset = self.seek(queryset, request, view)
+        return self.finish_page(list(queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset = self.seek(queryset, request, view)
+        return self.finish_page([row async for row in queryset])
+
+    def seek(self, queryset, request, view):
+        # One row more than the page size tells whether there is another page
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering = self.get_ordering(request, view)
+        position, self.reverse = self.decode_cursor(request)
+        self.has_position = position is not None
+
+        ordering = [self.flip(term) for term in self.ordering] if self.reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            try:
+                queryset = queryset.filter(self.after(ordering, position))
+            except (ValidationError, TypeError, ValueError):
+                raise NotFound(self.invalid_cursor_message)
+        return queryset[:self.page_size + 1]
+
+    def finish_page(self, results):
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if self.reverse:
+            results.reverse()
+
+        # Walking backwards always leaves a next page behind; walking forwards
+        # leaves a previous page behind unless this is the first page
+        has_next = True if self.reverse else has_more
+        has_previous = has_more if self.reverse else self.has_position
+        self.next_position = self.position(results[-1]) if results and has_next else None
+        self.previous_position = self.position(results[0]) if results and has_previous else None
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                page_size = int(request.query_params[self.page_size_query_param])
+                if page_size > 0:
+                    return min(page_size, self.max_page_size) if self.max_page_size else page_size
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_ordering(self, request, view):
+        # Any leading terms of ?ordering= the view allows, or else the view's
+        # cursor_ordering, with id as the tie breaker
+        allowed = set(getattr(view, 'ordering_fields', None) or []) | {'id'}
+        params = request.query_params.get(api_settings.ORDERING_PARAM, '')
+        terms = [term.strip() for term in params.split(',') if term.strip()]
+        if not terms:
+            terms = list(getattr(view, 'cursor_ordering', []))
+            allowed |= {term.lstrip('-') for term in terms}
+        ordering = []
+        for term in terms:
+            if term.lstrip('-') not in allowed:
+                break
+            ordering.append(term)
+            if term.lstrip('-') == 'id':
+                return ordering
+        descending = bool(ordering) and ordering[0].startswith('-')
+        return ordering + ['-id' if descending else 'id']
+
+    def after(self, ordering, position):
+        # Lexicographic "comes after" over the ordering tuple:
+        # (a > x) OR (a = x AND b > y) OR ...
+        condition = Q()
+        equal = Q()
+        for term, value in zip(ordering, position):
+            field = term.lstrip('-')
+            lookup = 'lt' if term.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def position(self, row):
+        fields = [term.lstrip('-') for term in self.ordering]
+        if isinstance(row, dict):
+            return [row[field] for field in fields]
+        return [getattr(row, field) for field in fields]
+
+    def flip(self, term):
+        return term[1:] if term.startswith('-') else '-' + term
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            position, reverse = cursor['p'], bool(cursor.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, position, reverse):
+        cursor = {'p': position, 'r': 1} if reverse else {'p': position}
+        encoded = urlsafe_b64encode(json.dumps(cursor, cls=DjangoJSONEncoder).encode()).decode('ascii')
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, reverse=False)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+
+class AsyncPageNumberPagination(PageNumberPagination):
+    # Adds apaginate_queryset() for async views: the COUNT and the page slice
+    # go through the async ORM, the rest is PageNumberPagination as is
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = self.django_paginator_class(queryset, page_size)
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        if page_number in self.last_page_strings:
+            page_number = paginator.num_pages
+        try:
+            number = paginator.validate_number(page_number)
+        except InvalidPage as exc:
+            msg = self.invalid_page_message.format(page_number=page_number, message=str(exc))
+            raise NotFound(msg)
+
+        bottom = (number - 1) * page_size
+        objects = [obj async for obj in queryset[bottom:bottom + page_size]]
+        self.page = paginator._get_page(objects, number, paginator)
+        if paginator.num_pages > 1 and self.template is not None:
+            self.display_page_controls = True
+        return objects
+
+
+class StandardResultsSetPagination(AsyncPageNumberPagination):
     page_size = 5
     page_size_query_param = 'page_size'
-    max_page_size = 1000
\ No newline at end of file
+    max_page_size = 1000
+    # ?cursor= (even empty) switches to keyset pagination
+    cursor_query_param = 'cursor'
+
+    def get_keyset(self, request):
+        if self.cursor_query_param not in request.query_params:
+            return None
+        keyset = KeysetPagination()
+        keyset.page_size = self.page_size
+        keyset.page_size_query_param = self.page_size_query_param
+        keyset.max_page_size = self.max_page_size
+        keyset.cursor_query_param = self.cursor_query_param
+        return keyset
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.get_keyset(request)
+        if self.keyset is not None:
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.get_keyset(request)
+        if self.keyset is not None:
+            return await self.keyset.apaginate_queryset(queryset, request, view)
+        return await super().apaginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class BookingPagination(KeysetPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
@@ -0,0 +1,28 @@
+import csv
+import io
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+def read_csv(stream, encoding='utf-8'):
+    # Rows as dicts keyed by the header line; empty cells are left out, as if
+    # the column was not given
+    try:
+        text = stream.read().decode(encoding)
+    except UnicodeDecodeError as exc:
+        raise ParseError(f'CSV parse error - {exc}')
+    try:
+        return [
+            {key: value for key, value in row.items() if value != ''}
+            for row in csv.DictReader(io.StringIO(text))
+        ]
+    except csv.Error as exc:
+        raise ParseError(f'CSV parse error - {exc}')
+
+
+class CSVParser(BaseParser):
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', 'utf-8')
+        return read_csv(stream, encoding)
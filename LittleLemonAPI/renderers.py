@@ -0,0 +1,125 @@
+import csv
+import io
+import json
+from itertools import groupby
+from types import GeneratorType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.xmlutils import SimplerXMLGenerator
+from rest_framework.renderers import BaseRenderer
+from rest_framework_xml.renderers import XMLRenderer
+
+# Export rows are flat (order columns followed by order item columns); the
+# renderers below turn an iterator of them into a stream of text chunks.
+ORDER_EXPORT_COLUMNS = ('order', 'user', 'delivery_crew', 'status', 'total', 'date', 'menuitem', 'quantity', 'unitprice', 'price')
+ORDER_COLUMNS = 6
+
+# Chunks handed to the server are at least this many characters
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class CSVRenderer(BaseRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Used for regular (error) responses
+        if data is None:
+            return ''
+        rows = data if isinstance(data, list) else [data]
+        buffer = io.StringIO()
+        if rows:
+            writer = csv.DictWriter(buffer, fieldnames=list(rows[0]))
+            writer.writeheader()
+            writer.writerows(rows)
+        return buffer.getvalue()
+
+    def stream_orders(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(ORDER_EXPORT_COLUMNS)
+        for row in rows:
+            writer.writerow(row[:3] + (int(row[3]),) + row[4:])
+            if buffer.tell() >= STREAM_CHUNK_SIZE:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+
+def group_orders(rows):
+    # One dict per order with its items nested; rows arrive grouped by order
+    for order, items in groupby(rows, key=lambda row: row[:ORDER_COLUMNS]):
+        line = {'id': order[0], **dict(zip(ORDER_EXPORT_COLUMNS[1:ORDER_COLUMNS], order[1:]))}
+        line['items'] = [
+            dict(zip(ORDER_EXPORT_COLUMNS[ORDER_COLUMNS:], item[ORDER_COLUMNS:]))
+            for item in items if item[ORDER_COLUMNS] is not None
+        ]
+        yield line
+
+
+class NDJSONRenderer(BaseRenderer):
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return ''
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in rows)
+
+    def stream_orders(self, rows):
+        # One line per order
+        chunk = []
+        size = 0
+        for line in group_orders(rows):
+            chunk.append(json.dumps(line, cls=DjangoJSONEncoder) + '\n')
+            size += len(chunk[-1])
+            if size >= STREAM_CHUNK_SIZE:
+                yield ''.join(chunk)
+                chunk, size = [], 0
+        yield ''.join(chunk)
+
+
+class StreamingXMLRenderer(XMLRenderer):
+    # The same document as XMLRenderer, but stream() yields it in chunks as
+    # list items are written, and lists may be generators, so a big page or
+    # export never has to exist as one string
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return ''
+        return ''.join(self.stream(data))
+
+    def stream(self, data):
+        buffer = io.StringIO()
+        xml = SimplerXMLGenerator(buffer, self.charset)
+        xml.startDocument()
+        xml.startElement(self.root_tag_name, {})
+        yield from self._stream_xml(xml, buffer, data)
+        xml.endElement(self.root_tag_name)
+        xml.endDocument()
+        yield buffer.getvalue()
+
+    def _stream_xml(self, xml, buffer, data):
+        if isinstance(data, (list, tuple, GeneratorType)):
+            for item in data:
+                xml.startElement(self.item_tag_name, {})
+                self._to_xml(xml, item)
+                xml.endElement(self.item_tag_name)
+                if buffer.tell() >= STREAM_CHUNK_SIZE:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+        elif isinstance(data, dict):
+            for key, value in data.items():
+                xml.startElement(key, {})
+                yield from self._stream_xml(xml, buffer, value)
+                xml.endElement(key)
+        else:
+            self._to_xml(xml, data)
+
+    def stream_orders(self, rows):
+        # One <list-item> per order with its items nested
+        return self.stream(group_orders(rows))
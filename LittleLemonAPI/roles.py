@@ -0,0 +1,45 @@
+MANAGER = 'Manager'
+DELIVERY_CREW = 'Delivery crew'
+
+# Roles are resolved at most once per request, memoized on the user instance
+# (the token cache hands every request its own copy). They are not cached
+# across requests: the cache is per process, so a user removed from the
+# Manager group would keep its permissions in the other worker processes.
+_REQUEST_ATTR = '_littlelemon_roles'
+
+
+def get_roles(user):
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, _REQUEST_ATTR, None)
+    if roles is None:
+        roles = frozenset(user.groups.values_list('name', flat=True))
+        setattr(user, _REQUEST_ATTR, roles)
+    return roles
+
+
+async def aget_roles(user):
+    # get_roles() for async views; memoizes on the user the same way, so sync
+    # code running later in the request finds the roles without a query
+    if user is None or not user.is_authenticated:
+        return frozenset()
+    roles = getattr(user, _REQUEST_ATTR, None)
+    if roles is None:
+        roles = frozenset([name async for name in user.groups.values_list('name', flat=True)])
+        setattr(user, _REQUEST_ATTR, roles)
+    return roles
+
+
+def is_manager(user):
+    return MANAGER in get_roles(user)
+
+
+def is_delivery_crew(user):
+    return DELIVERY_CREW in get_roles(user)
+
+
+def is_customer(user):
+    # Registered users who are not members of either group are customers
+    roles = get_roles(user)
+    return MANAGER not in roles and DELIVERY_CREW not in roles
+
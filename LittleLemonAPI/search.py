@@ -0,0 +1,66 @@
+import re
+from django.db import connections
+from rest_framework import filters
+from rest_framework.settings import api_settings
+from .models import Category, MenuItem
+
+# FTS5 index over menu item title, description and category title, kept in
+# sync by SQLite triggers so that bulk writes and queryset updates are
+# covered too. The rowid of an index row is the menu item id. Migration
+# 0006_menuitem_fts creates both; migrations that alter menu items or
+# categories have to drop the triggers first and create them again.
+FTS_TABLE = 'LittleLemonAPI_menuitem_fts'
+
+_available = {}
+
+
+def _q(name):
+    return connections['default'].ops.quote_name(name)
+
+
+def _populate_sql():
+    menuitem, category = MenuItem._meta.db_table, Category._meta.db_table
+    return (
+        f'INSERT INTO {_q(FTS_TABLE)}(rowid, title, description, category) '
+        f'SELECT m.id, m.title, m.description, c.title FROM {_q(menuitem)} m '
+        f'INNER JOIN {_q(category)} c ON c.id = m.category_id'
+    )
+
+
+def fts_available(using='default'):
+    # The migration only creates the index where FTS5 is compiled in
+    connection = connections[using]
+    key = (using, str(connection.settings_dict['NAME']))
+    if key not in _available:
+        _available[key] = connection.vendor == 'sqlite' and FTS_TABLE in connection.introspection.table_names()
+    return _available[key]
+
+
+def rebuild_index(using='default'):
+    with connections[using].cursor() as cursor:
+        cursor.execute(f'DELETE FROM {_q(FTS_TABLE)}')
+        cursor.execute(_populate_sql())
+
+
+def match_expression(terms):
+    # Every word must match, each as a prefix: "gree sal" -> "gree"* "sal"*
+    words = [word for term in terms for word in re.findall(r'\w+', term)]
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+class FullTextSearchFilter(filters.SearchFilter):
+    # ?search= over the FTS5 index, ranked by relevance unless ?ordering= is
+    # given. Falls back to the regular SearchFilter when the index is missing.
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms or queryset.model is not MenuItem or not fts_available(queryset.db):
+            return super().filter_queryset(request, queryset, view)
+
+        expression = match_expression(terms)
+        if not expression:
+            return queryset.none()
+        queryset = queryset.filter(search_index__document__match=expression)
+        if not request.query_params.get(api_settings.ORDERING_PARAM):
+            queryset = queryset.order_by('search_index__rank', 'id')
+        return queryset
@@ -0,0 +1,215 @@
+import random
+from bisect import bisect
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import accumulate
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import Group, User
+from django.db import transaction
+from rest_framework.authtoken.models import Token
+from .models import Category, MenuItem, Cart, Order, OrderItem, Booking, SlotOccupancy
+from .roles import DELIVERY_CREW, MANAGER
+
+# Rows per bulk_create and per transaction
+SEED_BATCH_SIZE = 10000
+
+CATEGORY_TITLES = ['Starters', 'Mains', 'Desserts', 'Drinks', 'Specials']
+FIRST_NAMES = ['Alex', 'Maria', 'Sam', 'Noah', 'Emma', 'Liam', 'Olivia', 'Ava', 'Lucas', 'Mia', 'Ethan', 'Zoe']
+LAST_NAMES = ['Smith', 'Garcia', 'Jones', 'Brown', 'Miller', 'Davis', 'Lopez', 'Wilson', 'Moore', 'Taylor']
+
+# Lines per order and units per line
+LINES_WEIGHTS = [30, 30, 20, 12, 8]
+QUANTITY_WEIGHTS = [75, 18, 5, 2]
+
+
+def zipf_weights(count, exponent=1.1):
+    # A few rows are very popular and most are rarely picked
+    return [1 / (rank + 1) ** exponent for rank in range(count)]
+
+
+def day_weights(today, days):
+    # Orders per day over the past `days` days: the business grows towards
+    # today, and weekends are busier
+    weights = []
+    for age in range(days):
+        day = today - timedelta(days=age)
+        weights.append((2 - age / days) * (1.5 if day.weekday() >= 4 else 1))
+    return weights
+
+
+class Picker:
+    # Weighted random choice with the cumulative weights computed once,
+    # since random.choices() would redo that on every call
+    def __init__(self, rng, population, weights):
+        self.rng = rng
+        self.population = population
+        self.cum_weights = list(accumulate(weights))
+
+    def __call__(self):
+        return self.population[bisect(self.cum_weights, self.rng.random() * self.cum_weights[-1])]
+
+
+def in_batches(objects, model, batch_size):
+    # bulk_create()s objects from an iterable without holding them all
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) == batch_size:
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        with transaction.atomic():
+            model.objects.bulk_create(batch)
+
+
+def seed_database(customers=50, crew=5, categories=5, menu_items=200, orders=1000, bookings=300,
+                  days=365, seed=0, batch_size=SEED_BATCH_SIZE, progress=None):
+    # Fills an empty database with a restaurant's worth of rows, always the
+    # same ones for the same arguments: menu items priced around 12 with a
+    # long tail, a few of them and a few of the customers account for most
+    # of the orders, orders pick up towards today and at weekends, and the
+    # bookings fill the evening slots first, from the next two weeks back.
+    # `progress` is called with a table and the number of rows created.
+    # Returns one user of each role (each with a token) and a sample of the
+    # rows, see get_fixtures().
+    rng = random.Random(seed)
+    today = date.today()
+    password = make_password(None)
+    report = progress or (lambda table, count: None)
+
+    managers = Group.objects.get_or_create(name=MANAGER)[0]
+    delivery_crew = Group.objects.get_or_create(name=DELIVERY_CREW)[0]
+    User.objects.bulk_create(
+        [User(username='seed-manager', password=password)]
+        + [User(username=f'seed-crew-{i}', password=password) for i in range(crew)]
+    )
+    in_batches((User(username=f'seed-customer-{i}', password=password) for i in range(customers)), User, batch_size)
+    users = dict(User.objects.filter(username__startswith='seed-').values_list('username', 'pk'))
+    crew_ids = [users[f'seed-crew-{i}'] for i in range(crew)]
+    customer_ids = [users[f'seed-customer-{i}'] for i in range(customers)]
+    User.groups.through.objects.bulk_create(
+        [User.groups.through(user_id=users['seed-manager'], group=managers)]
+        + [User.groups.through(user_id=user_id, group=delivery_crew) for user_id in crew_ids]
+    )
+    report('users', len(users))
+
+    titles = CATEGORY_TITLES[:categories] + [f'Category {i}' for i in range(len(CATEGORY_TITLES), categories)]
+    category_rows = Category.objects.bulk_create([Category(slug=title.lower().replace(' ', '-'), title=title) for title in titles])
+    pick_category = Picker(rng, category_rows, zipf_weights(categories, 0.8))
+    report('categories', categories)
+
+    def menu_item(i):
+        price = min(max(rng.lognormvariate(2.4, 0.45), 2.5), 99.99)
+        return MenuItem(
+            title=f'Dish {i}', price=Decimal(f'{price:.2f}'), featured=rng.random() < 0.05,
+            description=f'Seasonal dish number {i}', category=pick_category(),
+        )
+    in_batches((menu_item(i) for i in range(menu_items)), MenuItem, batch_size)
+    menu = list(MenuItem.objects.filter(title__startswith='Dish ').order_by('id').values_list('pk', 'price'))
+    report('menu items', menu_items)
+
+    # Popularity is unrelated to the order the dishes were created in
+    popular = rng.sample(menu, len(menu))
+    pick_item = Picker(rng, popular, zipf_weights(len(popular)))
+    pick_customer = Picker(rng, customer_ids, [rng.paretovariate(2) for _ in customer_ids])
+    pick_age = Picker(rng, range(days), day_weights(today, days))
+    pick_lines = Picker(rng, range(1, len(LINES_WEIGHTS) + 1), LINES_WEIGHTS)
+    pick_quantity = Picker(rng, range(1, len(QUANTITY_WEIGHTS) + 1), QUANTITY_WEIGHTS)
+
+    created_items = 0
+    for start in range(0, orders, batch_size):
+        batch, lines = [], []
+        for n in range(start, min(start + batch_size, orders)):
+            age = pick_age()
+            assigned = age > 0 or rng.random() < 0.5
+            order_lines = {}
+            while len(order_lines) < min(pick_lines(), len(menu)):
+                menuitem_id, price = pick_item()
+                order_lines.setdefault(menuitem_id, (price, pick_quantity()))
+            batch.append(Order(
+                # The first order goes to the customer the fixtures return
+                user_id=customer_ids[0] if n == 0 else pick_customer(),
+                delivery_crew_id=rng.choice(crew_ids) if assigned and crew_ids else None,
+                status=age > 1, date=today - timedelta(days=age),
+                total=sum(price * quantity for price, quantity in order_lines.values()),
+            ))
+            lines.append(order_lines)
+        with transaction.atomic():
+            # The ids come back from the INSERT
+            Order.objects.bulk_create(batch)
+            order_items = [
+                OrderItem(order_id=order.pk, menuitem_id=menuitem_id, quantity=quantity, unitprice=price, price=price * quantity)
+                for order, order_lines in zip(batch, lines) for menuitem_id, (price, quantity) in order_lines.items()
+            ]
+            OrderItem.objects.bulk_create(order_items, batch_size=batch_size)
+        created_items += len(order_items)
+        report('orders', start + len(batch))
+    report('order items', created_items)
+    # The orders were bulk inserted, past OrderManager.record_sales()
+    Order.objects.rebuild_sales()
+
+    def cart_items():
+        for user_id in customer_ids[::2]:
+            for menuitem_id, price in rng.sample(menu, min(3, len(menu))):
+                yield Cart(user_id=user_id, menuitem_id=menuitem_id, quantity=1, unitprice=price, price=price)
+    in_batches(cart_items(), Cart, batch_size)
+    report('cart items', len(customer_ids[::2]) * min(3, len(menu)))
+
+    seed_bookings(rng, bookings, today, batch_size)
+    report('bookings', bookings)
+
+    fixtures = get_fixtures()
+    for user in fixtures['users'].values():
+        Token.objects.get_or_create(user=user)
+    return fixtures
+
+
+def seed_bookings(rng, count, today, batch_size=SEED_BATCH_SIZE):
+    # Fills the slots of the next two weeks and then the days before, each
+    # slot up to a share of its covers that is higher in the evening, until
+    # there are `count` bookings. The occupancy counters are written with them.
+    hours = sorted(settings.BOOKING_SLOT_COVERS)
+    if not hours:
+        return
+    day = today + timedelta(days=13)
+    bookings, occupancy = [], []
+    created = 0
+    while created < count:
+        for slot in hours:
+            capacity = settings.BOOKING_SLOT_COVERS[slot]
+            evening = 1 if 18 <= slot <= 21 else 0.5
+            target = int(capacity * min(rng.betavariate(4, 2) * evening, 1))
+            covers = 0
+            while created < count:
+                guests = min(rng.choice([1, 2, 2, 2, 3, 4, 4, 5, 6, 8]), capacity)
+                if covers + guests > target:
+                    break
+                bookings.append(Booking(
+                    first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES), guest_number=guests,
+                    comment='', reservation_date=day, reservation_slot=slot,
+                ))
+                covers += guests
+                created += 1
+            if covers:
+                occupancy.append(SlotOccupancy(reservation_date=day, reservation_slot=slot, covers=covers))
+        if len(bookings) >= batch_size or created >= count:
+            with transaction.atomic():
+                Booking.objects.bulk_create(bookings, batch_size=batch_size)
+                SlotOccupancy.objects.bulk_create(occupancy, batch_size=batch_size)
+            bookings, occupancy = [], []
+        day -= timedelta(days=1)
+
+
+def get_fixtures():
+    # One seeded user of each role and a sample of the seeded rows, for
+    # requests against a database filled by seed_database()
+    users = {user.username: user for user in User.objects.filter(username__in=['seed-manager', 'seed-crew-0', 'seed-customer-0'])}
+    roles = {'manager': users['seed-manager'], 'delivery crew': users['seed-crew-0'], 'customer': users['seed-customer-0']}
+    return {
+        'users': roles,
+        'menuitem': MenuItem.objects.filter(title__startswith='Dish ').order_by('id').first(),
+        'order': Order.objects.filter(user=roles['customer']).order_by('id').first(),
+        'date': date.today(),
+    }
@@ -1,6 +1,11 @@
+from datetime import date, timedelta
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 from django.contrib.auth.models import User
-from .models import Category, MenuItem, Cart, Order, OrderItem
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import F
+from .instrumentation import timer
+from .models import Category, MenuItem, Cart, Order, OrderItem, Booking
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -15,6 +20,82 @@ class MenuItemSerializer(serializers.ModelSerializer):
         model = MenuItem
         fields = ['id', 'title', 'price', 'featured', 'description', 'category']
 
+class MenuItemImportListSerializer(serializers.ListSerializer):
+    # Validates every row on its own without touching the database, then
+    # checks the categories, ids and titles of the whole batch with one query
+    # each. Errors are reported per row, by position: {"rows": {"3": {...}}}.
+    # Rows with an id update that menu item, the others are created.
+    update_fields = ['title', 'price', 'featured', 'description', 'category', 'version']
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list) or not data:
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: ["Expected a non-empty list of menu items."]})
+        if self.max_length is not None and len(data) > self.max_length:
+            raise serializers.ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [f"Ensure this list has no more than {self.max_length} menu items."]})
+
+        rows, errors = [], {}
+        for index, item in enumerate(data):
+            try:
+                rows.append(self.child.run_validation(item))
+            except serializers.ValidationError as exc:
+                errors[index] = exc.detail
+                rows.append(None)
+        self.validate_batch(rows, errors)
+        if errors:
+            raise serializers.ValidationError({'rows': errors})
+        return rows
+
+    def validate_batch(self, rows, errors):
+        valid = [(index, row) for index, row in enumerate(rows) if row is not None]
+        categories = set(Category.objects.filter(pk__in={row['category'] for _, row in valid}).values_list('pk', flat=True))
+        self.menuitems = MenuItem.objects.in_bulk({row['id'] for _, row in valid if 'id' in row})
+        owners = dict(MenuItem.objects.filter(title__in=[row['title'] for _, row in valid]).values_list('title', 'id'))
+        seen = set()
+        for index, row in valid:
+            row_errors = {}
+            if row['category'] not in categories:
+                row_errors['category'] = [f'Invalid pk "{row["category"]}" - object does not exist.']
+            if 'id' in row and row['id'] not in self.menuitems:
+                row_errors['id'] = [f'Invalid pk "{row["id"]}" - object does not exist.']
+            owner = owners.get(row['title'])
+            if (owner is not None and owner != row.get('id')) or row['title'] in seen:
+                row_errors['title'] = ["menu item with this title already exists."]
+            seen.add(row['title'])
+            if row_errors:
+                errors[index] = row_errors
+
+    def create(self, validated_data):
+        # Call inside a transaction, together with the validation
+        self.created, self.updated = [], []
+        for row in validated_data:
+            fields = {**row, 'category_id': row['category']}
+            del fields['category']
+            if 'id' in fields:
+                menuitem = self.menuitems[fields.pop('id')]
+                for name, value in fields.items():
+                    setattr(menuitem, name, value)
+                # save() is not called, so bump the version here, in the
+                # database like save() does
+                menuitem.version = F('version') + 1
+                self.updated.append(menuitem)
+            else:
+                self.created.append(MenuItem(**fields, version=1))
+        MenuItem.objects.bulk_create(self.created)
+        MenuItem.objects.bulk_update(self.updated, self.update_fields)
+        return self.created + self.updated
+
+class MenuItemImportSerializer(serializers.ModelSerializer):
+    # One row of a bulk menu import
+    id = serializers.IntegerField(required=False)
+    category = serializers.IntegerField()
+
+    class Meta:
+        model = MenuItem
+        fields = ['id', 'title', 'price', 'featured', 'description', 'category']
+        # Checked for the whole batch by the list serializer
+        extra_kwargs = {'title': {'validators': []}}
+        list_serializer_class = MenuItemImportListSerializer
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -30,6 +111,13 @@ class CartSerializer(serializers.ModelSerializer):
     class Meta:
         model = Cart
         fields = ['user', 'menuitem', 'quantity', 'unitprice', 'price']
+        # str(user) is the username
+        values_sources = {'user': 'user__username'}
+
+class CartItemSerializer(serializers.Serializer):
+    # One line of a bulk add-to-cart request
+    menuitem = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, max_value=32767)
 
 class OrderSerializer(serializers.ModelSerializer):
     class Meta:
@@ -40,3 +128,85 @@ class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
         fields = ['order', 'menuitem', 'quantity', 'unitprice', 'price']
+
+class OrderExportQuerySerializer(serializers.Serializer):
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    status = serializers.ChoiceField(choices=['0', '1'], required=False)
+
+    def validate(self, data):
+        if 'date_from' in data and 'date_to' in data and data['date_from'] > data['date_to']:
+            raise serializers.ValidationError("date_from must not be after date_to")
+        return data
+
+class SalesReportQuerySerializer(serializers.Serializer):
+    # The last `default_days` days up to date_to (today by default)
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    default_days = 30
+    max_days = 3660
+
+    def validate(self, data):
+        data.setdefault('date_to', date.today())
+        data.setdefault('date_from', data['date_to'] - timedelta(days=self.default_days - 1))
+        if data['date_from'] > data['date_to']:
+            raise serializers.ValidationError("date_from must not be after date_to")
+        if (data['date_to'] - data['date_from']).days >= self.max_days:
+            raise serializers.ValidationError(f"A report covers at most {self.max_days} days")
+        return data
+
+class MenuItemSalesQuerySerializer(SalesReportQuerySerializer):
+    ordering = serializers.ChoiceField(choices=['revenue', 'units'], default='revenue')
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+class BookingSerializer(serializers.ModelSerializer):
+    # The comment is left out to keep list pages small
+    class Meta:
+        model = Booking
+        fields = ['id', 'first_name', 'last_name', 'guest_number', 'reservation_date', 'reservation_slot']
+
+class BookingQuerySerializer(serializers.Serializer):
+    date = serializers.DateField(required=False)
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    slot = serializers.IntegerField(required=False)
+
+class ValuesProjection:
+    # Read-only fast path for list responses: fetches the serializer's
+    # columns with .values() and builds the same dicts as to_representation()
+    # would, without creating a model instance per row. Every readable field
+    # must map to a single column; Meta.values_sources can name the lookup
+    # for fields that do not (its values are used as they are).
+
+    # Fields whose representation is the database value itself
+    passthrough_fields = (serializers.IntegerField, serializers.BooleanField, serializers.CharField, serializers.PrimaryKeyRelatedField)
+    unsupported_fields = (serializers.BaseSerializer, serializers.SerializerMethodField, serializers.ManyRelatedField, serializers.RelatedField)
+
+    def __init__(self, serializer):
+        sources = getattr(serializer.Meta, 'values_sources', {})
+        self.model = serializer.Meta.model
+        self.name = f'{type(serializer).__module__}.{type(serializer).__qualname__}'
+        self.columns = []
+        for field in serializer._readable_fields:
+            if field.field_name in sources:
+                self.columns.append((field.field_name, sources[field.field_name], None))
+                continue
+            if field.source == '*' or (isinstance(field, self.unsupported_fields) and not isinstance(field, serializers.PrimaryKeyRelatedField)):
+                raise ImproperlyConfigured(f"{type(serializer).__name__}.{field.field_name} cannot be read from .values(); add it to Meta.values_sources")
+            convert = None if isinstance(field, self.passthrough_fields) else field.to_representation
+            self.columns.append((field.field_name, '__'.join(field.source_attrs), convert))
+
+    def apply(self, queryset, *extra):
+        # The id is fetched as well for keyset pagination
+        return queryset.values(*dict.fromkeys(['id', *extra] + [lookup for _, lookup, _ in self.columns]))
+
+    def to_representation(self, rows):
+        data = []
+        with timer('serialize'):
+            for row in rows:
+                item = {}
+                for name, lookup, convert in self.columns:
+                    value = row[lookup]
+                    item[name] = value if convert is None or value is None else convert(value)
+                data.append(item)
+        return data
@@ -0,0 +1,129 @@
+from django.contrib.auth.models import Group, User
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+from . import instrumentation
+from .authentication import token_cache
+from .catalogue import bump_version
+from .database import apply_pragmas, set_transaction_mode
+from .dispatch import dispatcher
+from .fragments import fragment_cache
+from .models import Booking, Category, MenuItem, Order
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        apply_pragmas(connection.connection)
+        set_transaction_mode(connection)
+    # Counts the queries of instrumented requests; a no-op outside of them
+    instrumentation.install(connection)
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+def group_membership_changed(sender, action, **kwargs):
+    # Roles are read per request; only the dispatcher keeps the crew around.
+    # Like every invalidation below, it waits for the commit, so a dispatch
+    # running meanwhile cannot reload the crew from before the change.
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        transaction.on_commit(dispatcher.invalidate)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def group_changed(sender, instance, **kwargs):
+    # A renamed or deleted group changes who is in the delivery crew
+    transaction.on_commit(dispatcher.invalidate)
+
+
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def catalogue_changed(sender, **kwargs):
+    bump_version()
+
+
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def row_changed(sender, instance, **kwargs):
+    # The row version already makes the cached fragment unreachable; this
+    # only frees the memory
+    fragment_cache.delete((sender._meta.label_lower, instance.pk))
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, **kwargs):
+    # Only once committed: a rolled back save must not move the loads
+    order_id, crew_id, delivered = instance.pk, instance.delivery_crew_id, instance.status
+    transaction.on_commit(lambda: dispatcher.order_changed(order_id, crew_id, delivered))
+
+
+@receiver(post_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    order_id = instance.pk
+    transaction.on_commit(lambda: dispatcher.order_deleted(order_id))
+
+
+def booking_covers(booking):
+    return booking.reservation_date, booking.reservation_slot, booking.guest_number
+
+
+@receiver(pre_save, sender=Booking)
+def booking_saving(sender, instance, **kwargs):
+    # Remember what an edited booking was counted for
+    instance._counted_covers = None
+    if not instance._state.adding:
+        instance._counted_covers = Booking.objects.filter(pk=instance.pk).values_list(
+            'reservation_date', 'reservation_slot', 'guest_number',
+        ).first()
+
+
+@receiver(post_save, sender=Booking)
+def booking_saved(sender, instance, **kwargs):
+    # Keeps the slot counters in step with bookings saved past create_booking
+    # (admin, forms), and with edits to the date, slot or guests
+    if getattr(instance, '_covers_reserved', False):
+        instance._covers_reserved = False
+        return
+    counted, covers = instance._counted_covers, booking_covers(instance)
+    if counted == covers:
+        return
+    if counted is not None:
+        Booking.objects.release_covers(*counted)
+    Booking.objects.add_covers(*covers)
+
+
+@receiver(post_delete, sender=Booking)
+def booking_deleted(sender, instance, **kwargs):
+    # Give the covers back to the slot
+    Booking.objects.release_covers(*booking_covers(instance))
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    # Logging out deletes the token
+    token_cache.delete(instance.key)
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    # on_delete=SET_NULL would clear the delivery crew of their orders with
+    # an update that leaves the row versions (and the cached fragments)
+    # alone, so clear it here first, in the same transaction
+    Order.objects.filter(delivery_crew=instance).update(delivery_crew=None, version=F('version') + 1)
+
+
+@receiver(post_save, sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Deactivation, a new password or any other change to the user drops the
+    # cached snapshots of all their tokens
+    token_cache.delete_user(instance.pk)
+    if not instance.is_active:
+        # No more orders for a deactivated delivery crew member
+        transaction.on_commit(dispatcher.invalidate)
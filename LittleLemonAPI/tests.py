@@ -1,3 +1,1154 @@
-from django.test import TestCase
+import asyncio
+import json
+import threading
+from io import StringIO
+from datetime import date, timedelta
+from decimal import Decimal
+from unittest import mock
+from asgiref.sync import async_to_sync, iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import F, Sum
+from django.http import HttpResponse
+from django.test import AsyncRequestFactory, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIRequestFactory, APITestCase, APITransactionTestCase
+from rest_framework_xml.renderers import XMLRenderer
+from .models import CatalogueVersion, Category, MenuItem, Cart, Order, OrderItem, Booking, SlotOccupancy, DailySales, DailyMenuItemSales
+from .renderers import StreamingXMLRenderer
+from .serializers import CartSerializer, MenuItemSerializer, OrderSerializer, ValuesProjection
+from .roles import get_roles
+from .audit import audit_urls, get_routes, get_table_models, migration_draft, suggest_index, suggest_indexes
+from .authentication import token_cache
+from .benchmarks import DEFAULT_PROFILE, create_concurrency_fixtures, database_profile, run_concurrently
+from .database import get_pragmas
+from .instrumentation import PerformanceMiddleware, QueryBudgetExceeded, RequestMetrics
+from .loadtest import ClientTransport, run_load_test
+from .seed import seed_database
+from .writer import WriteQueue, WriteQueueTimeout, get_queue, run_write, stop_queues
+from .dispatch import dispatcher
+from .fragments import fragment_cache
+from . import catalogue, fragments, throttling
+from . import views
+from .async_views import AsyncMenuItemsView, AsyncSingleMenuItemView, AsyncSingleOrderView, read_async
 
-# Create your tests here.
+
+# Views that run more queries than their query_budget fail the test
+@override_settings(
+    THROTTLE_DATABASE=settings.BASE_DIR / 'test_throttle.sqlite3',
+    PERFORMANCE_INSTRUMENTATION=True, QUERY_BUDGET_ACTION='raise',
+)
+class LittleLemonTestCase(APITestCase):
+    def setUp(self):
+        # Cached catalogue pages, authenticated tokens, row fragments, crew
+        # loads and rate limits outlive the test transaction (roles are only
+        # memoized per request)
+        cache.clear()
+        token_cache.clear()
+        fragment_cache.clear()
+        dispatcher.invalidate()
+        throttling.reset()
+        self.manager_group = Group.objects.create(name='Manager')
+        self.crew_group = Group.objects.create(name='Delivery crew')
+        self.manager = self.create_user('manager', self.manager_group)
+        self.crew = self.create_user('crew', self.crew_group)
+        self.customer = self.create_user('customer')
+        self.category = Category.objects.create(slug='main', title='Main')
+        self.menuitem = MenuItem.objects.create(title='Pasta', price='12.50', featured=False, category=self.category)
+
+    def create_user(self, username, *groups):
+        user = User.objects.create_user(username=username, password='lemonPass!')
+        user.groups.add(*groups)
+        return user
+
+    def login(self, user):
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def create_order(self, user, delivery_crew=None, total='10.00'):
+        # Order.save() runs the delivery crew check, so insert the row directly
+        order = Order(user=user, delivery_crew=delivery_crew, total=total, date=date.today())
+        Order.objects.bulk_create([order])
+        return Order.objects.get(user=user, total=total)
+
+
+class RoleResolutionTests(LittleLemonTestCase):
+    def group_queries(self, context):
+        return [q['sql'] for q in context.captured_queries if 'auth_user_groups' in q['sql']]
+
+    def assertRoleLookups(self, count, method, path, data=None):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(path, data, format='json')
+        self.assertLess(response.status_code, 500)
+        self.assertEqual(len(self.group_queries(context)), count, self.group_queries(context))
+        return response
+
+    def test_order_endpoints_resolve_roles_once(self):
+        order = self.create_order(self.customer, delivery_crew=self.crew)
+        # One lookup for the requesting user, plus one for the assigned crew
+        # member when a save re-checks the delivery crew
+        for user, method, path, data, lookups in [
+            (self.manager, 'get', '/api/orders', None, 1),
+            (self.crew, 'get', '/api/orders', None, 1),
+            (self.customer, 'get', '/api/orders', None, 1),
+            (self.customer, 'get', f'/api/orders/{order.pk}', None, 1),
+            (self.crew, 'patch', f'/api/orders/{order.pk}', {'status': True}, 1),
+            (self.manager, 'put', f'/api/orders/{order.pk}', {'user': self.customer.pk, 'total': '10.00', 'date': '2024-01-01'}, 2),
+            (self.manager, 'delete', f'/api/orders/{order.pk}', None, 1),
+        ]:
+            with self.subTest(user=user.username, method=method, path=path):
+                cache.clear()
+                self.login(user)
+                self.assertRoleLookups(lookups, method, path, data)
+                # Roles are never cached across requests
+                self.assertRoleLookups(lookups, method, path, data)
+
+    def test_manager_assigning_crew_resolves_each_user_once(self):
+        order = self.create_order(self.customer)
+        self.login(self.manager)
+        path = f'/api/orders/{order.pk}'
+        self.assertRoleLookups(2, 'patch', path, {'delivery_crew': self.crew.pk})
+
+    def test_group_changes_apply_to_the_next_request(self):
+        self.assertEqual(get_roles(User.objects.get(pk=self.customer.pk)), frozenset())
+
+        self.login(self.manager)
+        response = self.client.post('/api/groups/delivery-crew/users', {'username': 'customer'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(get_roles(User.objects.get(pk=self.customer.pk)), {'Delivery crew'})
+
+        response = self.client.delete(f'/api/groups/delivery-crew/users/{self.customer.pk}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(get_roles(User.objects.get(pk=self.customer.pk)), frozenset())
+
+        self.manager_group.user_set.clear()
+        self.assertEqual(get_roles(User.objects.get(pk=self.manager.pk)), frozenset())
+
+
+class CheckoutTests(LittleLemonTestCase):
+    def fill_cart(self, lines):
+        items = MenuItem.objects.bulk_create([
+            MenuItem(title=f'Dish {i}', price='2.25', featured=False, category=self.category) for i in range(lines)
+        ])
+        Cart.objects.bulk_create([
+            Cart(user=self.customer, menuitem=item, quantity=2, unitprice='2.25', price='4.50') for item in items
+        ])
+
+    def checkout(self):
+        # Start every checkout from a cold token cache
+        token_cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/api/orders')
+        return response, len(context.captured_queries)
+
+    def test_checkout_moves_cart_into_order(self):
+        self.login(self.customer)
+        self.fill_cart(3)
+        response, _ = self.checkout()
+        self.assertEqual(response.status_code, 201)
+        order = Order.objects.get(pk=response.data['order'])
+        self.assertEqual(str(order.total), '13.50')
+        self.assertEqual(OrderItem.objects.filter(order=order).count(), 3)
+        self.assertFalse(Cart.objects.filter(user=self.customer).exists())
+
+    def test_checkout_query_count_does_not_grow_with_cart(self):
+        self.login(self.customer)
+        self.fill_cart(1)
+        _, small = self.checkout()
+        Cart.objects.all().delete()
+        MenuItem.objects.filter(title__startswith='Dish').delete()
+        self.fill_cart(25)
+        _, large = self.checkout()
+        self.assertEqual(small, large)
+
+    def test_invalid_cart_leaves_nothing_behind(self):
+        self.login(self.customer)
+        response, _ = self.checkout()
+        self.assertEqual(response.status_code, 400)
+
+        self.fill_cart(2)
+        Cart.objects.filter(user=self.customer).update(quantity=0)
+        response, _ = self.checkout()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(Cart.objects.filter(user=self.customer).count(), 2)
+
+
+class CatalogueCacheTests(LittleLemonTestCase):
+    def get_menu(self, query='', **headers):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/api/menu-items{query}', format='json', **headers)
+        return response, len(context.captured_queries)
+
+    def test_repeated_reads_are_served_from_cache(self):
+        first, queries = self.get_menu('?page_size=2&search=pasta')
+        self.assertEqual(first.status_code, 200)
+        self.assertGreater(queries, 0)
+
+        # Parameter order and unrelated parameters share the entry. The only
+        # query left reads the catalogue version.
+        second, queries = self.get_menu('?search=pasta&utm=kiosk&page_size=2')
+        self.assertEqual(queries, 1)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+        not_modified, queries = self.get_menu('?page_size=2&search=pasta', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(queries, 1)
+
+    def test_catalogue_changes_invalidate_cached_pages(self):
+        invalidations = catalogue.get_stats()['invalidations']
+        first, _ = self.get_menu()
+        self.menuitem.price = '9.00'
+        self.menuitem.save()
+
+        response, queries = self.get_menu(HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(queries, 0)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertEqual(response.json()['results'][0]['price'], '9.00')
+
+        self.login(self.manager)
+        stats = self.client.get('/api/cache/stats').data['catalogue']
+        self.assertEqual((stats['hits'], stats['misses'], stats['invalidations']), (0, 2, invalidations + 1))
+
+
+    def test_version_is_shared_between_processes(self):
+        first, _ = self.get_menu()
+        # Another worker process's change only reaches this one through the
+        # database row, and a flush deletes that
+        CatalogueVersion.objects.update(version=F('version') + 1)
+        self.assertEqual(self.get_menu(HTTP_IF_NONE_MATCH=first['ETag'])[0].status_code, 200)
+        second, _ = self.get_menu()
+        CatalogueVersion.objects.all().delete()
+        self.assertEqual(self.get_menu(HTTP_IF_NONE_MATCH=second['ETag'])[0].status_code, 200)
+
+
+class KeysetPaginationTests(LittleLemonTestCase):
+    def walk(self, url, link='next'):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.json())
+            ids.append([row['id'] for row in response.json()['results']])
+            url = response.json()[link]
+        return ids
+
+    def test_cursor_pages_seek_on_ordering_tuple(self):
+        Order.objects.bulk_create([
+            Order(user=self.customer, total='5.00', date=date(2024, 1, 1 + i % 3)) for i in range(7)
+        ])
+        expected = list(Order.objects.order_by('-date', '-id').values_list('id', flat=True))
+        self.login(self.manager)
+
+        pages = self.walk('/api/orders?cursor=&ordering=-date&page_size=3')
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), expected)
+
+        # Walking back from the last page returns the same pages
+        last = self.client.get('/api/orders?cursor=&ordering=-date&page_size=3').json()
+        last = self.client.get(self.client.get(last['next']).json()['next']).json()
+        self.assertEqual(self.walk(last['previous'], link='previous'), pages[1::-1])
+
+    def test_cursor_pages_are_stable_under_inserts(self):
+        MenuItem.objects.bulk_create([
+            MenuItem(title=f'Dish {i}', price=f'{i}.00', featured=False, category=self.category) for i in range(1, 5)
+        ])
+        first = self.client.get('/api/menu-items?cursor=&ordering=price&page_size=2').json()
+        # A cheaper item would shift every offset page, but not the cursor
+        MenuItem.objects.create(title='Olives', price='0.50', featured=False, category=self.category)
+        second = self.client.get(first['next']).json()
+        self.assertEqual([row['price'] for row in first['results'] + second['results']], ['1.00', '2.00', '3.00', '4.00'])
+
+    def test_invalid_cursor_is_not_found(self):
+        self.assertEqual(self.client.get('/api/menu-items?cursor=bogus').status_code, 404)
+        # Well-formed token with a value the field cannot hold
+        self.assertEqual(self.client.get('/api/menu-items?cursor=eyJwIjogWyJ4Il19').status_code, 404)
+
+
+class FullTextSearchTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        salads = Category.objects.create(slug='salads', title='Salads')
+        MenuItem.objects.bulk_create([
+            MenuItem(title='Greek salad', price='8.00', featured=False, category=salads, description='Feta and olives'),
+            MenuItem(title='Bruschetta', price='6.00', featured=False, category=self.category, description='Grilled bread with a greek twist'),
+        ])
+
+    def search(self, query):
+        return [row['title'] for row in self.client.get(f'/api/menu-items?search={query}').json()['results']]
+
+    def test_prefix_match_ranked_by_relevance(self):
+        self.assertEqual(self.search('gree'), ['Greek salad', 'Bruschetta'])
+        self.assertEqual(self.search('gre sal'), ['Greek salad'])
+        self.assertEqual(self.search('olive'), ['Greek salad'])
+        self.assertEqual(self.search('gree&ordering=-price'), ['Greek salad', 'Bruschetta'])
+        self.assertEqual(self.search('gree&ordering=price'), ['Bruschetta', 'Greek salad'])
+
+    def test_index_follows_writes(self):
+        Category.objects.filter(title='Salads').update(title='Starters')
+        self.assertEqual(self.search('starter'), ['Greek salad'])
+        MenuItem.objects.filter(title='Greek salad').delete()
+        self.assertEqual(self.search('gree'), ['Bruschetta'])
+        self.menuitem.title = 'Lemon pasta'
+        self.menuitem.save()
+        self.assertEqual(self.search('lemo'), ['Lemon pasta'])
+
+    def test_falls_back_to_search_filter(self):
+        with mock.patch('LittleLemonAPI.search.fts_available', return_value=False):
+            self.assertEqual(self.search('salads'), ['Greek salad'])
+            self.assertEqual(self.search('olive'), [])
+
+
+class OrderExportTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.order = self.create_order(self.customer, delivery_crew=self.crew, total='25.00')
+        OrderItem.objects.create(order=self.order, menuitem=self.menuitem, quantity=2, unitprice='12.50', price='25.00')
+        self.other = self.create_order(self.manager, total='3.00')
+
+    def export(self, query=''):
+        response = self.client.get(f'/api/orders/export{query}')
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_export_has_one_row_per_order_item(self):
+        self.login(self.manager)
+        response, content = self.export('?format=csv')
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        self.assertEqual(content.splitlines(), [
+            'order,user,delivery_crew,status,total,date,menuitem,quantity,unitprice,price',
+            f'{self.order.pk},{self.customer.pk},{self.crew.pk},0,25.00,{date.today()},{self.menuitem.pk},2,12.50,25.00',
+            f'{self.other.pk},{self.manager.pk},,0,3.00,{date.today()},,,,',
+        ])
+
+    def test_ndjson_export_nests_items_and_uses_order_scoping(self):
+        self.login(self.customer)
+        _, content = self.export('?format=ndjson')
+        lines = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(lines, [{
+            'id': self.order.pk, 'user': self.customer.pk, 'delivery_crew': self.crew.pk, 'status': False,
+            'total': '25.00', 'date': str(date.today()),
+            'items': [{'menuitem': self.menuitem.pk, 'quantity': 2, 'unitprice': '12.50', 'price': '25.00'}],
+        }])
+
+    def test_export_filters(self):
+        self.login(self.manager)
+        Order.objects.filter(pk=self.other.pk).update(status=True, date=date(2020, 1, 1))
+        self.assertEqual(len(self.export('?format=ndjson&status=1')[1].splitlines()), 1)
+        self.assertEqual(len(self.export('?format=ndjson&date_from=2021-01-01')[1].splitlines()), 1)
+        self.assertEqual(len(self.export('?format=ndjson&date_to=2021-01-01&status=0')[1].splitlines()), 0)
+        response = self.client.get('/api/orders/export?format=ndjson&date_from=2021-01-01&date_to=2020-01-01')
+        self.assertEqual(response.status_code, 400)
+
+
+class SalesRollupTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.soup = MenuItem.objects.create(title='Soup', price='4.00', featured=False, category=self.category)
+
+    def checkout(self, *lines):
+        self.login(self.customer)
+        self.client.post('/api/cart/menu-items/bulk', [{'menuitem': item.pk, 'quantity': quantity} for item, quantity in lines], format='json')
+        response = self.client.post('/api/orders')
+        self.assertEqual(response.status_code, 201)
+        return response.data['order']
+
+    def rollups(self):
+        return (
+            list(DailySales.objects.order_by('date').values_list('date', 'orders', 'revenue')),
+            list(DailyMenuItemSales.objects.order_by('date', 'menuitem').values_list('date', 'menuitem', 'units', 'revenue')),
+        )
+
+    def assertRollupsMatchRebuild(self):
+        rollups = self.rollups()
+        call_command('rebuildsales', stdout=StringIO())
+        self.assertEqual(self.rollups(), rollups)
+
+    def test_orders_are_rolled_up_as_they_change(self):
+        first = self.checkout((self.menuitem, 2), (self.soup, 1))
+        self.checkout((self.soup, 3))
+        today = date.today()
+        self.assertEqual(self.rollups(), (
+            [(today, 2, Decimal('41.00'))],
+            [(today, self.menuitem.pk, 2, Decimal('25.00')), (today, self.soup.pk, 4, Decimal('16.00'))],
+        ))
+        self.assertRollupsMatchRebuild()
+
+        # A manager moving an order to another day moves its sales
+        self.login(self.manager)
+        yesterday = today - timedelta(days=1)
+        response = self.client.patch(f'/api/orders/{first}', {'date': str(yesterday)}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.rollups()[0], [(yesterday, 1, Decimal('29.00')), (today, 1, Decimal('12.00'))])
+        self.assertRollupsMatchRebuild()
+
+        response = self.client.delete(f'/api/orders/{first}')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.rollups(), ([(today, 1, Decimal('12.00'))], [(today, self.soup.pk, 3, Decimal('12.00'))]))
+        self.assertRollupsMatchRebuild()
+
+    def test_sales_report_reads_one_row_per_day(self):
+        today = date.today()
+        DailySales.objects.bulk_create([
+            DailySales(date=today - timedelta(days=age), orders=age, revenue=Decimal(age) * 10) for age in range(1, 365, 2)
+        ])
+        self.login(self.manager)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/api/reports/sales?date_from={today - timedelta(days=364)}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['days']), 365)
+        self.assertEqual(response.data['days'][-2:], [
+            {'date': today - timedelta(days=1), 'orders': 1, 'revenue': '10.00'},
+            {'date': today, 'orders': 0, 'revenue': '0.00'},
+        ])
+        self.assertEqual(response.data['orders'], sum(range(1, 365, 2)))
+        self.assertEqual(response.data['revenue'], f'{sum(range(1, 365, 2)) * 10}.00')
+        self.assertEqual(len([query for query in context.captured_queries if 'dailysales' in query['sql']]), 1)
+
+        # The last 30 days by default
+        self.assertEqual(len(self.client.get('/api/reports/sales').data['days']), 30)
+        self.assertEqual(self.client.get(f'/api/reports/sales?date_to={today - timedelta(days=1)}&date_from={today}').status_code, 400)
+        self.assertEqual(self.client.get('/api/reports/sales?date_from=2000-01-01').status_code, 400)
+        self.login(self.customer)
+        self.assertEqual(self.client.get('/api/reports/sales').status_code, 403)
+
+    def test_menu_item_report_ranks_by_revenue_or_units(self):
+        self.checkout((self.menuitem, 1), (self.soup, 2))
+        self.checkout((self.soup, 1))
+        self.login(self.manager)
+        response = self.client.get('/api/reports/menu-items')
+        self.assertEqual(response.data['menu_items'], [
+            {'menuitem': self.menuitem.pk, 'title': 'Pasta', 'units': 1, 'revenue': '12.50'},
+            {'menuitem': self.soup.pk, 'title': 'Soup', 'units': 3, 'revenue': '12.00'},
+        ])
+        response = self.client.get('/api/reports/menu-items?ordering=units&limit=1')
+        self.assertEqual([row['title'] for row in response.data['menu_items']], ['Soup'])
+        response = self.client.get(f'/api/reports/menu-items?date_to={date.today() - timedelta(days=1)}')
+        self.assertEqual(response.data['menu_items'], [])
+
+
+class BookingsTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        Booking.objects.bulk_create([
+            Booking(first_name=f'Guest {i}', last_name='Doe', guest_number=2, reservation_date=date(2024, 5, 1 + i % 2),
+                    reservation_slot=18 + i % 3, comment='Window seat')
+            for i in range(12)
+        ])
+
+    def test_day_is_paged_in_slot_order_without_comments(self):
+        url = '/api/bookings?date=2024-05-01&page_size=4'
+        bookings = []
+        while url:
+            page = self.client.get(url).data
+            self.assertLessEqual(len(page['results']), 4)
+            bookings += page['results']
+            url = page['next']
+        self.assertEqual(len(bookings), 6)
+        self.assertEqual({b['reservation_date'] for b in bookings}, {'2024-05-01'})
+        self.assertEqual([b['reservation_slot'] for b in bookings], sorted(b['reservation_slot'] for b in bookings))
+        self.assertNotIn('comment', bookings[0])
+
+    def test_availability_is_read_from_slot_counters(self):
+        with self.settings(BOOKING_SLOT_COVERS={18: 10, 19: 10}):
+            Booking.objects.create_booking(first_name='Ada', last_name='Lovelace', guest_number=6,
+                                           reservation_date=date(2024, 6, 1), reservation_slot=19, comment='')
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get('/api/bookings/availability?date=2024-06-01')
+            self.assertEqual(len(context.captured_queries), 1)
+            self.assertEqual(response.data, [
+                {'slot': 18, 'covers': 10, 'booked': 0, 'available': 10},
+                {'slot': 19, 'covers': 10, 'booked': 6, 'available': 4},
+            ])
+            self.assertEqual(self.client.get('/api/bookings/availability').status_code, 400)
+
+    def test_bookings_saved_past_create_booking_are_counted(self):
+        def covers(slot):
+            return SlotOccupancy.objects.filter(reservation_date=date(2024, 6, 1), reservation_slot=slot).values_list('covers', flat=True).first()
+
+        reserved = Booking.objects.create_booking(first_name='Ada', last_name='Lovelace', guest_number=6,
+                                                  reservation_date=date(2024, 6, 1), reservation_slot=19, comment='')
+        self.assertEqual(covers(19), 6)
+        # Saved the way the admin does
+        booking = Booking.objects.create(first_name='Alan', last_name='Turing', guest_number=3,
+                                         reservation_date=date(2024, 6, 1), reservation_slot=19, comment='')
+        self.assertEqual(covers(19), 9)
+        booking.guest_number = 4
+        booking.save()
+        self.assertEqual(covers(19), 10)
+        booking.reservation_slot = 20
+        booking.save()
+        self.assertEqual((covers(19), covers(20)), (6, 4))
+        reserved.comment = 'Birthday'
+        reserved.save()
+        self.assertEqual(covers(19), 6)
+        booking.delete()
+        reserved.delete()
+        self.assertEqual((covers(19), covers(20)), (0, 0))
+
+        # Never below zero, even for a booking the counters missed
+        Booking.objects.bulk_create([Booking(first_name='Grace', last_name='Hopper', guest_number=5,
+                                             reservation_date=date(2024, 6, 1), reservation_slot=19, comment='')])
+        Booking.objects.get(first_name='Grace').delete()
+        self.assertEqual(covers(19), 0)
+
+    def test_filters(self):
+        self.assertEqual(len(self.client.get('/api/bookings?date_from=2024-05-02&slot=19').data['results']), 2)
+        self.assertEqual(self.client.get('/api/bookings?date=tomorrow').status_code, 400)
+
+
+class AsyncReadViewTests(LittleLemonTestCase):
+    def call(self, view, path, method='get', user=None, **kwargs):
+        request = getattr(APIRequestFactory(), method)(path, format='json')
+        if user is not None:
+            request.META['HTTP_AUTHORIZATION'] = f'Token {Token.objects.get_or_create(user=user)[0].key}'
+        response = async_to_sync(view)(request, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+
+    def test_menu_list_matches_sync_view(self):
+        MenuItem.objects.bulk_create([MenuItem(title=f'Dish {i}', price='5.00', featured=False, category=self.category) for i in range(7)])
+        for query in ['', '?page=2', '?ordering=-price&cursor=', '?search=pasta']:
+            cache.clear()
+            expected = self.client.get(f'/api/menu-items{query}').json()
+            cache.clear()
+            response = self.call(AsyncMenuItemsView.as_view(), f'/api/menu-items{query}')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.content), expected)
+            self.assertTrue(response.has_header('ETag'))
+
+    def test_catalogue_cache_is_used_off_the_event_loop(self):
+        def on_event_loop():
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return False
+            return True
+
+        calls = []
+        get, set_ = cache.get, cache.set
+        with mock.patch.object(cache, 'get', lambda *args: calls.append(('get', on_event_loop())) or get(*args)), \
+                mock.patch.object(cache, 'set', lambda *args: calls.append(('set', on_event_loop())) or set_(*args)):
+            cache.clear()
+            for status_code in (200, 200):
+                self.assertEqual(self.call(AsyncMenuItemsView.as_view(), '/api/menu-items').status_code, status_code)
+        self.assertIn(('get', False), calls)
+        self.assertIn(('set', False), calls)
+        self.assertNotIn(('get', True), calls)
+        self.assertNotIn(('set', True), calls)
+
+    def test_menu_item_detail(self):
+        view = AsyncSingleMenuItemView.as_view()
+        response = self.call(view, '/api/menu-items/1', pk=self.menuitem.pk)
+        self.assertEqual(json.loads(response.content)['title'], 'Pasta')
+        self.assertEqual(self.call(view, '/api/menu-items/0', pk=0).status_code, 404)
+
+    def test_order_detail_is_scoped_by_role(self):
+        order = self.create_order(self.customer)
+        OrderItem.objects.create(order=order, menuitem=self.menuitem, quantity=2, unitprice='12.50', price='25.00')
+        view = AsyncSingleOrderView.as_view()
+        response = self.call(view, '/api/orders/1', user=self.customer, pk=order.pk)
+        self.assertEqual(json.loads(response.content)[0]['quantity'], 2)
+        self.assertEqual(self.call(view, '/api/orders/1', user=self.crew, pk=order.pk).status_code, 404)
+        self.assertEqual(self.call(view, '/api/orders/1', pk=order.pk).status_code, 401)
+
+    def test_writes_go_to_the_sync_view(self):
+        view = read_async(views.MenuItemsView.as_view(), AsyncMenuItemsView.as_view())
+        response = self.call(view, '/api/menu-items', method='post', user=self.customer)
+        self.assertEqual(response.status_code, 403)
+
+
+class CachedTokenAuthenticationTests(LittleLemonTestCase):
+    def token_queries(self, url='/api/orders'):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        return response, [q['sql'] for q in context.captured_queries if 'authtoken_token' in q['sql']]
+
+    def test_token_is_looked_up_once(self):
+        self.login(self.customer)
+        self.assertEqual(len(self.token_queries()[1]), 1)
+        response, queries = self.token_queries()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, [])
+        self.assertEqual(token_cache.get_stats()['hits'], 1)
+
+    def test_logout_revokes_the_cached_token(self):
+        self.login(self.customer)
+        self.assertEqual(self.client.get('/api/orders').status_code, 200)
+        self.assertEqual(self.client.post('/auth/token/logout/').status_code, 204)
+        self.assertEqual(self.client.get('/api/orders').status_code, 401)
+
+    def test_deactivation_revokes_the_cached_token(self):
+        self.login(self.customer)
+        self.assertEqual(self.client.get('/api/orders').status_code, 200)
+        self.customer.is_active = False
+        self.customer.save()
+        self.assertEqual(self.client.get('/api/orders').status_code, 401)
+
+    def test_requests_do_not_share_the_user_instance(self):
+        self.login(self.customer)
+        self.client.get('/api/orders')
+        self.manager_group.user_set.add(self.customer)
+        # Roles memoized on the first request's user must not stick
+        response = self.client.get('/api/cache/stats')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['auth']['hits'], 1)
+
+
+class SharedRateThrottleTests(LittleLemonTestCase):
+    def test_checkout_has_its_own_budget(self):
+        self.login(self.customer)
+        for _ in range(5):
+            self.assertEqual(self.client.post('/api/orders').status_code, 400)  # empty cart
+        response = self.client.post('/api/orders')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(self.client.get('/api/orders').status_code, 200)
+
+    def test_anonymous_budget_is_per_client(self):
+        with mock.patch.object(throttling.SharedRateThrottle, 'THROTTLE_RATES', {'anon': '2/minute'}):
+            for status_code in (200, 200, 429):
+                self.assertEqual(self.client.get('/api/bookings').status_code, status_code)
+            self.assertEqual(self.client.get('/api/bookings', REMOTE_ADDR='10.0.0.2').status_code, 200)
+
+    def test_bucket_is_shared_between_connections_and_refills(self):
+        with mock.patch('time.time', return_value=1000.0):
+            self.assertEqual(throttling.take_token('k', 2, 1 / 30), (True, 1.0))
+            self.assertEqual(throttling.take_token('k', 2, 1 / 30), (True, 0.0))
+            # Another thread has its own connection, as another worker would
+            other = []
+            thread = threading.Thread(target=lambda: other.append(throttling.take_token('k', 2, 1 / 30)))
+            thread.start()
+            thread.join()
+            self.assertEqual(other, [(False, 0.0)])
+        with mock.patch('time.time', return_value=1030.0):
+            self.assertEqual(throttling.take_token('k', 2, 1 / 30), (True, 0.0))
+
+
+    def test_idle_buckets_are_pruned(self):
+        with mock.patch('time.time', return_value=1000.0):
+            throttling.take_token('idle', 2, 1 / 30)
+        with mock.patch('time.time', return_value=1000.0 + 24 * 60 * 60 + 1), \
+                mock.patch.object(throttling, 'PRUNE_EVERY', 1):
+            throttling.take_token('busy', 2, 1 / 30)
+        keys = [key for key, in throttling.get_connection().execute('SELECT key FROM throttle_bucket')]
+        self.assertEqual(keys, ['busy'])
+
+
+class ValuesProjectionTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_order(self.customer, total='7.5')
+        self.create_order(self.customer, delivery_crew=self.crew, total='1234.00')
+        Cart.objects.create(user=self.customer, menuitem=self.menuitem, quantity=3, unitprice='12.50', price='37.50')
+
+    def test_projection_matches_the_serializer(self):
+        for serializer_class, queryset in [
+            (MenuItemSerializer, MenuItem.objects.order_by('id')),
+            (OrderSerializer, Order.objects.order_by('id')),
+            (CartSerializer, Cart.objects.order_by('id')),
+        ]:
+            with self.subTest(serializer=serializer_class.__name__):
+                projection = ValuesProjection(serializer_class())
+                self.assertEqual(
+                    json.dumps(projection.to_representation(projection.apply(queryset))),
+                    json.dumps(serializer_class(queryset, many=True).data),
+                )
+
+    def test_list_views_keep_their_json(self):
+        self.login(self.customer)
+        for view, url in [(views.MenuItemsView, '/api/menu-items'), (views.OrdersView, '/api/orders?ordering=-total'), (views.CartView, '/api/cart/menu-items')]:
+            with self.subTest(url=url):
+                cache.clear()
+                fast = self.client.get(url).content
+                cache.clear()
+                with mock.patch.object(view, 'values_projection', False):
+                    self.assertEqual(fast, self.client.get(url).content)
+
+
+class FragmentCacheTests(LittleLemonTestCase):
+    def get_menu(self, query=''):
+        # Skip the whole-response catalogue cache to get at the fragments
+        cache.clear()
+        return self.client.get(f'/api/menu-items{query}')
+
+    def test_rows_are_rendered_once_per_version(self):
+        MenuItem.objects.bulk_create([MenuItem(title=f'Dish {i}', price='3.10', featured=False, category=self.category) for i in range(4)])
+        first = self.get_menu()
+        self.assertEqual(fragment_cache.get_stats()['misses'], 5)
+        second = self.get_menu()
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(fragment_cache.get_stats()['hits'], 5)
+
+        self.menuitem.price = '13.00'
+        self.menuitem.save()
+        self.assertEqual(self.get_menu().json()['results'][0]['price'], '13.00')
+
+    def test_assembled_json_matches_the_serializer(self):
+        self.create_order(self.customer, total='9.9')
+        self.login(self.customer)
+        for url in ['/api/menu-items?page_size=1', '/api/orders', '/api/orders?cursor=']:
+            with self.subTest(url=url):
+                cache.clear()
+                self.client.get(url)
+                cache.clear()
+                cached = self.client.get(url)
+                cache.clear()
+                with mock.patch.object(views.MenuItemsView, 'fragment_cache', False), mock.patch.object(views.OrdersView, 'fragment_cache', False):
+                    self.assertEqual(cached.content, self.client.get(url).content)
+                self.assertEqual(cached['Content-Type'], 'application/json')
+
+    def test_checkout_total_bumps_the_order_version(self):
+        self.login(self.customer)
+        Cart.objects.create(user=self.customer, menuitem=self.menuitem, quantity=2, unitprice='12.50', price='25.00')
+        order = Order.objects.get(pk=self.client.post('/api/orders').data['order'])
+        self.assertEqual(self.client.get('/api/orders').json()['results'][0]['total'], '25.00')
+        self.assertEqual(order.version, 2)
+
+    def test_concurrent_saves_get_their_own_versions(self):
+        first, second = MenuItem.objects.get(pk=self.menuitem.pk), MenuItem.objects.get(pk=self.menuitem.pk)
+        first.price = '1.00'
+        first.save()
+        self.assertEqual(first.version, 2)
+        second.price = '2.00'
+        second.save()
+        self.assertEqual(second.version, 3)
+
+    def test_deleting_the_crew_member_bumps_the_order_version(self):
+        order = self.create_order(self.customer, delivery_crew=self.crew)
+        self.crew.delete()
+        self.assertEqual(Order.objects.values_list('delivery_crew', 'version').get(pk=order.pk), (None, 1))
+
+    def test_memory_is_bounded(self):
+        cache = fragments.FragmentCache(max_bytes=100)
+        for pk in range(10):
+            cache.set(('menuitem', pk), 1, 'S', b'x' * 30)
+        self.assertEqual(cache.get_stats()['bytes'], 90)
+        self.assertIsNone(cache.get(('menuitem', 0), 1, 'S'))
+        self.assertEqual(cache.get(('menuitem', 9), 1, 'S'), b'x' * 30)
+
+
+class StreamingXMLRendererTests(LittleLemonTestCase):
+    def test_output_matches_xml_renderer(self):
+        data = {'count': 2, 'next': None, 'results': [
+            {'id': 1, 'title': 'Fish & <chips>', 'price': '5.00', 'tags': ['a', 'b'], 'extra': None},
+            {'id': 2, 'title': 'Ünïcode', 'price': '1.25', 'tags': [], 'extra': {'x': True}},
+        ]}
+        for payload in (data, data['results'], 'text', None):
+            with self.subTest(payload=payload):
+                self.assertEqual(StreamingXMLRenderer().render(payload), XMLRenderer().render(payload))
+
+    def test_list_pages_are_streamed(self):
+        MenuItem.objects.bulk_create([MenuItem(title=f'Dish {i}', price='5.00', featured=False, category=self.category) for i in range(7)])
+        response = self.client.get('/api/menu-items?page_size=6', HTTP_ACCEPT='application/xml')
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/xml; charset=utf-8')
+        expected = XMLRenderer().render(self.client.get('/api/menu-items?page_size=6', HTTP_ACCEPT='application/json').json())
+        self.assertEqual(b''.join(response.streaming_content).decode(), expected)
+
+    def test_order_export(self):
+        order = self.create_order(self.customer, total='12.50')
+        OrderItem.objects.create(order=order, menuitem=self.menuitem, quantity=1, unitprice='12.50', price='12.50')
+        self.login(self.manager)
+        response = self.client.get('/api/orders/export?format=xml')
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn(f'<list-item><id>{order.pk}</id><user>{self.customer.pk}</user><delivery_crew></delivery_crew>', content)
+        self.assertIn('<items><list-item><menuitem>', content)
+
+
+class CartUpsertTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login(self.customer)
+
+    def test_adding_an_item_again_adds_to_its_quantity(self):
+        self.assertEqual(self.client.post('/api/cart/menu-items', {'menuitem': self.menuitem.pk, 'quantity': 2}).status_code, 201)
+        response = self.client.post('/api/cart/menu-items', {'menuitem': self.menuitem.pk, 'quantity': 3})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'user': 'customer', 'menuitem': self.menuitem.pk, 'quantity': 5, 'unitprice': '12.50', 'price': '62.50'})
+        cart = Cart.objects.get(user=self.customer)
+        self.assertEqual((cart.quantity, str(cart.price)), (5, '62.50'))
+
+    def test_single_add_errors(self):
+        self.assertEqual(self.client.post('/api/cart/menu-items', {'menuitem': 0, 'quantity': 1}).status_code, 404)
+        self.assertEqual(self.client.post('/api/cart/menu-items', {'menuitem': self.menuitem.pk}).status_code, 400)
+        self.assertEqual(self.client.post('/api/cart/menu-items', {'menuitem': self.menuitem.pk, 'quantity': 'two'}).status_code, 400)
+
+    def test_bulk_add_takes_constant_queries(self):
+        items = MenuItem.objects.bulk_create([
+            MenuItem(title=f'Side {i}', price='1.10', featured=False, category=self.category) for i in range(20)
+        ])
+        Cart.objects.create(user=self.customer, menuitem=items[0], quantity=1, unitprice='1.10', price='1.10')
+        payload = [{'menuitem': item.pk, 'quantity': 3} for item in items]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/api/cart/menu-items/bulk', payload, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 20)
+        self.assertEqual(len([q for q in context.captured_queries if 'LittleLemonAPI_cart' in q['sql']]), 1)
+        self.assertEqual(str(Cart.objects.get(menuitem=items[0]).price), '4.40')
+        self.assertEqual(Cart.objects.filter(user=self.customer).count(), 20)
+
+    def test_unknown_menu_item_adds_nothing(self):
+        response = self.client.post('/api/cart/menu-items/bulk', [
+            {'menuitem': self.menuitem.pk, 'quantity': 1}, {'menuitem': 999, 'quantity': 1},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('999', response.data['detail'][0])
+        self.assertFalse(Cart.objects.exists())
+
+
+class MenuItemBulkImportTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login(self.manager)
+        self.desserts = Category.objects.create(slug='desserts', title='Desserts')
+
+    def test_json_import_creates_and_updates_in_constant_queries(self):
+        rows = [{'title': f'Tart {i}', 'price': '4.50', 'featured': False, 'category': self.desserts.pk} for i in range(30)]
+        rows.append({'id': self.menuitem.pk, 'title': 'Pasta', 'price': '13.00', 'featured': True, 'description': 'Fresh', 'category': self.category.pk})
+        invalidations = catalogue.get_stats()['invalidations']
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/api/menu-items/bulk', rows, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((len(response.data['created']), response.data['updated']), (30, [self.menuitem.pk]))
+        self.assertLess(len(context.captured_queries), 15)
+        self.assertEqual(catalogue.get_stats()['invalidations'], invalidations + 1)
+        self.menuitem.refresh_from_db()
+        self.assertEqual((str(self.menuitem.price), self.menuitem.featured, self.menuitem.version), ('13.00', True, 2))
+        self.assertEqual([row['title'] for row in self.client.get('/api/menu-items?search=tart&page_size=50').json()['results']][:1], ['Tart 0'])
+
+    def test_errors_are_reported_per_row_and_nothing_is_written(self):
+        response = self.client.post('/api/menu-items/bulk', [
+            {'title': 'Sorbet', 'price': '3.00', 'featured': False, 'category': self.desserts.pk},
+            {'title': 'Pasta', 'price': '3.00', 'featured': False, 'category': self.desserts.pk},
+            {'title': 'Gelato', 'price': 'cheap', 'featured': False, 'category': 999},
+            {'id': 999, 'title': 'Gelato', 'price': '3.00', 'featured': False, 'category': self.desserts.pk},
+        ], format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.data['rows']), {1, 2, 3})
+        self.assertIn('title', response.data['rows'][1])
+        self.assertIn('price', response.data['rows'][2])
+        self.assertEqual(set(response.data['rows'][3]), {'id'})
+        self.assertFalse(MenuItem.objects.filter(title='Sorbet').exists())
+
+    def test_csv_body_and_upload(self):
+        body = 'title,price,featured,category\nMousse,5.25,true,%d\nFlan,4.00,false,%d\n' % (self.desserts.pk, self.desserts.pk)
+        response = self.client.post('/api/menu-items/bulk', body, content_type='text/csv')
+        self.assertEqual(response.status_code, 201)
+        upload = SimpleUploadedFile('menu.csv', b'title,price,featured,category\nTiramisu,6.00,0,%d\n' % self.desserts.pk, content_type='text/csv')
+        response = self.client.post('/api/menu-items/bulk', {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(MenuItem.objects.filter(category=self.desserts).count(), 3)
+
+    def test_managers_only(self):
+        self.login(self.customer)
+        self.assertEqual(self.client.post('/api/menu-items/bulk', [], format='json').status_code, 403)
+
+
+class OrderDispatchTests(LittleLemonTestCase):
+    def setUp(self):
+        super().setUp()
+        self.crew2 = self.create_user('crew2', self.crew_group)
+        self.login(self.manager)
+
+    def dispatch(self, **data):
+        response = self.client.post('/api/orders/dispatch', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        return [(row['order'], row['delivery_crew']) for row in response.data['assigned']]
+
+    def test_orders_go_to_the_least_loaded_crew(self):
+        for i in range(2):
+            self.create_order(self.customer, delivery_crew=self.crew, total=f'{i}.50')
+        orders = [self.create_order(self.customer, total=f'{i}.00') for i in range(4)]
+        assigned = self.dispatch()
+        self.assertEqual([order_id for order_id, _ in assigned], [order.pk for order in orders])
+        self.assertEqual(sorted(crew_id for _, crew_id in assigned), [self.crew.pk] + [self.crew2.pk] * 3)
+        self.assertEqual(Order.objects.filter(delivery_crew=self.crew2).count(), 3)
+        self.assertEqual(self.dispatch(), [])
+
+    def test_delivered_orders_free_the_crew(self):
+        first = self.create_order(self.customer, total='1.00')
+        self.assertEqual(self.dispatch(), [(first.pk, self.crew.pk)])
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/orders/{first.pk}', {'status': 1}, format='json')
+        self.assertEqual(response.status_code, 200)
+        # Both are free again, so the tie goes to the first crew member
+        second = self.create_order(self.customer, total='2.00')
+        self.assertEqual(self.dispatch(), [(second.pk, self.crew.pk)])
+        third = self.create_order(self.customer, total='3.00')
+        self.assertEqual(self.dispatch(), [(third.pk, self.crew2.pk)])
+
+    def test_loads_follow_committed_changes_only(self):
+        self.dispatch()
+        order = self.create_order(self.customer, total='1.00')
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(ValidationError):
+            with transaction.atomic():
+                order.delivery_crew = self.crew
+                order.save()
+                raise ValidationError("rolled back")
+        # The rolled back assignment did not count, so the tie goes to the
+        # first crew member
+        self.assertEqual(self.dispatch(), [(order.pk, self.crew.pk)])
+
+        # Assignments made by another process are read on the next reload
+        other = self.create_order(self.customer, total='2.00')
+        Order.objects.filter(pk=other.pk).update(delivery_crew=self.crew2)
+        third = self.create_order(self.customer, total='3.00')
+        with mock.patch('LittleLemonAPI.dispatch.DISPATCH_RELOAD_INTERVAL', 0):
+            self.assertEqual(self.dispatch(), [(third.pk, self.crew.pk)])
+
+    def test_crew_changes_reload_the_loads_once_committed(self):
+        self.dispatch()
+        # A dispatch holding the lock does not hold up the transaction that
+        # adds a crew member
+        with dispatcher.lock, self.captureOnCommitCallbacks(execute=True):
+            rider = self.create_user('rider', self.crew_group)
+            self.assertTrue(dispatcher.loaded)
+        self.assertFalse(dispatcher.loaded)
+        self.dispatch()
+        self.assertIn(rider.pk, dispatcher.loads)
+
+    def test_query_count_does_not_grow_with_crew(self):
+        # Warm the token and role caches; both measured runs load the crew
+        self.dispatch()
+        self.create_order(self.customer, total='1.00')
+        dispatcher.invalidate()
+        with CaptureQueriesContext(connection) as context:
+            self.dispatch()
+        small = len(context.captured_queries)
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(20):
+                self.create_user(f'rider{i}', self.crew_group)
+        for i in range(20):
+            self.create_order(self.customer, total=f'{i + 2}.00')
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(len(self.dispatch(batch_size=100)), 20)
+        self.assertEqual(len(context.captured_queries), small)
+
+    def test_managers_only(self):
+        self.login(self.crew)
+        self.assertEqual(self.client.post('/api/orders/dispatch').status_code, 403)
+        self.login(self.manager)
+        self.assertEqual(self.client.post('/api/orders/dispatch', {'batch_size': 0}, format='json').status_code, 400)
+
+
+class SQLiteTuningTests(APITransactionTestCase):
+    # Not wrapped in a transaction, so that other threads see the fixtures
+    def test_pragmas_are_applied_to_new_connections(self):
+        connection.ensure_connection()
+        pragmas = get_pragmas(connection.connection, settings.SQLITE_PRAGMAS)
+        self.assertEqual(pragmas['journal_mode'], 'wal')
+        self.assertEqual(pragmas['synchronous'], 1)
+        self.assertEqual(pragmas['busy_timeout'], settings.SQLITE_PRAGMAS['busy_timeout'])
+        self.assertEqual(pragmas['cache_size'], settings.SQLITE_PRAGMAS['cache_size'])
+
+    def test_transactions_take_the_write_lock_up_front(self):
+        with CaptureQueriesContext(connection) as context, transaction.atomic():
+            Order.objects.exists()
+        self.assertEqual(context.captured_queries[0]['sql'], 'BEGIN IMMEDIATE')
+
+    def test_default_benchmark_profile_uses_deferred_transactions(self):
+        with database_profile(DEFAULT_PROFILE):
+            with CaptureQueriesContext(connection) as context, transaction.atomic():
+                Order.objects.exists()
+            self.assertEqual(context.captured_queries[0]['sql'], 'BEGIN')
+        with CaptureQueriesContext(connection) as context, transaction.atomic():
+            Order.objects.exists()
+        self.assertEqual(context.captured_queries[0]['sql'], 'BEGIN IMMEDIATE')
+
+    def test_parallel_writers_and_readers_do_not_lock(self):
+        fragment_cache.clear()
+        create_concurrency_fixtures(4)
+        result = run_concurrently(writers=4, readers=4, operations=5)
+        self.assertEqual((result['lock_errors'], result['errors']), (0, 0))
+        self.assertEqual(result['requests'], 80)
+        self.assertEqual(Order.objects.count(), 20)
+        self.assertEqual(OrderItem.objects.count(), 60)
+        # One connection per thread, kept for all its requests
+        self.assertEqual(result['connections'], 8)
+
+
+@override_settings(WRITE_QUEUE=True)
+class WriteQueueTests(APITransactionTestCase):
+    def tearDown(self):
+        stop_queues()
+
+    def book(self, guests=2, **fields):
+        return Booking.objects.create_booking(
+            first_name='Ada', last_name='L', guest_number=guests, comment='', reservation_date=date(2030, 1, 1), reservation_slot=19, **fields,
+        )
+
+    def book_and_fail(self):
+        self.book()
+        raise ValidationError("No")
+
+    def test_queued_jobs_commit_together_and_fail_alone(self):
+        write_queue = WriteQueue('default')
+        self.addCleanup(write_queue.stop)
+        gate = threading.Event()
+        # Hold the writer, so the next three are queued up for one batch
+        first = write_queue.submit(gate.wait)
+        jobs = [write_queue.submit(self.book), write_queue.submit(self.book_and_fail), write_queue.submit(self.book)]
+        gate.set()
+        first.result(timeout=10)
+        self.assertIsInstance(jobs[0].result(timeout=10), Booking)
+        self.assertIsInstance(jobs[1].exception(timeout=10), ValidationError)
+        self.assertIsInstance(jobs[2].result(timeout=10), Booking)
+        self.assertEqual(Booking.objects.count(), 2)
+        stats = write_queue.get_stats()
+        self.assertEqual((stats['jobs'], stats['failed']), (4, 1))
+        self.assertLessEqual(stats['batches'], 2)
+
+    @override_settings(WRITE_QUEUE_TIMEOUT=0.1)
+    def test_timeout_cancels_the_queued_write(self):
+        gate = threading.Event()
+        get_queue().submit(gate.wait)
+        with self.assertRaises(WriteQueueTimeout):
+            run_write(self.book)
+        gate.set()
+        stop_queues()
+        self.assertFalse(Booking.objects.exists())
+
+    def test_checkouts_under_contention(self):
+        fragment_cache.clear()
+        create_concurrency_fixtures(8)
+        result = run_concurrently(writers=8, readers=2, operations=3)
+        self.assertEqual((result['lock_errors'], result['errors']), (0, 0))
+        self.assertEqual(Order.objects.count(), 24)
+        self.assertEqual(OrderItem.objects.count(), 72)
+
+
+class AuditQueriesTests(LittleLemonTestCase):
+    def test_every_route_is_requested_and_explained(self):
+        fixtures = seed_database(customers=3, crew=2, menu_items=20, orders=15, bookings=50)
+        requests, statements = audit_urls(fixtures)
+        self.assertEqual({request['status'] for request in requests if request['status'] >= 500}, set())
+        paths = {request['url'].split('?')[0] for request in requests}
+        self.assertEqual(len(paths), len({template for template, _ in get_routes()}))
+        self.assertTrue(all(statement['plan'] for statement in statements))
+        # The composite indexes cover the order lists by date
+        for statement in statements:
+            if 'ordering=-date' in ' '.join(statement['urls']) and 'ORDER BY' in statement['sql']:
+                self.assertNotIn('temp b-tree for order by', [problem for problem, _ in statement['problems']])
+
+    def test_suggests_equality_then_order_by_columns(self):
+        table = Cart._meta.db_table
+        statement = {
+            'sql': f'SELECT "{table}"."id", "{table}"."price" FROM "{table}" WHERE "{table}"."quantity" = 2 ORDER BY 2 DESC LIMIT 5',
+            'problems': [('full scan', table), ('temp b-tree for order by', None)],
+        }
+        self.assertEqual(suggest_index(statement, get_table_models()), (Cart, ['quantity', 'price']))
+        # Already covered by unique_together
+        statement['sql'] = f'SELECT "{table}"."id" FROM "{table}" WHERE "{table}"."user_id" = 2 ORDER BY "{table}"."menuitem_id"'
+        self.assertIsNone(suggest_index(statement, get_table_models()))
+
+        draft = migration_draft(suggest_indexes([{**statement, 'sql': statement['sql'].replace('user_id', 'quantity')}]))
+        compile(draft, 'draft.py', 'exec')
+        self.assertIn("models.Index(fields=['quantity', 'menuitem'], name='cart_quantity_menuitem_idx')", draft)
+
+
+class PerformanceMiddlewareTests(LittleLemonTestCase):
+    def test_server_timing_header(self):
+        self.login(self.customer)
+        timing = self.client.get('/api/menu-items').headers['Server-Timing']
+        # Token, catalogue page and the fragment of the one menu item
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="4 queries", serialize;dur=[\d.]+, cache;desc="0 hits, 3 misses", total;dur=[\d.]+$')
+        timing = self.client.get('/api/menu-items').headers['Server-Timing']
+        # Only the catalogue version is read
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="1 queries", cache;desc="2 hits, 0 misses"')
+        order = self.create_order(self.customer)
+        timing = self.client.get(f'/api/orders/{order.pk}').headers['Server-Timing']
+        self.assertRegex(timing, r'serialize;dur=[\d.]+, render;dur=[\d.]+')
+
+    def test_query_budget(self):
+        self.login(self.customer)
+        with mock.patch.object(views.MenuItemsView, 'query_budget', 1):
+            with self.assertRaisesMessage(QueryBudgetExceeded, "GET /api/menu-items (MenuItemsView) ran 4 queries, over its budget of 1"):
+                self.client.get('/api/menu-items')
+            cache.clear()
+            with override_settings(QUERY_BUDGET_ACTION='log'), self.assertLogs('LittleLemonAPI.instrumentation', 'WARNING'):
+                self.assertEqual(self.client.get('/api/menu-items').status_code, 200)
+
+    def test_repeated_statements_are_reported(self):
+        metrics = RequestMetrics()
+        execute = lambda sql, params, many, context: None
+        for pk in range(3):
+            metrics.record_query(execute, 'SELECT * FROM "auth_group" WHERE "id" = %s', (pk,), False, {})
+        metrics.record_query(execute, 'SELECT 1', (), False, {})
+        self.assertEqual(metrics.duplicates(), [('SELECT * FROM "auth_group" WHERE "id" = %s', 3)])
+        self.assertIn('db;dur=0.00;desc="4 queries", dup;desc="1 repeated statements"', metrics.server_timing())
+
+    def test_streamed_queries_count_towards_the_budget(self):
+        self.login(self.customer)
+        order = self.create_order(self.customer, total='25.00')
+        OrderItem.objects.create(order=order, menuitem=self.menuitem, quantity=2, unitprice='12.50', price='25.00')
+        response = self.client.get('/api/orders/export?format=csv')
+        self.assertRegex(response.headers['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries"')
+        with mock.patch.object(views.OrderExportView, 'query_budget', 1):
+            response = self.client.get('/api/orders/export?format=csv')
+            # The rows are read while the body is consumed
+            with self.assertRaisesMessage(QueryBudgetExceeded, "(OrderExportView) ran"):
+                b''.join(response.streaming_content)
+
+    def test_async_mode_counts_queries_of_other_threads(self):
+        def count_menu_items():
+            try:
+                return MenuItem.objects.count()
+            finally:
+                connection.close()
+
+        async def get_response(request):
+            # Another thread, with a database connection of its own
+            await sync_to_async(count_menu_items, thread_sensitive=False)()
+            return HttpResponse()
+
+        middleware = PerformanceMiddleware(get_response)
+        self.assertTrue(iscoroutinefunction(middleware))
+        self.assertTrue(iscoroutinefunction(middleware.process_template_response))
+        response = async_to_sync(middleware)(AsyncRequestFactory().get('/'))
+        self.assertRegex(response.headers['Server-Timing'], r'^db;dur=[\d.]+;desc="1 queries"')
+
+    @override_settings(PERFORMANCE_INSTRUMENTATION=False)
+    def test_disabled(self):
+        self.client = self.client_class()
+        self.assertNotIn('Server-Timing', self.client.get('/api/menu-items').headers)
+
+
+class SeedBenchTests(LittleLemonTestCase):
+    def test_seeded_volumes(self):
+        fixtures = seed_database(customers=20, crew=3, categories=8, menu_items=40, orders=300, bookings=500, batch_size=64)
+        self.assertEqual(Category.objects.exclude(pk=self.category.pk).count(), 8)
+        self.assertEqual(MenuItem.objects.filter(title__startswith='Dish ').count(), 40)
+        self.assertEqual(Order.objects.count(), 300)
+        self.assertEqual(Booking.objects.count(), 500)
+        self.assertEqual(fixtures['order'].user, fixtures['users']['customer'])
+        # Order totals add up and no slot is overbooked
+        totals = dict(OrderItem.objects.values_list('order').annotate(Sum('price')))
+        for order in Order.objects.all():
+            self.assertAlmostEqual(order.total, totals[order.pk], places=2)
+        for occupancy in SlotOccupancy.objects.all():
+            booked = Booking.objects.filter(reservation_date=occupancy.reservation_date, reservation_slot=occupancy.reservation_slot)
+            self.assertEqual(booked.aggregate(covers=Sum('guest_number'))['covers'], occupancy.covers)
+            self.assertLessEqual(occupancy.covers, settings.BOOKING_SLOT_COVERS[occupancy.reservation_slot])
+
+    def test_load_test_report(self):
+        fixtures = seed_database(customers=5, crew=2, menu_items=20, orders=50, bookings=20)
+        report = run_load_test(ClientTransport(), fixtures, requests=3, concurrency=1, writes=True, match='/api/orders')
+        self.assertEqual(report['rows']['LittleLemonAPI.Order'], 53)
+        results = {(result['method'], result['url'], result['role']): result for result in report['results']}
+        # The delivery crew cannot see the customer's order
+        self.assertNotIn(('GET', f'/api/orders/{fixtures["order"].pk}', 'delivery crew'), results)
+        checkout = results['POST', '/api/orders', 'writer']
+        self.assertEqual(checkout['statuses'], {'201': 3})
+        self.assertLessEqual(checkout['p50_ms'], checkout['p99_ms'])
+        self.assertEqual(results['GET', '/api/orders', 'customer']['errors'], 0)
+        self.assertIsNotNone(results['GET', '/api/orders', 'customer']['queries'])
@@ -0,0 +1,129 @@
+import os
+import sqlite3
+import threading
+import time
+from django.conf import settings
+from rest_framework.throttling import SimpleRateThrottle
+
+# Token buckets shared by every worker process on the host, one row per
+# scope and client. A check is a single UPSERT, so it is atomic without any
+# explicit locking and costs the same however many requests were made.
+CREATE_TABLE_SQL = '''
+    CREATE TABLE IF NOT EXISTS throttle_bucket (
+        key TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated REAL NOT NULL,
+        allowed INTEGER NOT NULL
+    ) WITHOUT ROWID
+'''
+
+# Refill the bucket for the time since the last request (capped at its
+# capacity), then take a token if there is a whole one. In the UPDATE, the
+# column names refer to the row as it was before the statement.
+TAKE_TOKEN_SQL = '''
+    INSERT INTO throttle_bucket (key, tokens, updated, allowed)
+    VALUES (:key, :capacity - 1, :now, 1)
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = MIN(:capacity, tokens + MAX(:now - updated, 0) * :rate)
+                 - (MIN(:capacity, tokens + MAX(:now - updated, 0) * :rate) >= 1),
+        allowed = MIN(:capacity, tokens + MAX(:now - updated, 0) * :rate) >= 1,
+        updated = MAX(:now, updated)
+    RETURNING allowed, tokens
+'''
+
+# A bucket left alone for longer than its duration is full again, the same
+# as no row at all, so it can be deleted. Every PRUNE_EVERY checks a
+# connection deletes the buckets idle for more than THROTTLE_BUCKET_MAX_AGE
+# seconds (a day, the longest DRF rate period), so the table only holds the
+# recent clients.
+PRUNE_SQL = 'DELETE FROM throttle_bucket WHERE updated < :before'
+PRUNE_EVERY = 1000
+
+_local = threading.local()
+
+
+def get_database_path():
+    return str(getattr(settings, 'THROTTLE_DATABASE', settings.BASE_DIR / 'throttle.sqlite3'))
+
+
+def get_connection():
+    # One connection per thread; a forked worker or a changed setting opens
+    # a new one
+    path = get_database_path()
+    owner = (os.getpid(), path)
+    if getattr(_local, 'owner', None) != owner:
+        connection = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(CREATE_TABLE_SQL)
+        _local.connection, _local.owner = connection, owner
+        _local.checks = 0
+    return _local.connection
+
+
+def take_token(key, capacity, rate):
+    # Returns (allowed, tokens left)
+    connection = get_connection()
+    now = time.time()
+    row = connection.execute(TAKE_TOKEN_SQL, {
+        'key': key, 'capacity': capacity, 'rate': rate, 'now': now,
+    }).fetchone()
+    _local.checks += 1
+    if _local.checks % PRUNE_EVERY == 0:
+        prune(now)
+    return bool(row[0]), row[1]
+
+
+def prune(now=None):
+    # Returns the number of buckets deleted
+    if now is None:
+        now = time.time()
+    max_age = getattr(settings, 'THROTTLE_BUCKET_MAX_AGE', 24 * 60 * 60)
+    return get_connection().execute(PRUNE_SQL, {'before': now - max_age}).rowcount
+
+
+def reset():
+    get_connection().execute('DELETE FROM throttle_bucket')
+
+
+class SharedRateThrottle(SimpleRateThrottle):
+    # Rate limits per client (user id, or IP address for anonymous requests)
+    # held in the shared bucket database. The scope is the view's
+    # throttle_scope, so views can have their own budgets, or else
+    # 'user'/'anon' as with DRF's UserRateThrottle/AnonRateThrottle.
+    # A bucket holds `num_requests` tokens and refills at num_requests/duration
+    # per second, so bursts up to the configured rate are allowed.
+
+    def __init__(self):
+        # The rate depends on the view, see allow_request()
+        pass
+
+    def get_scope(self, request, view):
+        scope = getattr(view, 'throttle_scope', None)
+        if scope:
+            return scope
+        return 'user' if request.user and request.user.is_authenticated else 'anon'
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def allow_request(self, request, view):
+        # Off for load tests (see manage.py loadtest)
+        if not getattr(settings, 'THROTTLE_ENABLED', True):
+            return True
+        self.scope = self.get_scope(request, view)
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        if self.rate is None:
+            return True
+
+        allowed, self.tokens = take_token(self.get_cache_key(request, view), self.num_requests, self.num_requests / self.duration)
+        return allowed
+
+    def wait(self):
+        # Seconds until a whole token has been refilled
+        return max(1 - self.tokens, 0) * self.duration / self.num_requests
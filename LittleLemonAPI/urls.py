@@ -1,15 +1,35 @@
+from django.conf import settings
 from django.urls import path
 from . import views
+from .async_views import AsyncCategoriesView, AsyncMenuItemsView, AsyncSingleMenuItemView, AsyncSingleOrderView, read_async
+
+
+def read_view(sync_view, async_view):
+    # With ASYNC_READ_VIEWS on, GET/HEAD requests are served by the async
+    # variant of the view
+    if getattr(settings, 'ASYNC_READ_VIEWS', False):
+        return read_async(sync_view.as_view(), async_view.as_view())
+    return sync_view.as_view()
+
 
 urlpatterns = [
-    path('categories', views.CategoriesView.as_view(), name='CategoriesView'),
-    path('menu-items', views.MenuItemsView.as_view(), name='MenuItemsView'),
-    path('menu-items/<int:pk>', views.SingleMenuItemView.as_view(), name='SingleMenuItemView'),
+    path('categories', read_view(views.CategoriesView, AsyncCategoriesView), name='CategoriesView'),
+    path('menu-items', read_view(views.MenuItemsView, AsyncMenuItemsView), name='MenuItemsView'),
+    path('menu-items/bulk', views.MenuItemBulkView.as_view(), name='MenuItemBulkView'),
+    path('menu-items/<int:pk>', read_view(views.SingleMenuItemView, AsyncSingleMenuItemView), name='SingleMenuItemView'),
     path('groups/manager/users', views.ManagerUsersView.as_view(), name='ManagerUsersView'),
     path('groups/manager/users/<int:pk>', views.SingleManagerUserView.as_view(), name='SingleManagerUserView'),
     path('groups/delivery-crew/users', views.DeliveryCrewUsersView.as_view(), name='DeliveryCrewUsersView'),
     path('groups/delivery-crew/users/<int:pk>', views.SingleDeliveryCrewUserView.as_view(), name='SingleDeliveryCrewUserView'),
     path('cart/menu-items', views.CartView.as_view(), name='CartView'),
+    path('cart/menu-items/bulk', views.CartBulkView.as_view(), name='CartBulkView'),
     path('orders', views.OrdersView.as_view(), name='OrdersView'),
-    path('orders/<int:pk>', views.SingeOrderView.as_view(), name='SingleOrderView')
+    path('orders/dispatch', views.OrderDispatchView.as_view(), name='OrderDispatchView'),
+    path('orders/export', views.OrderExportView.as_view(), name='OrderExportView'),
+    path('orders/<int:pk>', read_view(views.SingeOrderView, AsyncSingleOrderView), name='SingleOrderView'),
+    path('reports/sales', views.SalesReportView.as_view(), name='SalesReportView'),
+    path('reports/menu-items', views.MenuItemSalesReportView.as_view(), name='MenuItemSalesReportView'),
+    path('bookings', views.BookingsView.as_view(), name='BookingsView'),
+    path('bookings/availability', views.BookingAvailabilityView.as_view(), name='BookingAvailabilityView'),
+    path('cache/stats', views.CacheStatsView.as_view(), name='CacheStatsView'),
 ]
\ No newline at end of file
@@ -1,25 +1,46 @@
-from datetime import date
 from django.contrib.auth.models import Group, User
 from django.core.exceptions import ValidationError
-from django.shortcuts import get_object_or_404
-from rest_framework import generics, permissions, status, serializers
-from .models import MenuItem, Category, Cart, Order, OrderItem
-from .serializers import MenuItemSerializer, CategorySerializer, UserSerializer, CartSerializer, OrderSerializer, OrderItemSerializer
+from django.http import Http404, StreamingHttpResponse
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Sum
+from rest_framework import generics, permissions, status, serializers, filters
+from rest_framework.parsers import JSONParser, MultiPartParser
+from .models import MenuItem, Category, Cart, Order, OrderItem, Booking, DailySales, DailyMenuItemSales
+from .serializers import MenuItemSerializer, MenuItemImportSerializer, CategorySerializer, UserSerializer, CartSerializer, CartItemSerializer, OrderSerializer, OrderItemSerializer, OrderExportQuerySerializer, SalesReportQuerySerializer, MenuItemSalesQuerySerializer, BookingSerializer, BookingQuerySerializer
 from .permissions import IsManager, IsDeliveryCrew
+from .roles import is_manager, is_delivery_crew, is_customer
 from rest_framework.response import Response
-from .paginators import StandardResultsSetPagination
+from rest_framework.views import APIView
+from .paginators import StandardResultsSetPagination, BookingPagination
+from .renderers import CSVRenderer, NDJSONRenderer, StreamingXMLRenderer
+from .parsers import CSVParser, read_csv
+from .mixins import CatalogueCacheMixin, ValuesProjectionMixin
+from .search import FullTextSearchFilter
+from .authentication import token_cache
+from .fragments import fragment_cache
+from .dispatch import dispatcher
+from .writer import run_write
+from .instrumentation import timer
+from . import catalogue
 
 # Create your views here.
-class CategoriesView(generics.ListCreateAPIView):
+class CategoriesView(CatalogueCacheMixin, generics.ListCreateAPIView):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    query_budget = 4
 
-class MenuItemsView(generics.ListCreateAPIView):
+class MenuItemsView(CatalogueCacheMixin, ValuesProjectionMixin, generics.ListCreateAPIView):
     queryset = MenuItem.objects.all().order_by('id') # ordering is necessary for PageNumberPagination to work
     serializer_class = MenuItemSerializer
+    values_projection = True
+    fragment_cache = True
     pagination_class = StandardResultsSetPagination
-    search_fields = ['title', 'category__title']
+    filter_backends = [filters.OrderingFilter, FullTextSearchFilter]
+    search_fields = ['title', 'category__title'] # used when full-text search is unavailable
     ordering_fields = ['title', 'price']
+    throttle_scope = 'menu'
+    query_budget = 5
 
     def get_permissions(self):
         if self.request.method == 'GET':
@@ -31,9 +52,34 @@ class MenuItemsView(generics.ListCreateAPIView):
         else:
             return super().get_permissions()
 
+class MenuItemBulkView(APIView):
+    # Creates and updates many menu items at once from a JSON list, a CSV
+    # body or a CSV file upload (field `file`), all or nothing
+    permission_classes = [permissions.IsAuthenticated, IsManager]
+    parser_classes = [JSONParser, CSVParser, MultiPartParser]
+    max_rows = 5000
+
+    def post(self, request, *args, **kwargs):
+        rows = request.data
+        if 'file' in request.FILES:
+            rows = read_csv(request.FILES['file'])
+        serializer = MenuItemImportSerializer(data=rows, many=True, max_length=self.max_rows)
+        with transaction.atomic():
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            serializer.save()
+        # Bulk writes send no signals: drop the cached catalogue once for the
+        # whole batch (the search index follows through its triggers)
+        catalogue.bump_version()
+        return Response({
+            'created': [menuitem.id for menuitem in serializer.created],
+            'updated': [menuitem.id for menuitem in serializer.updated],
+        }, status=status.HTTP_201_CREATED)
+
 class SingleMenuItemView(generics.RetrieveUpdateDestroyAPIView):
     queryset = MenuItem.objects.all()
     serializer_class = MenuItemSerializer
+    query_budget = 5
 
     def get_permissions(self):
         if self.request.method == 'GET':
@@ -47,6 +93,7 @@ class GroupUsersView(generics.ListCreateAPIView):
     serializer_class = UserSerializer
     permission_classes = [IsManager]
     group_name = None  # This should be overridden in subclasses
+    query_budget = 6
 
     def get_queryset(self):
         if self.group_name is None:
@@ -107,21 +154,28 @@ class DeliveryCrewUsersView(GroupUsersView):
 class SingleDeliveryCrewUserView(SingleGroupUserView):
     group_name = 'Delivery crew'
 
-class CartView(generics.CreateAPIView, generics.ListAPIView, generics.DestroyAPIView):
+class CartView(ValuesProjectionMixin, generics.CreateAPIView, generics.ListAPIView, generics.DestroyAPIView):
     serializer_class = CartSerializer
+    values_projection = True
+    query_budget = 5
 
-    def perform_create(self, serializer):
-        menuitem_id = self.request.data.get('menuitem')
-        quantity = self.request.data.get('quantity')
+    def create(self, request, *args, **kwargs):
+        menuitem_id = request.data.get('menuitem')
+        quantity = request.data.get('quantity')
 
         if not menuitem_id or not quantity:
             raise serializers.ValidationError({'error': "menuitem and quantity are required"})
+        item = CartItemSerializer(data={'menuitem': menuitem_id, 'quantity': quantity})
+        item.is_valid(raise_exception=True)
 
-        menuitem = get_object_or_404(MenuItem, id=menuitem_id)
-        unitprice = menuitem.price
-        price = unitprice * int(quantity)
-
-        serializer.save(user=self.request.user, menuitem=menuitem, quantity=quantity, unitprice=unitprice, price=price) # will raise IntegrityError if the same menu item is added twice
+        # Adding a menu item that is already in the cart adds to its quantity
+        try:
+            cart, = run_write(Cart.objects.add_items, request.user, [(item.validated_data['menuitem'], item.validated_data['quantity'])])
+        except MenuItem.DoesNotExist:
+            raise Http404
+        except ValidationError as e:
+            return Response({'detail': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(CartSerializer(cart).data, status=status.HTTP_201_CREATED)
 
     def get_queryset(self):
         return Cart.objects.filter(user=self.request.user)
@@ -130,133 +184,128 @@ class CartView(generics.CreateAPIView, generics.ListAPIView, generics.DestroyAPI
         Cart.objects.filter(user=request.user).delete()
         return Response({'detail': "Cart items deleted successfully"}, status=status.HTTP_204_NO_CONTENT)
 
-class OrdersView(generics.ListCreateAPIView):
-    serializer_class = OrderSerializer
-    pagination_class = StandardResultsSetPagination
-    search_fields = ['user__username', 'delivery_crew__username']
-    ordering_fields = ['date', 'total']
-    
+class CartBulkView(APIView):
+    # Adds a list of {menuitem, quantity} to the cart with one statement
+    max_items = 500
+    query_budget = 6
+
+    def post(self, request, *args, **kwargs):
+        items = CartItemSerializer(data=request.data, many=True, max_length=self.max_items)
+        items.is_valid(raise_exception=True)
+        try:
+            carts = run_write(Cart.objects.add_items, request.user, [(item['menuitem'], item['quantity']) for item in items.validated_data])
+        except MenuItem.DoesNotExist as e:
+            return Response({'detail': [str(e)]}, status=status.HTTP_400_BAD_REQUEST)
+        except ValidationError as e:
+            return Response({'detail': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(CartSerializer(carts, many=True).data, status=status.HTTP_201_CREATED)
+
+class OrderScopeMixin:
+    # Orders the requesting user is allowed to see
     def get_queryset(self):
         user = self.request.user
-        groups = [group.name for group in user.groups.all()]
-        is_manager = 'Manager' in groups
-        is_delivery_crew = 'Delivery crew' in groups
-        if is_manager:
+        if is_manager(user):
             # Return orders belonging to all users
             return Order.objects.all()
-        elif is_delivery_crew:
+        elif is_delivery_crew(user):
             # Return orders that were assigned to delivery crew user
             return Order.objects.filter(delivery_crew=user)
         else:
             # Return customer's own orders only
             return Order.objects.filter(user=user)
+
+class OrdersView(OrderScopeMixin, ValuesProjectionMixin, generics.ListCreateAPIView):
+    serializer_class = OrderSerializer
+    values_projection = True
+    fragment_cache = True
+    pagination_class = StandardResultsSetPagination
+    search_fields = ['user__username', 'delivery_crew__username']
+    ordering_fields = ['date', 'total']
+    query_budget = 14
+
+    def get_throttles(self):
+        # Checkout has its own budget
+        self.throttle_scope = 'checkout' if self.request.method == 'POST' else None
+        return super().get_throttles()
     
     def post(self, request, *args, **kwargs):
         user = self.request.user
-        groups = [group.name for group in user.groups.all()]
-        is_manager = 'Manager' in groups
-        is_delivery_crew = 'Delivery crew' in groups
         # Check if user is customer
-        if not (is_manager or is_delivery_crew):
-            # Create order
-            order_data = {
-                'user': user.id,
-                'delivery_crew': None,
-                'status': 0,
-                'total': 0,
-                'date': date.today()
-            }
-            order_serializer = OrderSerializer(data=order_data)
-            if order_serializer.is_valid():
-                order = order_serializer.save()
-                # Get cart items related to customer
-                cart_items = Cart.objects.filter(user=user)
-                # Add each cart item to an order item
-                for cart_item in cart_items:
-                    order_item_data = {
-                        'order': order.id,
-                        'menuitem': cart_item.menuitem.id,
-                        'quantity': cart_item.quantity,
-                        'unitprice': cart_item.unitprice,
-                        'price': cart_item.price
-                    }
-                    order_item_serializer = OrderItemSerializer(data=order_item_data)
-                    if order_item_serializer.is_valid():
-                        order_item_serializer.save()
-                        order.total += cart_item.price
-                        order.save()
-                    else:
-                        return Response(order_item_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-                # Delete cart item
-                cart_items.delete()
-                return Response({'detail': "Order created successfully"}, status=status.HTTP_201_CREATED)
+        if is_customer(user):
+            # Create the order from the customer's cart in a single transaction
+            try:
+                order = run_write(Order.objects.create_from_cart, user)
+            except ValidationError as e:
+                return Response({'detail': e.messages}, status=status.HTTP_400_BAD_REQUEST)
+            return Response({'detail': "Order created successfully", 'order': order.id}, status=status.HTTP_201_CREATED)
         else:
             return Response({'detail': "Permission denied. Only customers can create orders"}, status=status.HTTP_403_FORBIDDEN)
 
-class SingeOrderView(generics.RetrieveUpdateDestroyAPIView):
+class OrderDispatchView(APIView):
+    # Assigns the oldest unassigned orders to the least loaded delivery crew
+    permission_classes = [IsManager]
+    max_batch_size = 500
+
+    def post(self, request, *args, **kwargs):
+        batch_size = serializers.IntegerField(min_value=1, max_value=self.max_batch_size)
+        try:
+            batch_size = batch_size.run_validation(request.data.get('batch_size', request.query_params.get('batch_size', 50)))
+        except serializers.ValidationError as e:
+            return Response({'batch_size': e.detail}, status=status.HTTP_400_BAD_REQUEST)
+        assignments = dispatcher.dispatch(batch_size)
+        return Response({'assigned': [{'order': order_id, 'delivery_crew': crew_id} for order_id, crew_id in assignments]})
+
+class SingeOrderView(OrderScopeMixin, generics.RetrieveUpdateDestroyAPIView):
     serializer_class = OrderSerializer
+    # Moving or deleting an order updates the sales rollups too
+    query_budget = 14
 
-    def get_queryset(self):
-        user = self.request.user
-        groups = [group.name for group in user.groups.all()]
-        is_manager = 'Manager' in groups
-        is_delivery_crew = 'Delivery crew' in groups
-        if is_manager:
-            return Order.objects.all()
-        elif is_delivery_crew:
-            return Order.objects.filter(delivery_crew=user)
-        else:
-            return Order.objects.filter(user=user)
-    
     def get(self, request, *args, **kwargs):
         order = self.get_object()
-        user = request.user
-        groups = [group.name for group in user.groups.all()]
-        is_customer = ('Manager' not in groups) and ('Delivery crew' not in groups)
 
         # check if the order belongs to the current user (for customers)
-        if is_customer and order.user != request.user:
+        if is_customer(request.user) and order.user_id != request.user.id:
             return Response({'detail': "Permission denied. This order does not belong to the current user"}, status=status.HTTP_403_FORBIDDEN)
         
         order_items = OrderItem.objects.filter(order=order)
-        serialized_order_items = OrderItemSerializer(order_items, many=True)
-        return Response(serialized_order_items.data)
+        with timer('serialize'):
+            data = OrderItemSerializer(order_items, many=True).data
+        return Response(data)
     
     def put(self, request, *args, **kwargs):
         order = self.get_object()
-        user = request.user
-        groups = [group.name for group in user.groups.all()]
-        is_manager = 'Manager' in groups
 
-        if not is_manager:
+        if not is_manager(request.user):
             return Response({'detail': "Permission denied. Only managers are allowed to make PUT requests."}, status=status.HTTP_403_FORBIDDEN)
         serializer = self.get_serializer(order, data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            self.save_order(serializer)
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     def patch(self, request, *args, **kwargs):
         order = self.get_object()
         user = request.user
-        groups = [group.name for group in user.groups.all()]
-        is_manager = 'Manager' in groups
-        is_delivery_crew = 'Delivery crew' in groups
+        manager = is_manager(user)
+        delivery_crew = is_delivery_crew(user)
 
         # Make sure the customer is either a manager or delivery crew
-        if not (is_manager or is_delivery_crew):
+        if not (manager or delivery_crew):
             return Response({'detail': "Permission denied. Customers are not allowed to edit orders."}, status=status.HTTP_403_FORBIDDEN)
 
         # Partially update the order
         # Delivery crew can only update the status of orders assigned to them
-        if is_delivery_crew:
-            if order.delivery_crew != request.user:
+        if delivery_crew:
+            if order.delivery_crew_id != user.id:
                 return Response({'detail': "Permission denied. This order is not assigned to the current delivery crew member."}, status=status.HTTP_403_FORBIDDEN)
             if 'status' in request.data:
                 status_value = request.data['status']
                 if not isinstance(status_value, bool):
                     return Response({'detail': "Invalid value for 'status'. Must be a boolean value."}, status=status.HTTP_400_BAD_REQUEST)
                 order.status = bool(status_value)
+                # The assigned crew member is the requesting user, whose roles
+                # save() re-checks without another lookup
+                order.delivery_crew = user
                 order.save()
 
                 serializer = self.get_serializer(order)
@@ -266,28 +315,161 @@ class SingeOrderView(generics.RetrieveUpdateDestroyAPIView):
         
 
         # Managers can edit other fields too
-        if is_manager:
+        if manager:
             serializer = self.get_serializer(order, data=request.data, partial=True)
             if serializer.is_valid():
                 try:
-                    serializer.save()
+                    self.save_order(serializer)
                 except ValidationError:
                     # assigned user is not in Delivery crew group
                     return Response({'detail': "User must belong to the 'Delivery crew' group"}, status=status.HTTP_400_BAD_REQUEST)
                 return Response(serializer.data)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    def save_order(self, serializer):
+        # A manager may change the date or total of an order, which moves its
+        # sales in the rollups
+        order = serializer.instance
+        before = Order(pk=order.pk, date=order.date, total=order.total)
+        with transaction.atomic():
+            serializer.save()
+            if (order.date, order.total) != (before.date, before.total):
+                Order.objects.move_sales(before, order)
+
     def delete(self, request, *args, **kwargs):
         # Custom logic for handling DELETE requests
         order = self.get_object()
-        user = request.user
-        groups = [group.name for group in user.groups.all()]
-        is_manager = 'Manager' in groups
 
         # Make sure the customer is a manager 
-        if not is_manager:
+        if not is_manager(request.user):
             return Response({'detail': "Permission denied. Only managers are allowed to delete orders."}, status=status.HTTP_403_FORBIDDEN)
 
-        # Your logic for deleting the order goes here
-        order.delete()
+        # The sales rollups are adjusted in the same transaction
+        Order.objects.delete_order(order)
         return Response({'detail': "Order deleted successfully"}, status=status.HTTP_204_NO_CONTENT)
+
+class OrderExportView(OrderScopeMixin, generics.GenericAPIView):
+    # Streams orders joined with their items as CSV (one row per item),
+    # NDJSON (one line per order) or XML (one element per order), reading the
+    # rows in chunks so memory stays flat whatever the size of the export
+    renderer_classes = [CSVRenderer, NDJSONRenderer, StreamingXMLRenderer]
+    chunk_size = 2000
+    query_budget = 4
+
+    def get(self, request, *args, **kwargs):
+        params = OrderExportQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        queryset = self.get_queryset()
+        if 'date_from' in params.validated_data:
+            queryset = queryset.filter(date__gte=params.validated_data['date_from'])
+        if 'date_to' in params.validated_data:
+            queryset = queryset.filter(date__lte=params.validated_data['date_to'])
+        if 'status' in params.validated_data:
+            queryset = queryset.filter(status=params.validated_data['status'] == '1')
+
+        rows = queryset.order_by('date', 'id', 'orderitem__id').values_list(
+            'id', 'user_id', 'delivery_crew_id', 'status', 'total', 'date',
+            'orderitem__menuitem_id', 'orderitem__quantity', 'orderitem__unitprice', 'orderitem__price',
+        ).iterator(chunk_size=self.chunk_size)
+
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(renderer.stream_orders(rows), content_type=f'{renderer.media_type}; charset={renderer.charset}')
+        response['Content-Disposition'] = f'attachment; filename="orders.{renderer.format}"'
+        return response
+
+# Sums of the rollups, formatted like the prices in the other responses
+money = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+class SalesReportView(APIView):
+    # Orders and revenue of every day from date_from to date_to, days
+    # without orders included, read from the daily rollup: a year's chart is
+    # 365 rows however many orders were taken
+    permission_classes = [IsManager]
+    query_budget = 3
+
+    def get(self, request, *args, **kwargs):
+        params = SalesReportQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        date_from, date_to = params.validated_data['date_from'], params.validated_data['date_to']
+        sales = {
+            day: (orders, revenue)
+            for day, orders, revenue in DailySales.objects.filter(date__range=(date_from, date_to)).values_list('date', 'orders', 'revenue')
+        }
+        days = [date_from + timedelta(days=n) for n in range((date_to - date_from).days + 1)]
+        rows = [(day, *sales.get(day, (0, 0))) for day in days]
+        return Response({
+            'date_from': date_from,
+            'date_to': date_to,
+            'orders': sum(orders for _, orders, _ in rows),
+            'revenue': money.to_representation(sum(revenue for _, _, revenue in rows)),
+            'days': [{'date': day, 'orders': orders, 'revenue': money.to_representation(revenue)} for day, orders, revenue in rows],
+        })
+
+class MenuItemSalesReportView(APIView):
+    # The best selling menu items from date_from to date_to, by revenue or
+    # units, summed from the per day and menu item rollup
+    permission_classes = [IsManager]
+    query_budget = 3
+
+    def get(self, request, *args, **kwargs):
+        params = MenuItemSalesQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        date_from, date_to = params.validated_data['date_from'], params.validated_data['date_to']
+        rows = DailyMenuItemSales.objects.filter(date__range=(date_from, date_to)).values(
+            'menuitem_id', 'menuitem__title',
+        ).annotate(total_units=Sum('units'), total_revenue=Sum('revenue')).order_by(
+            '-total_' + params.validated_data['ordering'], 'menuitem_id',
+        )[:params.validated_data['limit']]
+        return Response({
+            'date_from': date_from,
+            'date_to': date_to,
+            'menu_items': [
+                {'menuitem': row['menuitem_id'], 'title': row['menuitem__title'], 'units': row['total_units'], 'revenue': money.to_representation(row['total_revenue'])}
+                for row in rows
+            ],
+        })
+
+class BookingsView(generics.ListAPIView):
+    # Public, like the reservations page that reads it. Seeks on the
+    # (reservation_date, reservation_slot) index, so a page costs the same
+    # however many bookings were ever taken.
+    serializer_class = BookingSerializer
+    pagination_class = BookingPagination
+    permission_classes = []
+    filter_backends = []
+    ordering_fields = ['reservation_date', 'reservation_slot']
+    cursor_ordering = ['reservation_date', 'reservation_slot']
+    query_budget = 3
+
+    def get_queryset(self):
+        params = BookingQuerySerializer(data=self.request.query_params)
+        params.is_valid(raise_exception=True)
+        queryset = Booking.objects.only(*BookingSerializer.Meta.fields)
+        lookups = {
+            'date': 'reservation_date',
+            'date_from': 'reservation_date__gte',
+            'date_to': 'reservation_date__lte',
+            'slot': 'reservation_slot',
+        }
+        return queryset.filter(**{lookups[name]: value for name, value in params.validated_data.items()})
+
+class BookingAvailabilityView(APIView):
+    # Free covers per slot for one date, read from the occupancy counters
+    permission_classes = []
+
+    def get(self, request, *args, **kwargs):
+        params = BookingQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        if 'date' not in params.validated_data:
+            return Response({'detail': "The 'date' parameter is required"}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(Booking.objects.availability(params.validated_data['date']))
+
+class CacheStatsView(APIView):
+    permission_classes = [IsManager]
+
+    def get(self, request, *args, **kwargs):
+        return Response({
+            'catalogue': catalogue.get_stats(),
+            'auth': token_cache.get_stats(),
+            'fragments': fragment_cache.get_stats(),
+        })
@@ -0,0 +1,129 @@
+import queue
+import threading
+from concurrent import futures
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+# SQLite has a single writer however many connections ask. With WRITE_QUEUE
+# on, write transactions are handed to one thread per database instead of
+# every request thread queueing on the busy timeout, and whatever has piled
+# up while it was busy is committed in one transaction.
+
+
+class WriteQueueTimeout(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "The database is busy, please try again."
+    default_code = 'write_timeout'
+
+
+class WriteQueue:
+    # Jobs waiting when the writer gets to them (up to WRITE_QUEUE_BATCH) run
+    # in one transaction, each in its own savepoint, so a job that raises only
+    # rolls back its own changes. The futures are resolved after the commit.
+
+    def __init__(self, using):
+        self.using = using
+        self.jobs = queue.SimpleQueue()
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stats = dict.fromkeys(('jobs', 'batches', 'failed'), 0)
+
+    def submit(self, func, *args, **kwargs):
+        future = futures.Future()
+        self.jobs.put((future, func, args, kwargs))
+        with self.lock:
+            # A forked worker process starts its own thread
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name=f'write-queue-{self.using}', daemon=True)
+                self.thread.start()
+        return future
+
+    def stop(self):
+        # Lets the thread finish the queued jobs, close its connection and exit
+        with self.lock:
+            thread, self.thread = self.thread, None
+        if thread is not None and thread.is_alive():
+            self.jobs.put(None)
+            thread.join()
+
+    def run(self):
+        while True:
+            batch = [self.jobs.get()]
+            while batch[-1] is not None and len(batch) < getattr(settings, 'WRITE_QUEUE_BATCH', 32):
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = batch[-1] is None
+            # Jobs whose caller gave up before they started are dropped
+            batch = [job for job in batch if job is not None and job[0].set_running_or_notify_cancel()]
+            if batch:
+                self.commit(batch)
+            if stopping:
+                connections[self.using].close()
+                return
+
+    def commit(self, batch):
+        connections[self.using].close_if_unusable_or_obsolete()
+        results = []
+        try:
+            with transaction.atomic(using=self.using):
+                for future, func, args, kwargs in batch:
+                    try:
+                        with transaction.atomic(using=self.using):
+                            results.append((future, func(*args, **kwargs), None))
+                    except Exception as e:
+                        results.append((future, None, e))
+        except Exception as e:
+            # The commit itself failed, so none of the jobs happened
+            results = [(future, None, e) for future, *_ in batch]
+        with self.lock:
+            self.stats['jobs'] += len(batch)
+            self.stats['batches'] += 1
+            self.stats['failed'] += sum(error is not None for _, _, error in results)
+        for future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def get_queue(using=DEFAULT_DB_ALIAS):
+    with _queues_lock:
+        if using not in _queues:
+            _queues[using] = WriteQueue(using)
+        return _queues[using]
+
+
+def stop_queues():
+    with _queues_lock:
+        write_queues = list(_queues.values())
+    for write_queue in write_queues:
+        write_queue.stop()
+
+
+def run_write(func, *args, using=DEFAULT_DB_ALIAS, **kwargs):
+    # Calls func through the database's write queue when WRITE_QUEUE is on,
+    # and waits up to WRITE_QUEUE_TIMEOUT seconds for it. Otherwise, or when
+    # the caller is already inside a transaction (whose lock the writer would
+    # wait on), func runs right here.
+    if not getattr(settings, 'WRITE_QUEUE', False) or connections[using].in_atomic_block:
+        return func(*args, **kwargs)
+    future = get_queue(using).submit(func, *args, **kwargs)
+    try:
+        return future.result(timeout=getattr(settings, 'WRITE_QUEUE_TIMEOUT', 10))
+    except futures.TimeoutError:
+        if future.cancel():
+            raise WriteQueueTimeout()
+        # Already running, so it is about to finish
+        return future.result()
@@ -0,0 +1,125 @@
+import gzip
+import json
+import logging
+import posixpath
+from io import BytesIO
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, StaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Widths of the downscaled copies collectstatic makes of every JPEG
+RESPONSIVE_IMAGE_WIDTHS = getattr(settings, 'RESPONSIVE_IMAGE_WIDTHS', [480, 960, 1440])
+RESPONSIVE_IMAGE_QUALITY = 80
+
+# Text files that are worth sending compressed
+GZIP_EXTENSIONS = ('.css', '.js', '.svg', '.txt', '.json', '.ico')
+
+# Sizes and downscaled copies of the collected images, next to the manifest
+IMAGES_MANIFEST = 'images.json'
+
+
+def variant_name(name, width):
+    base, ext = posixpath.splitext(name)
+    return f'{base}-{width}w{ext}'
+
+
+class OptimizedStaticFilesStorage(ManifestStaticFilesStorage):
+    # ManifestStaticFilesStorage (content-hashed names, so the files can be
+    # cached for ever) that also writes, for collectstatic:
+    # - a gzipped copy (name.gz) of each hashed text file, for static_asset()
+    #   to send to clients that accept it
+    # - copies of each JPEG downscaled to RESPONSIVE_IMAGE_WIDTHS (if Pillow is
+    #   installed), hashed like the other files, for srcset()
+    # Until collectstatic has written the manifest, files are served under
+    # their own names, as with DEBUG on.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.images = self.load_images()
+
+    def load_images(self):
+        try:
+            with self.manifest_storage.open(IMAGES_MANIFEST) as f:
+                return json.loads(f.read().decode())
+        except FileNotFoundError:
+            return {}
+
+    def url(self, name, force=False):
+        if not self.hashed_files:
+            return StaticFilesStorage.url(self, name)
+        return super().url(name, force)
+
+    def srcset(self, name):
+        # "url 480w, url 960w, ..." for an <img>: the downscaled copies and
+        # the original. Empty when there are none, and with DEBUG on, where
+        # files are served from the app directories that do not have them.
+        image = self.images.get(name)
+        if not image or not image['variants'] or settings.DEBUG:
+            return ''
+        candidates = [(self.url(variant), width) for width, variant in image['variants']]
+        candidates.append((self.url(name), image['width']))
+        return ', '.join(f'{url} {width}w' for url, width in candidates)
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            yield from super().post_process(paths, dry_run, **options)
+            return
+        images = self.resize_images(paths)
+        # Hashes the downscaled copies along with the other files
+        yield from super().post_process(paths, dry_run, **options)
+        for hashed_name in set(self.hashed_files.values()):
+            if hashed_name.endswith(GZIP_EXTENSIONS):
+                self.compress(hashed_name)
+        self.save_images(images)
+
+    def resize_images(self, paths):
+        # Adds the downscaled copies to the collected paths
+        if Image is None:
+            logger.warning("Pillow is not installed, so images are not downscaled")
+            return {}
+        images = {}
+        for name in sorted(paths):
+            if not name.lower().endswith(('.jpg', '.jpeg')):
+                continue
+            storage, path = paths[name]
+            with storage.open(path) as f:
+                image = Image.open(f)
+                image.load()
+            variants = []
+            for width in sorted(RESPONSIVE_IMAGE_WIDTHS):
+                if width >= image.width:
+                    break
+                resized = image.resize((width, round(image.height * width / image.width)), Image.LANCZOS)
+                content = BytesIO()
+                resized.save(content, 'JPEG', quality=RESPONSIVE_IMAGE_QUALITY, optimize=True, progressive=True)
+                variant = variant_name(name, width)
+                if self.exists(variant):
+                    self.delete(variant)
+                self._save(variant, ContentFile(content.getvalue()))
+                paths[variant] = (self, variant)
+                variants.append((width, variant))
+            images[name] = {'width': image.width, 'variants': variants}
+        return images
+
+    def compress(self, name):
+        with self.open(name) as f:
+            content = f.read()
+        # mtime=0 so that collecting the same file gives the same bytes
+        compressed = gzip.compress(content, compresslevel=9, mtime=0)
+        if len(compressed) < len(content):
+            if self.exists(name + '.gz'):
+                self.delete(name + '.gz')
+            self._save(name + '.gz', ContentFile(compressed))
+
+    def save_images(self, images):
+        self.images = images
+        if self.manifest_storage.exists(IMAGES_MANIFEST):
+            self.manifest_storage.delete(IMAGES_MANIFEST)
+        self.manifest_storage._save(IMAGES_MANIFEST, ContentFile(json.dumps(images).encode()))
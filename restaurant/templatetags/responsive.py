@@ -0,0 +1,20 @@
+from django import template
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.utils.html import format_html
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_img(name, alt='', sizes='(min-width: 800px) 50vw, 100vw'):
+    # <img> of a static image with the srcset of its downscaled copies (see
+    # restaurant/storage.py), so browsers pick the smallest that is enough.
+    # Nothing for an image that was not collected.
+    try:
+        src = staticfiles_storage.url(name)
+    except ValueError:
+        return ''
+    srcset = getattr(staticfiles_storage, 'srcset', lambda name: '')(name)
+    if not srcset:
+        return format_html('<img src="{}" alt="{}" loading="lazy" />', src, alt)
+    return format_html('<img src="{}" srcset="{}" sizes="{}" alt="{}" loading="lazy" />', src, srcset, sizes, alt)
@@ -1,3 +1,186 @@
-from django.test import TestCase
+import gzip
+import re
+import shutil
+import tempfile
+import threading
+from datetime import date
+from unittest import mock, skipUnless
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from LittleLemonAPI import catalogue
+from LittleLemonAPI.models import Booking, Category, MenuItem, SlotOccupancy
+from .storage import Image
+from .views import static_asset
 
-# Create your tests here.
+
+class ReservationsPageTests(TestCase):
+    def test_page_does_not_inline_bookings(self):
+        Booking.objects.create(first_name='Ada', last_name='Lovelace', guest_number=2,
+                               reservation_date=date.today(), reservation_slot=19, comment='')
+        response = self.client.get('/reservations?date=2024-05-01')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, 'Lovelace')
+        self.assertContains(response, 'value="2024-05-01"')
+        # Errors of the API request, such as 429, are shown instead of an empty list
+        self.assertContains(response, 'id="bookings-error"')
+
+
+class BookingCapacityTests(TransactionTestCase):
+    def book(self, client, guests=4, slot=19):
+        return client.post('/book', {
+            'first_name': 'Ada', 'last_name': 'Lovelace', 'guest_number': guests,
+            'reservation_date': '2024-05-01', 'reservation_slot': slot, 'comment': 'Window seat',
+        })
+
+    def test_full_slot_rejects_booking(self):
+        with self.settings(BOOKING_SLOT_COVERS={19: 6}):
+            self.book(self.client)
+            response = self.book(self.client)
+            self.assertContains(response, 'Not enough free tables')
+            self.assertEqual(Booking.objects.count(), 1)
+            self.assertContains(self.book(self.client, slot=3), 'There is no reservation slot 3')
+
+            Booking.objects.get().delete()
+            self.assertEqual(self.book(self.client).status_code, 200)
+            self.assertEqual(Booking.objects.count(), 1)
+
+    def test_concurrent_bookings_never_overbook(self):
+        # 40 covers, 30 concurrent requests for 4 guests each: exactly 10 fit
+        errors = []
+
+        def book():
+            try:
+                self.book(Client())
+            except Exception as e:  # a failed request must not hide overbooking
+                errors.append(e)
+            finally:
+                connection.close()
+
+        with self.settings(BOOKING_SLOT_COVERS={19: 40}):
+            threads = [threading.Thread(target=book) for _ in range(30)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(Booking.objects.count(), 10)
+        self.assertEqual(SlotOccupancy.objects.get().covers, 40)
+
+
+class PageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(slug='mains', title='Mains')
+        self.item = MenuItem.objects.create(title='Pasta', price='12.50', featured=False, category=category,
+                                            description='Fresh egg pasta')
+
+    def test_menu_fragment_follows_catalogue_version(self):
+        with CaptureQueriesContext(connection) as context:
+            self.assertContains(self.client.get('/menu'), 'Pasta')
+        # The catalogue version, then only the columns the template shows
+        self.assertEqual(len(context.captured_queries), 2)
+        self.assertNotIn('description', context.captured_queries[1]['sql'])
+        with self.assertNumQueries(1):
+            self.assertContains(self.client.get('/menu'), 'Pasta')
+
+        self.item.title = 'Lasagne'
+        self.item.save()
+        response = self.client.get('/menu')
+        self.assertContains(response, 'Lasagne')
+        self.assertNotContains(response, 'Pasta')
+
+    def test_menu_item_is_looked_up_once(self):
+        with self.assertNumQueries(2):
+            self.assertContains(self.client.get(f'/menu/{self.item.pk}'), 'Fresh egg pasta')
+        with self.assertNumQueries(1):
+            self.assertContains(self.client.get(f'/menu/{self.item.pk}'), 'Fresh egg pasta')
+        self.assertEqual(self.client.get(f'/menu/{self.item.pk + 1}').status_code, 404)
+
+    def test_conditional_get(self):
+        response = self.client.get(f'/menu/{self.item.pk}')
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(f'/menu/{self.item.pk}', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.assertEqual(self.client.get(f'/menu/{self.item.pk}', HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self.assertNotEqual(self.client.get('/menu')['ETag'], etag)
+
+        MenuItem.objects.create(title='Soup', price='6.00', featured=False, category=self.item.category)
+        self.assertEqual(self.client.get(f'/menu/{self.item.pk}', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_no_conditional_response_without_a_version(self):
+        etag = self.client.get('/menu')['ETag']
+        with mock.patch.object(catalogue, 'get_state', return_value=(None, None)):
+            response = self.client.get('/menu', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_static_pages_are_cached_whole(self):
+        for path in ('/', '/about'):
+            response = self.client.get(path)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('max-age', response['Cache-Control'])
+            self.assertEqual(self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class StaticAssetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.static_root = tempfile.mkdtemp()
+        # enable()/disable() rather than enterClassContext(), which needs Python 3.11
+        cls.static_settings = override_settings(STATIC_ROOT=cls.static_root)
+        cls.static_settings.enable()
+        call_command('collectstatic', interactive=False, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.static_settings.disable()
+        super().tearDownClass()
+        shutil.rmtree(cls.static_root)
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, path, **headers):
+        return static_asset(RequestFactory().get('/static/' + path, **headers), path)
+
+    def test_hashed_gzipped_css(self):
+        name = staticfiles_storage.stored_name('css/style.css')
+        self.assertRegex(name, r'^css/style\.[0-9a-f]{12}\.css$')
+        self.assertContains(self.client.get('/'), f'/static/{name}')
+
+        response = self.get(name, HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertIn('immutable', response['Cache-Control'])
+        content = b''.join(response.streaming_content)
+        self.assertEqual(gzip.decompress(content), staticfiles_storage.open(name).read())
+        self.assertLess(len(content), staticfiles_storage.size(name) / 2)
+
+        response = self.get(name)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        # Unhashed names may change, so they are not cached for long
+        self.assertFalse(self.get('css/style.css').has_header('Cache-Control'))
+
+    @skipUnless(Image, "Pillow is not installed")
+    def test_responsive_images(self):
+        html = self.client.get('/').content.decode()
+        srcset = re.search(r'<img src="[^"]*/Grill\.[0-9a-f]{12}\.jpg" srcset="([^"]*)"', html).group(1)
+        candidates = [candidate.rsplit(' ', 1) for candidate in srcset.split(', ')]
+        self.assertEqual([width for _, width in candidates], ['480w', '960w', '1440w', '1592w'])
+        small = candidates[0][0].removeprefix('/static/')
+        self.assertLess(staticfiles_storage.size(small), staticfiles_storage.size(staticfiles_storage.stored_name('img/Grill.jpg')) / 4)
+        self.assertIn('immutable', self.get(small)['Cache-Control'])
+
+    def test_missing_image_is_left_out(self):
+        category = Category.objects.create(slug='mains', title='Mains')
+        item = MenuItem.objects.create(title='No photo', price='1.00', featured=False, category=category)
+        response = self.client.get(f'/menu/{item.pk}')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, '<img src="/static/img/menu_items')
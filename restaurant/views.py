@@ -1,38 +1,99 @@
-from django.shortcuts import render
+import os
+import re
+from datetime import date
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.shortcuts import get_object_or_404, render
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.functional import SimpleLazyObject
+from django.views import static
+from django.views.decorators.cache import cache_page
+from django.views.decorators.http import condition, conditional_page
 from .forms import BookingForm
+from LittleLemonAPI import catalogue
 from LittleLemonAPI.models import MenuItem, Booking
-from django.core import serializers
+from LittleLemonAPI.writer import WriteQueueTimeout, run_write
+
+# How long whole static pages and the menu fragments stay cached
+PAGE_CACHE_TIMEOUT = getattr(settings, 'PAGE_CACHE_TIMEOUT', 600)
+
+# Collected files with a content hash in their name (style.0123456789ab.css)
+# never change, so browsers may keep them for a year without asking again
+HASHED_NAME = re.compile(r'\.[0-9a-f]{12}\.\w+$')
+HASHED_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def catalogue_etag(request, pk=None):
+    # No ETag, and so no 304, while the version is unknown
+    version = catalogue.get_version(request)
+    return None if version is None else f'{version}-{pk}'
+
+def catalogue_last_modified(request, pk=None):
+    return catalogue.get_last_modified(request)
+
+# Menu pages answer If-None-Match/If-Modified-Since with 304 from the
+# catalogue version, read once per request from the row all processes share
+menu_condition = condition(etag_func=catalogue_etag, last_modified_func=catalogue_last_modified)
 
 
 # Create your views here.
+# Static pages are cached whole; the ETag is a hash of the cached content
+@conditional_page
+@cache_page(PAGE_CACHE_TIMEOUT)
 def home(request):
     return render(request, 'index.html')
 
+@conditional_page
+@cache_page(PAGE_CACHE_TIMEOUT)
 def about(request):
     return render(request, 'about.html')
 
-def menu(request):    
-    menu = MenuItem.objects.all()
-    return render(request, 'menu.html', {"menu": menu})
+@menu_condition
+def menu(request):
+    # The template caches the list under the catalogue version, so the
+    # query only runs when that fragment is missing
+    menu = MenuItem.objects.only('title', 'price')
+    return render(request, 'menu.html', {"menu": menu, "version": catalogue.get_version(request), "timeout": PAGE_CACHE_TIMEOUT})
 
+@menu_condition
 def display_menu_item(request, pk=None):
     if pk:
-        menu_item = MenuItem.objects.get(pk=pk)
+        # Looked up only if the template's fragment is not cached
+        menu_item = SimpleLazyObject(lambda: get_object_or_404(MenuItem, pk=pk))
     else:
         menu_item = ''
-    return render(request, "menu_item.html", {"menu_item": menu_item})
+    return render(request, "menu_item.html", {"menu_item": menu_item, "pk": pk, "version": catalogue.get_version(request), "timeout": PAGE_CACHE_TIMEOUT})
 
 def book(request):
     form = BookingForm()
     if request.method == 'POST':
         form = BookingForm(request.POST)
         if form.is_valid():
-            form.save()
-            print(form)
+            try:
+                run_write(Booking.objects.create_booking, **form.cleaned_data)
+            except ValidationError as e:
+                form.add_error(None, e)
+            except WriteQueueTimeout as e:
+                form.add_error(None, str(e.detail))
     context = {'form':form}
     return render(request, 'book.html', context)
 
 def reservations(request):
-    bookings = Booking.objects.all()
-    booking_json = serializers.serialize('json', bookings)
-    return render(request, 'bookings.html',{"bookings":booking_json})
+    # The page fetches the bookings of the selected day from /api/bookings
+    selected = request.GET.get('date') or date.today().isoformat()
+    return render(request, 'bookings.html', {"date": selected})
+
+def static_asset(request, path):
+    # Serves STATIC_ROOT when no web server in front does (SERVE_STATIC): the
+    # gzipped copy collectstatic made for clients that accept gzip, and
+    # hashed names with a far-future Cache-Control
+    name = path
+    if 'gzip' in request.headers.get('Accept-Encoding', '') and os.path.isfile(safe_join(settings.STATIC_ROOT, path + '.gz')):
+        # serve() sends the type of the file inside with Content-Encoding: gzip
+        name = path + '.gz'
+    response = static.serve(request, name, document_root=settings.STATIC_ROOT)
+    patch_vary_headers(response, ['Accept-Encoding'])
+    if HASHED_NAME.search(path):
+        patch_cache_control(response, public=True, max_age=HASHED_MAX_AGE, immutable=True)
+    return response